@@ -0,0 +1,294 @@
+'''Portal local de pruebas y banco de pruebas de rendimiento para logger.py.
+
+Uso:
+    python benchmark.py serve [--port 8443] [--latency 0.05] [--error-rate 0.1] [--logout-failure-rate 0.1]
+    python benchmark.py bench [--iterations 50] [--latency 0.05] [--json]
+    python benchmark.py load  [--clients 20] [--duration 10] [--async] [--latency 0.05] [--json]
+
+El portal simula /LoginServlet, /LogoutServlet y /EtecsaQueryServlet de secure.etecsa.net sobre HTTP
+(sin TLS), con latencia configurable, errores (todos los mensajes de error de EtecsaLogger) y respuestas
+logoutcallback. Los clientes de prueba no comprueban la conexión (_check_connection siempre devuelve None).
+'''
+import os, sys, json, random, tempfile, threading, subprocess, asyncio
+from time import sleep, perf_counter, monotonic
+from math import ceil
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+ruta_script = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ruta_script)
+import logger
+
+ERROR_MESSAGES = logger.EtecsaLogger._EtecsaLogger__error_messages
+
+class MockPortalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1  # Cabeceras y cuerpo en un único envío.
+
+    def log_message(self, *args):
+        pass
+
+    def __reply(self, body:str, status:int=200, headers:dict|None=None) -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if self.server.portal.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(data), self.server.portal.chunk_size):
+                chunk = data[start:start + self.server.portal.chunk_size]
+                self.wfile.write(b'%x\r\n%s\r\n'%(len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_GET(self):
+        portal = self.server.portal
+        portal.wait()
+        if self.path.split('?')[0] != '/':
+            self.__reply('', 302, {'Location': '/'})  # Como el portal con cualquier otra página.
+            return
+        self.__reply('<html><form action="/LoginServlet" method="post">'
+                     '<input type="hidden" name="CSRFHW" value="%s">'
+                     '<input type="hidden" name="wlanuserip" value="10.0.0.2"></form></html>'%uuid4().hex)
+
+    def do_POST(self):
+        portal = self.server.portal
+        length = int(self.headers.get('Content-Length', 0))
+        data = {key: value[0] for key, value in parse_qs(self.rfile.read(length).decode()).items()}
+        portal.wait()
+        path = self.path.split('?')[0]
+        if path == '/LoginServlet':
+            self.__reply(portal.login(data))
+        elif path == '/LogoutServlet':
+            self.__reply(portal.logout(data))
+        elif path == '/EtecsaQueryServlet':
+            self.__reply(portal.query(data))
+        else:
+            self.__reply('Not found', 404)
+
+class MockPortal():
+    '''Portal de ETECSA simulado.
+    latency:                Latencia añadida a cada respuesta, en segundos.
+    jitter:                 Variación aleatoria máxima de la latencia, en segundos.
+    error_rate:             Probabilidad de que un inicio de sesión responda con uno de los mensajes de error.
+    errors:                 Mensajes de error a usar (por defecto todos los de EtecsaLogger).
+    logout_failure_rate:    Probabilidad de responder logoutcallback('FAILURE').
+    left_time:              Tiempo restante que devuelve getLeftTime.
+    chunked:                Enviar las respuestas con Transfer-Encoding: chunked, en fragmentos de chunk_size bytes.
+    Las peticiones GET a cualquier ruta que no sea / se redirigen a /.
+    '''
+    def __init__(self, host:str='127.0.0.1', port:int=0, latency:float=0.0, jitter:float=0.0, error_rate:float=0.0,
+                 errors:list|None=None, logout_failure_rate:float=0.0, left_time:str='10:00:00', chunked:bool=False,
+                 chunk_size:int=16):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = errors if errors is not None else ERROR_MESSAGES
+        self.logout_failure_rate = logout_failure_rate
+        self.left_time = left_time
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), MockPortalHandler)
+        self.server.daemon_threads = True
+        self.server.portal = self
+
+    @property
+    def url(self) -> str:
+        return 'http://%s:%d'%self.server.server_address[:2]
+
+    def wait(self) -> None:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            sleep(delay)
+
+    def login(self, data:dict) -> str:
+        if random.random() < self.error_rate:
+            return '<html><script>alert("%s");</script></html>'%random.choice(self.errors)
+        attribute_uuid = uuid4().hex.upper()
+        with self.lock:
+            self.sessions[attribute_uuid] = data.get('username')
+        return '<html><script>var urlParam = "ATTRIBUTE_UUID=%s&CSRFHW=%s&loggerId=%s";</script></html>'%(attribute_uuid, uuid4().hex, uuid4().hex)
+
+    def logout(self, data:dict) -> str:
+        with self.lock:  # Como el portal real, solo se cierra la sesión si el usuario coincide con el que la abrió.
+            known = data.get('ATTRIBUTE_UUID') in self.sessions and self.sessions[data['ATTRIBUTE_UUID']] == data.get('username')
+            if known:
+                del self.sessions[data['ATTRIBUTE_UUID']]
+        if not known or random.random() < self.logout_failure_rate:
+            return "logoutcallback('FAILURE');"
+        return "logoutcallback('SUCCESS');"
+
+    def query(self, data:dict) -> str:
+        if data.get('op') != 'getLeftTime' or data.get('ATTRIBUTE_UUID') not in self.sessions:
+            return 'errorop'
+        return self.left_time
+
+    def start(self) -> 'MockPortal':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+def make_logger_class(portal_url:str, base:type=logger.EtecsaLogger, folder:str|None=None) -> type:
+    '''Crea una subclase de EtecsaLogger que usa el portal simulado y una carpeta de datos temporal propia, dentro de
+    folder si se indica. Quien la crea debe borrarla (logger_data_folder) o borrar folder al terminar.'''
+    data_folder = tempfile.mkdtemp(prefix='etecsa-bench-', dir=folder) + '/'
+    with open(data_folder + 'config.ini', 'w') as file:
+        file.write('[USERS]\nbench@nauta.com.cu = bench\n\n[CONFIG]\nchoose = bench@nauta.com.cu\n')
+    attributes = {'logger_data_folder': data_folder,
+                  'config_file': data_folder + 'config.ini',
+                  'accounts_file': data_folder + 'accounts.json',
+                  'HOST': portal_url}
+    if issubclass(base, logger.AsyncEtecsaLogger):
+        async def _check_connection(self, *args, **kwargs):
+            return None
+    else:
+        def _check_connection(self, *args, **kwargs):
+            return None
+    attributes['_check_connection'] = _check_connection
+    return type('Bench' + base.__name__, (base,), attributes)
+
+def percentiles(samples:list) -> dict:
+    '''Devuelve el número de muestras y los percentiles 50/90/99, el mínimo y el máximo, en milisegundos.'''
+    data = sorted(sample*1000 for sample in samples)
+    if not data:
+        return {'n': 0}
+    percentile = lambda p: data[max(0, ceil(p / 100 * len(data)) - 1)]
+    return {'n': len(data), 'min': data[0], 'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99), 'max': data[-1]}
+
+def format_stats(name:str, stats:dict) -> str:
+    if not stats.get('n'):
+        return '%-22s sin muestras'%name
+    return '%-22s n=%-5d mín %7.2f  p50 %7.2f  p90 %7.2f  p99 %7.2f  máx %7.2f ms'%(name, stats['n'], stats['min'], stats['p50'], stats['p90'], stats['p99'], stats['max'])
+
+def timed(function, *args, **kwargs) -> tuple:
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return perf_counter() - start, result
+
+def bench(portal:MockPortal, iterations:int, folder:str|None=None) -> dict:
+    '''Latencia de inicio y cierre de sesión en frío (logger y conexión nuevos) y en caliente (conexión reutilizada),
+    y tiempo de arranque de la línea de comandos.'''
+    samples = {'login_cold': [], 'logout_cold': [], 'login_warm': [], 'logout_warm': [], 'cli_startup': []}
+    Logger = make_logger_class(portal.url, folder=folder)
+    for _ in range(iterations):
+        client = Logger()
+        elapsed, status = timed(client.login, verbose=False)
+        if status == 0:
+            samples['login_cold'].append(elapsed)
+        client.close()
+        elapsed, status = timed(client.logout, verbose=False)
+        if status == 0:
+            samples['logout_cold'].append(elapsed)
+        client.close()
+    client = Logger()
+    for _ in range(iterations):
+        elapsed, status = timed(client.login, verbose=False)
+        if status == 0:
+            samples['login_warm'].append(elapsed)
+        elapsed, status = timed(client.logout, verbose=False)
+        if status == 0:
+            samples['logout_warm'].append(elapsed)
+    client.close()
+    for _ in range(max(1, iterations // 5)):
+        elapsed, _ = timed(subprocess.run, [sys.executable, os.path.join(ruta_script, 'logger.py'), 'h'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples['cli_startup'].append(elapsed)
+    return {name: percentiles(values) for name, values in samples.items()}
+
+def load(portal:MockPortal, clients:int, duration:float, use_async:bool=False, folder:str|None=None) -> dict:
+    '''Ejecuta clients clientes concurrentes que inician y cierran sesión sin pausa durante duration segundos.'''
+    logins, logouts, errors = [], [], [0]
+    deadline = monotonic() + duration
+    if use_async:
+        async def worker():
+            client = make_logger_class(portal.url, logger.AsyncEtecsaLogger, folder)()
+            while monotonic() < deadline:
+                start = perf_counter()
+                status = await client.login(verbose=False)
+                (logins.append(perf_counter() - start) if status == 0 else errors.__setitem__(0, errors[0] + 1))
+                start = perf_counter()
+                status = await client.logout(verbose=False)
+                (logouts.append(perf_counter() - start) if status == 0 else errors.__setitem__(0, errors[0] + 1))
+            await client.close()
+        async def run():
+            await asyncio.gather(*[worker() for _ in range(clients)])
+        asyncio.run(run())
+    else:
+        lock = threading.Lock()
+        def worker():
+            client = make_logger_class(portal.url, folder=folder)()
+            while monotonic() < deadline:
+                elapsed, status = timed(client.login, verbose=False)
+                with lock:
+                    logins.append(elapsed) if status == 0 else errors.__setitem__(0, errors[0] + 1)
+                elapsed, status = timed(client.logout, verbose=False)
+                with lock:
+                    logouts.append(elapsed) if status == 0 else errors.__setitem__(0, errors[0] + 1)
+            client.close()
+        threads = [threading.Thread(target=worker) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return {'clients': clients, 'duration': duration, 'async': use_async,
+            'operations_per_second': (len(logins) + len(logouts)) / duration, 'errors': errors[0],
+            'login': percentiles(logins), 'logout': percentiles(logouts)}
+
+def main():
+    parser = ArgumentParser(description='Portal simulado y banco de pruebas de rendimiento de logger.py.')
+    parser.add_argument('mode', choices=['serve', 'bench', 'load'])
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia del portal, en segundos.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Variación aleatoria de la latencia, en segundos.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probabilidad de error al iniciar sesión.')
+    parser.add_argument('--logout-failure-rate', type=float, default=0.0, help="Probabilidad de logoutcallback('FAILURE').")
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Usar AsyncEtecsaLogger en un único bucle de eventos.')
+    parser.add_argument('--json', action='store_true', help='Mostrar los resultados en formato JSON.')
+    args = parser.parse_args()
+
+    portal = MockPortal(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        logout_failure_rate=args.logout_failure_rate).start()
+    if args.mode == 'serve':
+        print('Portal simulado escuchando en %s (Ctrl-C para salir)'%portal.url)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    elif args.mode == 'bench':
+        with tempfile.TemporaryDirectory(prefix='etecsa-bench-') as folder:
+            results = bench(portal, args.iterations, folder)
+        if args.json:
+            print(json.dumps(results, indent=1))
+        else:
+            for name, stats in results.items():
+                print(format_stats(name, stats))
+    else:
+        with tempfile.TemporaryDirectory(prefix='etecsa-bench-') as folder:
+            results = load(portal, args.clients, args.duration, args.use_async, folder)
+        if args.json:
+            print(json.dumps(results, indent=1))
+        else:
+            print('%d clientes%s, %.1f s: %.1f operaciones/s, %d errores'%(results['clients'], ' (asyncio)' if results['async'] else '',
+                                                                         results['duration'], results['operations_per_second'], results['errors']))
+            print(format_stats('login', results['login']))
+            print(format_stats('logout', results['logout']))
+    portal.stop()
+
+if __name__ == '__main__':
+    main()
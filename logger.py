@@ -1,15 +1,161 @@
-import requests, os
-from time import sleep
+import os
+from importlib import import_module
+from time import sleep, monotonic, time, perf_counter
+import time as time_module
+import heapq
 from sys import argv
 from platform import system as platform_system
-from configparser import ConfigParser
-from yaml import safe_load, safe_dump
-from datetime import datetime
-from socket import socket, AF_INET, SOCK_RAW
+from configparser import ConfigParser, Error as ConfigError
+from datetime import datetime, timedelta
+import json
+from socket import socket, gethostbyname, getaddrinfo, SOCK_STREAM, AF_INET, SOCK_RAW, SOCK_DGRAM, IPPROTO_ICMP
 try:
-    from tqdm import tqdm
-except ModuleNotFoundError:
-    print('Módulo tqdm no encontrado. Ejecute "pip install tqdm" para obtenerlo.')
+    from socket import AF_UNIX
+except ImportError:  # Windows
+    AF_UNIX = None
+from select import select
+from shutil import get_terminal_size
+from threading import Lock, Event, Thread, current_thread, local
+from random import uniform
+from collections import deque, namedtuple
+import re
+import tempfile
+import atexit
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from io import StringIO
+from contextlib import redirect_stdout
+try:
+    import fcntl
+except ModuleNotFoundError:  # Windows
+    fcntl = None
+    import msvcrt
+import struct
+import zlib
+from math import ceil
+from urllib.parse import urlsplit, urljoin, urlencode
+
+class LazyModule():
+    '''Módulo que solo se importa la primera vez que se accede a uno de sus atributos. Así los comandos que no
+    hacen peticiones (t?, config, ...) no pagan el tiempo de importar requests, asyncio, etc.'''
+    def __init__(self, name:str):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute:str):
+        if self.__module is None:
+            with span('import ' + self.__name):
+                self.__module = import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+requests = LazyModule('requests')
+asyncio = LazyModule('asyncio')
+ssl = LazyModule('ssl')
+futures = LazyModule('concurrent.futures')
+
+class NullSpan():
+    '''Intervalo que no hace nada; es lo que devuelve span() cuando el trazado está desactivado.'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class TraceSpan():
+    def __init__(self, tracer:'Tracer', name:str, args:dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.id = next(self.tracer.ids)
+        self.parent = self.tracer.current.get()
+        self.token = self.tracer.current.set((self.id, self.parent[1] + 1 if self.parent else 0))
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        end = perf_counter()
+        self.tracer.current.reset(self.token)
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.start, end, self.id, self.parent, self.args)
+
+class Tracer():
+    '''Registro jerárquico de los tiempos de cada comando (importaciones, configuración, sesión, pruebas de conexión,
+    DNS, TLS, peticiones HTTP y escrituras de archivos).
+    format: 'jsonl' (una línea JSON por intervalo, anexadas al archivo) o 'chrome' (formato Trace Event de Chrome,
+            para ver los tiempos como gráfico de llamas en chrome://tracing o Perfetto).
+    '''
+    def __init__(self, file_route:str, format:str='jsonl'):
+        from itertools import count
+        from threading import get_ident
+        self.file_route = file_route
+        self.format = format
+        self.events = []
+        self.lock = Lock()
+        self.ids = count(1)
+        self.current = ContextVar('span', default=None)
+        self.origin = perf_counter()
+        self.origin_wall = time()
+        self.get_ident = get_ident
+
+    def span(self, name:str, args:dict) -> TraceSpan:
+        return TraceSpan(self, name, args)
+
+    def record(self, name:str, start:float, end:float, span_id:int, parent:tuple|None, args:dict) -> None:
+        with self.lock:
+            self.events.append({'id': span_id, 'parent': parent[0] if parent else None, 'depth': parent[1] + 1 if parent else 0,
+                                'name': name, 'start': start - self.origin, 'duration': end - start,
+                                'thread': self.get_ident(), 'args': args})
+
+    def flush(self) -> None:
+        '''Función encargada de escribir los intervalos registrados en el archivo de trazas.'''
+        with self.lock:
+            events, self.events = sorted(self.events, key=lambda event: event['start']), []
+        if not events:
+            return
+        os.makedirs(os.path.dirname(self.file_route) or '.', exist_ok=True)
+        if self.format == 'chrome':
+            trace = {'traceEvents': [{'name': event['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': event['thread'],
+                                      'ts': (self.origin_wall + event['start']) * 1e6, 'dur': event['duration'] * 1e6,
+                                      'args': event['args']} for event in events],
+                     'displayTimeUnit': 'ms'}
+            with open(self.file_route, 'w') as file:
+                json.dump(trace, file)
+        else:
+            with open(self.file_route, 'a') as file:
+                for event in events:
+                    event.update({'pid': os.getpid(), 'start_ms': round(event.pop('start') * 1000, 3),
+                                  'duration_ms': round(event.pop('duration') * 1000, 3), 'command': ' '.join(argv[1:])})
+                    file.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+tracer = None
+
+def span(name:str, **args):
+    '''Devuelve un contexto que registra el bloque como un intervalo de la traza, o uno vacío si no se está trazando.'''
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, args)
+
+def enable_tracing(file_route:str, format:str='jsonl') -> Tracer:
+    '''Función encargada de activar el trazado. La traza se escribe al terminar el proceso o al llamar disable_tracing().'''
+    global tracer
+    if tracer is None:
+        atexit.register(disable_tracing)
+    tracer = Tracer(file_route, format)
+    return tracer
+
+def disable_tracing() -> str|None:
+    '''Función encargada de desactivar el trazado y escribir la traza. Devuelve la ruta del archivo escrito.'''
+    global tracer
+    if tracer is None:
+        return None
+    current, tracer = tracer, None
+    current.flush()
+    return current.file_route
 
 def clear_screen():
     '''Limpiar pantalla.'''
@@ -17,27 +163,1543 @@ def clear_screen():
     os.system(clear_msg)
     return 0
 
-def ping(host:str, timeout:float=1.0):
-    sock = socket(AF_INET, SOCK_RAW, 1)
-    sock.settimeout(timeout)
+class ICMPProber():
+    '''Clase encargada de enviar peticiones ICMP echo numeradas a varios hosts desde un único socket.
+    Intenta abrir un socket SOCK_RAW y, si no hay permisos, usa un socket ICMP SOCK_DGRAM sin privilegios.
+    Cada respuesta se empareja con su petición por el número de secuencia y el host de origen, y los tiempos
+    de ida y vuelta (RTT) se guardan por host en un buffer circular de tamaño history.
+    '''
+    ECHO_REQUEST = 8
+    ECHO_REPLY = 0
+
+    def __init__(self, history:int=100):
+        try:
+            self.sock = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)
+            self.raw = True
+        except PermissionError:
+            self.sock = socket(AF_INET, SOCK_DGRAM, IPPROTO_ICMP)
+            self.raw = False
+        self.sock.setblocking(False)
+        self.identifier = os.getpid() & 0xffff
+        self.sequence = 0
+        self.history = history
+        self.stats = {}
+        self.lock = Lock()
+        self.async_lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        '''Función encargada de cerrar el socket.'''
+        self.sock.close()
+
+    @staticmethod
+    def checksum(data:bytes) -> int:
+        '''Función encargada de calcular la suma de verificación de internet (RFC 1071).'''
+        if len(data) % 2:
+            data += b'\x00'
+        total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+        total = (total >> 16) + (total & 0xffff)
+        total += total >> 16
+        return ~total & 0xffff
+
+    def __packet(self, sequence:int) -> bytes:
+        payload = b'etecsa-logger'.ljust(16, b'\x00')
+        header = struct.pack('!BBHHH', self.ECHO_REQUEST, 0, 0, self.identifier, sequence)
+        return struct.pack('!BBHHH', self.ECHO_REQUEST, 0, self.checksum(header + payload), self.identifier, sequence) + payload
+
+    def __parse_reply(self, data:bytes) -> int|None:
+        '''Devuelve el número de secuencia de una respuesta echo propia, o None si el paquete no es para nosotros.'''
+        if self.raw:
+            data = data[(data[0] & 0x0f) * 4:]  # Saltar la cabecera IP.
+        if len(data) < 8:
+            return None
+        type_, code, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+        if type_ != self.ECHO_REPLY or code != 0:
+            return None
+        if self.raw and identifier != self.identifier:  # Con SOCK_DGRAM el kernel reescribe el identificador.
+            return None
+        return sequence
+
+    def __record(self, host:str, rtt:float|None) -> None:
+        if host not in self.stats:
+            self.stats[host] = deque(maxlen=self.history)
+        self.stats[host].append(rtt)
+
+    def __send(self, hosts:list) -> dict:
+        '''Envía una petición echo a cada host. Devuelve {secuencia: (host, dirección, momento de envío)}.'''
+        pending = {}
+        for host in hosts:
+            self.sequence = (self.sequence + 1) & 0xffff
+            address = gethostbyname(host)
+            try:
+                self.sock.sendto(self.__packet(self.sequence), (address, 0))
+            except OSError:
+                continue
+            pending[self.sequence] = (host, address, monotonic())
+        return pending
+
+    def __match(self, data:bytes, source:str, pending:dict, results:dict) -> str|None:
+        '''Empareja una respuesta con su petición pendiente. Devuelve el host que respondió o None.'''
+        sequence = self.__parse_reply(data)
+        if sequence in pending and pending[sequence][1] == source:
+            host, _, sent = pending.pop(sequence)
+            results[host] = monotonic() - sent
+            return host
+        return None
+
+    def ping_many(self, hosts:list, timeout:float=1.0, until:str|None=None) -> dict:
+        '''Función encargada de enviar una petición echo a cada host y esperar las respuestas.
+        until:  Si se especifica un host, se deja de esperar en cuanto este responde.
+        Devuelve un diccionario {host: RTT en segundos o None si no hubo respuesta}.
+        '''
+        with self.lock:
+            results = {host: None for host in hosts}
+            pending = self.__send(hosts)
+            deadline = monotonic() + timeout
+            while pending:
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not select([self.sock], [], [], remaining)[0]:
+                    break
+                try:
+                    data, (source, _) = self.sock.recvfrom(1024)
+                except BlockingIOError:
+                    continue
+                host = self.__match(data, source, pending, results)
+                if host is not None and host == until:
+                    break
+            for host in hosts:
+                self.__record(host, results[host])
+            return results
+
+    async def async_ping_many(self, hosts:list, timeout:float=1.0, until:str|None=None) -> dict:
+        '''Versión asíncrona de ping_many(): espera las respuestas en el bucle de eventos, sin bloquearlo.'''
+        loop = asyncio.get_running_loop()
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        async with self.async_lock:
+            results = {host: None for host in hosts}
+            replies = asyncio.Queue()
+            def on_readable():
+                while True:
+                    try:
+                        data, (source, _) = self.sock.recvfrom(1024)
+                    except (BlockingIOError, InterruptedError):
+                        return
+                    replies.put_nowait((data, source))
+            pending = self.__send(hosts)
+            deadline = monotonic() + timeout
+            loop.add_reader(self.sock.fileno(), on_readable)
+            try:
+                while pending:
+                    try:
+                        data, source = await asyncio.wait_for(replies.get(), max(0, deadline - monotonic()))
+                    except asyncio.TimeoutError:
+                        break
+                    host = self.__match(data, source, pending, results)
+                    if host is not None and host == until:
+                        break
+            finally:
+                loop.remove_reader(self.sock.fileno())
+            for host in hosts:
+                self.__record(host, results[host])
+            return results
+
+    def ping(self, host:str, count:int=1, timeout:float=1.0, interval:float=1.0) -> list:
+        '''Función encargada de enviar count peticiones echo a un host, separadas por interval segundos.
+        Devuelve la lista de RTT (None para las peticiones perdidas).'''
+        rtts = []
+        for i in range(count):
+            start = monotonic()
+            rtts.append(self.ping_many([host], timeout)[host])
+            if i < count - 1:
+                sleep(max(0, interval - (monotonic() - start)))
+        return rtts
+
+    def statistics(self, host:str) -> dict:
+        '''Función encargada de calcular las estadísticas de las últimas peticiones a un host: enviados,
+        recibidos, pérdida (%), y RTT mínimo, promedio, percentiles 50/90/99 y máximo (en milisegundos).'''
+        samples = list(self.stats.get(host, []))
+        rtts = sorted(rtt*1000 for rtt in samples if rtt is not None)
+        data = {'sent': len(samples), 'received': len(rtts),
+                'loss': 100 * (len(samples) - len(rtts)) / len(samples) if samples else 0.0}
+        if rtts:
+            percentile = lambda p: rtts[max(0, ceil(p / 100 * len(rtts)) - 1)]
+            data.update({'min': rtts[0], 'avg': sum(rtts) / len(rtts), 'p50': percentile(50),
+                         'p90': percentile(90), 'p99': percentile(99), 'max': rtts[-1]})
+        return data
+
+def ping(host:str, timeout:float=1.0) -> int:
+    '''Función encargada de enviar una única petición echo a un host. Devuelve 0 si responde, 1 en caso contrario.'''
     try:
-        sock.connect((host, 0))
-    except Exception:
+        with ICMPProber(history=1) as prober:
+            return 0 if prober.ping_many([host], timeout)[host] is not None else 1
+    except OSError:
         return 1
-    sock.send(b'\x08\x00\xf7\xff\x00\x00\x00\x00')
+
+class DNSCache():
+    '''Caché de las direcciones resueltas de los hosts, compartida por las conexiones HTTP sincrónicas y asíncronas.
+    Las conexiones a un host con una dirección guardada se abren directamente a esa dirección (el certificado TLS se
+    sigue verificando con el nombre del host).'''
+    def __init__(self):
+        self.entries = {}
+        self.lock = Lock()
+
+    def resolve(self, host:str, port:int, ttl:float=300) -> str:
+        '''Función encargada de resolver el host y guardar la dirección durante ttl segundos. Lanza OSError si falla.'''
+        with span('dns', host=host):
+            address = getaddrinfo(host, port, type=SOCK_STREAM)[0][4][0]
+        with self.lock:
+            self.entries[host] = (address, monotonic() + ttl)
+        return address
+
+    def get(self, host:str) -> str|None:
+        '''Dirección guardada del host, o None si no hay o ya caducó.'''
+        with self.lock:
+            entry = self.entries.get(host)
+            if entry is None:
+                return None
+            if monotonic() >= entry[1]:
+                del self.entries[host]
+                return None
+            return entry[0]
+
+    def discard(self, host:str) -> None:
+        with self.lock:
+            self.entries.pop(host, None)
+
+dns_cache = DNSCache()
+
+class ResponseCapture():
+    '''Buffer circular en memoria con las últimas respuestas HTTP (del portal y de las consultas), con su estado,
+    cabeceras, tiempo de respuesta y cuerpo comprimido con zlib. Sirve para depurar cambios en el formato de las
+    páginas del portal sin escribir en disco en cada petición: solo se escribe un archivo (un zip con un índice JSON
+    y los cuerpos) al pedirlo con dump() o cuando una respuesta no se pudo interpretar (dump_on_error(), como mucho
+    una vez cada error_interval segundos). Compartido por las conexiones sincrónicas y asíncronas.
+    Las cookies y los identificadores de la sesión (ATTRIBUTE_UUID, CSRFHW, loggerId, JSESSIONID) se ocultan al
+    guardar cada respuesta, así no llegan a los archivos que se comparten para depurar.
+    '''
+    SECRET_HEADERS = {'cookie', 'set-cookie', 'authorization'}
+    SECRET_NAMES = rb'(?:ATTRIBUTE_UUID|CSRFHW|loggerId|JSESSIONID)'
+    SECRET_FIELDS = re.compile(rb'(?i)(' + SECRET_NAMES + rb'\s*=\s*["\']?)[^&"\'\s<>;]+')
+    INPUT_TAG = re.compile(rb'(?i)<input\b[^>]*>')
+    SECRET_INPUT = re.compile(rb'(?i)\bname\s*=\s*["\']?' + SECRET_NAMES + rb'(?![\w-])')
+    INPUT_VALUE = re.compile(rb'(?i)(\bvalue\s*=\s*)(?:"[^"]*"|\'[^\']*\'|[^\s"\'>]+)')
+    REDACTED = '<oculto>'
+
+    def __init__(self, size:int=32, max_body:int=262144, error_interval:float=300):
+        self.entries = deque(maxlen=size)
+        self.max_body = max_body
+        self.error_interval = error_interval
+        self.last_error_dump = None
+        self.lock = Lock()
+
+    def configure(self, size:int, max_body:int, error_interval:float) -> None:
+        with self.lock:
+            if size != self.entries.maxlen:
+                self.entries = deque(self.entries, maxlen=size)
+            self.max_body = max_body
+            self.error_interval = error_interval
+
+    def record(self, method:str, url:str, status:int|None, headers, body:bytes, elapsed:float, error:str|None=None) -> None:
+        '''Función encargada de guardar una respuesta (o, si status es None, el error de una petición fallida).
+        Se guardan como mucho max_body bytes del cuerpo.'''
+        body = self.redact((body or b'')[:self.max_body + 256])[:self.max_body]  # El margen cubre un valor cortado al final.
+        headers = {key: self.REDACTED if key.lower() in self.SECRET_HEADERS else value for key, value in dict(headers or {}).items()}
+        entry = {'time': time(), 'method': method, 'url': self.redact(url.encode()).decode(), 'status': status,
+                 'elapsed': round(elapsed, 6), 'headers': headers, 'size': len(body), 'error': error}
+        data = zlib.compress(body, 1)
+        with self.lock:
+            self.entries.append((entry, data))
+
+    @classmethod
+    def redact(cls, data:bytes) -> bytes:
+        '''Oculta los identificadores de la sesión en parámetros (ATTRIBUTE_UUID=...) y en las etiquetas <input> con
+        ese nombre, sin importar el orden de los atributos, las comillas ni los espacios.'''
+        def redact_input(match):
+            tag = match.group()
+            if not cls.SECRET_INPUT.search(tag):
+                return tag
+            return cls.INPUT_VALUE.sub(rb'\1"' + cls.REDACTED.encode() + rb'"', tag)
+        return cls.SECRET_FIELDS.sub(rb'\1' + cls.REDACTED.encode(), cls.INPUT_TAG.sub(redact_input, data))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def memory(self) -> int:
+        '''Bytes ocupados por los cuerpos comprimidos.'''
+        with self.lock:
+            return sum(len(data) for _, data in self.entries)
+
+    def __str__(self):
+        with self.lock:
+            entries = [entry for entry, _ in self.entries]
+        if not entries:
+            return 'No hay respuestas capturadas.'
+        lines = []
+        for entry in entries:
+            lines.append('%s %-4s %s -> %s (%.0f ms, %d bytes)'%(datetime.fromtimestamp(entry['time']).strftime('%H:%M:%S'),
+                         entry['method'], urlsplit(entry['url']).path, entry['status'] or entry['error'],
+                         entry['elapsed']*1000, entry['size']))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def file_route(folder:str) -> str:
+        return folder + 'capture-%s.zip'%datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    def dump(self, file_route:str, reason:str='demand') -> int:
+        '''Función encargada de escribir las respuestas capturadas en un archivo zip. Devuelve cuántas se escribieron.'''
+        import zipfile
+        from io import BytesIO
+        with self.lock:
+            entries = list(self.entries)
+        buffer = BytesIO()
+        index = []
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for number, (entry, data) in enumerate(entries, 1):
+                name = '%03d-%s-%s.html'%(number, entry['method'], os.path.basename(urlsplit(entry['url']).path) or 'index')
+                archive.writestr(name, zlib.decompress(data))
+                index.append(dict(entry, file=name))
+            archive.writestr('index.json', json.dumps({'reason': reason, 'time': time(), 'responses': index}, indent=1, ensure_ascii=False))
+        atomic_write(file_route, buffer.getvalue())
+        return len(entries)
+
+    def dump_on_error(self, folder:str, reason:str) -> str|None:
+        '''Función encargada de escribir la captura tras una respuesta que no se pudo interpretar, salvo que ya se
+        haya escrito otra hace menos de error_interval segundos. Devuelve la ruta del archivo o None.'''
+        now = monotonic()
+        with self.lock:
+            if not self.entries or (self.last_error_dump is not None and now - self.last_error_dump < self.error_interval):
+                return None
+            self.last_error_dump = now
+        file_route = self.file_route(folder)
+        try:
+            self.dump(file_route, reason)
+        except OSError:
+            return None
+        return file_route
+
+responses = ResponseCapture()
+
+class CapturedStream():
+    '''Cuerpo (de urllib3) de una respuesta leída en modo stream: guarda lo que se va leyendo y lo registra en la
+    captura al cerrar o liberar la respuesta, lo que pase primero.'''
+    def __init__(self, raw, method:str, url:str, status:int, headers, start:float):
+        self.raw = raw
+        self.request = (method, url, status, headers)
+        self.start = start
+        self.chunks = []
+        self.size = 0
+
+    def __keep(self, data:bytes) -> None:
+        if self.chunks is not None and self.size < responses.max_body:
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def __finish(self) -> None:
+        if self.chunks is not None:
+            method, url, status, headers = self.request
+            responses.record(method, url, status, headers, b''.join(self.chunks), perf_counter() - self.start)
+            self.chunks = None
+
+    def stream(self, *args, **kwargs):
+        for chunk in self.raw.stream(*args, **kwargs):
+            self.__keep(chunk)
+            yield chunk
+
+    def read(self, *args, **kwargs) -> bytes:
+        data = self.raw.read(*args, **kwargs)
+        self.__keep(data)
+        return data
+
+    def close(self) -> None:
+        self.__finish()
+        self.raw.close()
+
+    def release_conn(self) -> None:
+        self.__finish()
+        self.raw.release_conn()
+
+    def __getattr__(self, attribute:str):
+        return getattr(self.raw, attribute)
+
+class TrafficSampler():
+    '''Muestreador del tráfico de red de la sesión. Un hilo en segundo plano lee cada interval segundos los bytes
+    recibidos y enviados de /proc/net/dev (de todas las interfaces menos lo, o solo de interface) y guarda los totales
+    acumulados en un buffer circular de size muestras, del que salen el caudal actual, el promedio y el máximo.
+    Los totales suman solo los incrementos de los contadores, así que no dependen del tamaño del buffer y una interfaz
+    que se reinicia no resta bytes. Solo está disponible en Linux.
+    '''
+    DEV_FILE = '/proc/net/dev'
+    BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+    def __init__(self, interval:float=1.0, size:int=300, interface:str|None=None, window:float=5.0):
+        self.interval = interval
+        self.interface = interface
+        self.window = window
+        self.samples = deque(maxlen=size)
+        self.lock = Lock()
+        self.stop_event = None  # Cada hilo tiene su propio evento, así un stop() seguido de start() no deja dos vivos.
+        self.thread = None
+        self.reset()
+
+    @classmethod
+    def available(cls) -> bool:
+        return os.access(cls.DEV_FILE, os.R_OK)
+
+    @classmethod
+    def boot_id(cls) -> str|None:
+        '''Identificador del arranque actual del sistema, para saber si los contadores se reiniciaron.'''
+        try:
+            with open(cls.BOOT_ID_FILE, 'r') as file:
+                return file.read().strip()
+        except OSError:
+            return None
+
+    def read_counters(self) -> tuple|None:
+        '''Tupla (bytes recibidos, bytes enviados) de las interfaces, o None si no se pueden leer.'''
+        try:
+            with open(self.DEV_FILE, 'rb') as file:
+                lines = file.read().splitlines()[2:]
+        except OSError:
+            return None
+        received, sent = 0, 0
+        for line in lines:
+            name, _, fields = line.partition(b':')
+            name = name.strip().decode()
+            if (name != self.interface) if self.interface else (name == 'lo'):
+                continue
+            fields = fields.split()
+            received += int(fields[0])
+            sent += int(fields[8])
+        return received, sent
+
+    def reset(self) -> None:
+        with self.lock:
+            self.samples.clear()
+            self.rx_total, self.tx_total = 0, 0
+            self.rx_peak, self.tx_peak = 0.0, 0.0
+            self.started = None
+            self.last = None
+
+    def sample(self) -> None:
+        '''Función encargada de tomar una muestra de los contadores.'''
+        counters = self.read_counters()
+        if counters is None:
+            return
+        now = monotonic()
+        with self.lock:
+            if self.last is None:
+                self.started = now
+            else:
+                received, sent = max(0, counters[0] - self.last[1]), max(0, counters[1] - self.last[2])
+                self.rx_total += received
+                self.tx_total += sent
+                elapsed = now - self.last[0]
+                if elapsed > 0:
+                    self.rx_peak = max(self.rx_peak, received / elapsed)
+                    self.tx_peak = max(self.tx_peak, sent / elapsed)
+            self.last = (now, counters[0], counters[1])
+            self.samples.append((now, self.rx_total, self.tx_total))
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self) -> bool:
+        '''Función encargada de empezar a muestrear desde cero. Devuelve False si no hay contadores que leer.'''
+        if self.running:
+            return True
+        if not self.available():
+            return False
+        self.reset()
+        self.sample()
+        self.stop_event = Event()
+        self.thread = Thread(target=self.__run, args=(self.stop_event,), name='traffic-sampler', daemon=True)
+        self.thread.start()
+        return True
+
+    def __run(self, stop_event:Event) -> None:
+        while not stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        '''Función encargada de detener el muestreo y esperar a que termine el hilo (que puede estar tomando una muestra).'''
+        thread, self.thread = self.thread, None
+        if self.stop_event is not None:
+            self.stop_event.set()
+        if thread is not None and thread is not current_thread():
+            thread.join()
+
+    def summary(self) -> dict|None:
+        '''Resumen del tráfico desde que empezó el muestreo (bytes, y caudales en bytes por segundo), o None si aún no
+        hay dos muestras.'''
+        with self.lock:
+            if len(self.samples) < 2:
+                return None
+            now, received, sent = self.samples[-1]
+            for base in reversed(self.samples):
+                if now - base[0] >= self.window:
+                    break
+            elapsed, window = now - self.started, now - base[0]
+            return {'seconds': round(elapsed, 1), 'rx_bytes': received, 'tx_bytes': sent,
+                    'rx_avg': received / elapsed if elapsed else 0.0, 'tx_avg': sent / elapsed if elapsed else 0.0,
+                    'rx_rate': (received - base[1]) / window if window else 0.0, 'tx_rate': (sent - base[2]) / window if window else 0.0,
+                    'rx_peak': self.rx_peak, 'tx_peak': self.tx_peak}
+
+    @staticmethod
+    def format_bytes(amount:float, suffix:str='B') -> str:
+        for unit in ['', 'K', 'M', 'G']:
+            if amount < 1024 or unit == 'G':
+                return '%.1f %s%s'%(amount, unit, suffix)
+            amount /= 1024
+
+    @classmethod
+    def format_summary(cls, summary:dict) -> str:
+        rate = lambda value: cls.format_bytes(value, 'B/s') if value is not None else '?'
+        return ('recibido {rx} (actual {rx_rate}, promedio {rx_avg}, máx. {rx_peak}), '
+                'enviado {tx} (actual {tx_rate}, promedio {tx_avg}, máx. {tx_peak})').format(
+                    rx=cls.format_bytes(summary['rx_bytes']), tx=cls.format_bytes(summary['tx_bytes']),
+                    **{key: rate(summary.get(key)) for key in ['rx_rate', 'tx_rate', 'rx_avg', 'tx_avg', 'rx_peak', 'tx_peak']})
+
+def time_to_seconds(time_:str) -> int|None:
+    '''Función encargada de convertir un tiempo con formato 'hora:minuto:segundo' a segundos. Devuelve None si el formato es inválido.'''
     try:
-        r = sock.recv(1024)
-    except TimeoutError:
-        return 1
-    sock.close()
-    if r:
-        return 0
-    return 1
+        hours, minutes, seconds = map(int, time_.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    return hours*3600 + minutes*60 + seconds
+
+def seconds_to_time(seconds:float) -> str:
+    '''Función encargada de convertir una cantidad de segundos a formato 'hora:minuto:segundo'.'''
+    seconds = int(seconds)
+    return '%.2d:%.2d:%.2d'%(seconds//3600, (seconds%3600)//60, seconds%60)
+
+def atomic_write(file_route:str, data:str|bytes) -> None:
+    '''Función encargada de reemplazar el contenido de un archivo de forma atómica: se escribe un archivo temporal en
+    la misma carpeta y luego se renombra sobre el original, así ningún lector ve el archivo a medio escribir.'''
+    with span('write ' + os.path.basename(file_route)):
+        _atomic_write(file_route, data)
+
+def _atomic_write(file_route:str, data:str|bytes) -> None:
+    folder = os.path.dirname(file_route) or '.'
+    os.makedirs(folder, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=folder, prefix='.' + os.path.basename(file_route) + '.')
+    try:
+        with os.fdopen(descriptor, 'wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, file_route)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+class PrefixIndex():
+    '''Índice de prefijos (trie) sobre un conjunto de claves. Cada nodo guarda cuántas claves hay debajo de él y una
+    de ellas, así que saber si un prefijo es exacto o corresponde a una sola clave cuesta lo que su largo, sin
+    importar cuántas claves haya.
+    '''
+    class Node():
+        __slots__ = ('children', 'count', 'key', 'end')
+        def __init__(self):
+            self.children = {}
+            self.count = 0
+            self.key = None
+            self.end = False
+
+    def __init__(self, keys=()):
+        self.root = self.Node()
+        for key in keys:
+            self.add(key)
+
+    def __find(self, prefix:str) -> 'PrefixIndex.Node|None':
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, key:str) -> bool:
+        node = self.__find(key)
+        return node is not None and node.end
+
+    def __len__(self) -> int:
+        return self.root.count
+
+    def add(self, key:str) -> None:
+        if key in self:
+            return
+        node = self.root
+        node.count += 1
+        node.key = key
+        for char in key:
+            node = node.children.setdefault(char, self.Node())
+            node.count += 1
+            node.key = key
+        node.end = True
+
+    def resolve(self, prefix:str) -> str|None:
+        '''Devuelve la clave igual a prefix o, si no existe, la única que empieza por prefix. None si no hay ninguna o
+        si hay varias.'''
+        node = self.__find(prefix)
+        if node is None:
+            return None
+        if node.end:
+            return prefix
+        return node.key if node.count == 1 else None
+
+    def complete(self, prefix:str) -> list:
+        '''Claves que empiezan por prefix, en orden alfabético.'''
+        node = self.__find(prefix)
+        keys = []
+        stack = [(node, prefix)] if node is not None else []
+        while stack:
+            node, key = stack.pop()
+            if node.end:
+                keys.append(key)
+            stack.extend((child, key + char) for char, child in sorted(node.children.items(), reverse=True))
+        return keys
+
+class FileLock():
+    '''Bloqueo consultivo entre procesos sobre un archivo .lock (flock en POSIX, msvcrt.locking en Windows).
+    exclusive:  Bloqueo exclusivo (escritura) o compartido (lectura). En Windows siempre es exclusivo.'''
+    def __init__(self, file_route:str, exclusive:bool=True):
+        self.file_route = file_route
+        self.exclusive = exclusive
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.file_route) or '.', exist_ok=True)
+        self.file = open(self.file_route, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+
+class SessionStore():
+    '''Clase encargada de leer y escribir el archivo de sesión de forma segura entre varios procesos (la línea de
+    comandos, el modo interactivo, un demonio, ...). Las escrituras son atómicas y se hacen bajo un bloqueo
+    exclusivo, las lecturas bajo un bloqueo compartido, y el contenido se guarda en memoria mientras el tamaño y la
+    fecha de modificación del archivo no cambien, así que leerlo de nuevo solo cuesta una llamada a stat().
+    '''
+    def __init__(self, file_route:str):
+        self.file_route = file_route
+        self.lock_route = file_route + '.lock'
+        self._cache = None
+        self._signature = None
+
+    def __signature(self) -> tuple|None:
+        try:
+            stat = os.stat(self.file_route)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def load(self) -> dict|None:
+        '''Función encargada de devolver los datos de sesión guardados, o None si no existe el archivo.
+        Lanza ValueError si el archivo no es JSON válido.'''
+        signature = self.__signature()
+        if signature is None:
+            return None
+        if signature == self._signature:
+            return self._cache.copy()
+        with FileLock(self.lock_route, exclusive=False):
+            signature = self.__signature()
+            try:
+                with open(self.file_route, 'r') as file:
+                    content = json.load(file)
+            except FileNotFoundError:
+                return None
+        self._cache, self._signature = content, signature
+        return content.copy()
+
+    def save(self, data:dict) -> None:
+        '''Función encargada de reemplazar los datos de sesión guardados.'''
+        with FileLock(self.lock_route):
+            atomic_write(self.file_route, json.dumps(data, separators=(',', ':')))
+            self._cache, self._signature = data.copy(), self.__signature()
+
+    def update(self, function) -> dict:
+        '''Función encargada de leer, modificar y guardar los datos bajo un mismo bloqueo exclusivo, así no se pierden
+        los cambios que otro proceso haga entre la lectura y la escritura. function recibe los datos guardados (None si
+        no existen o no son válidos) y devuelve los nuevos. Devuelve los datos guardados.'''
+        with FileLock(self.lock_route):
+            try:
+                with open(self.file_route, 'r') as file:
+                    content = json.load(file)
+            except (FileNotFoundError, ValueError):
+                content = None
+            data = function(content)
+            atomic_write(self.file_route, json.dumps(data, separators=(',', ':')))
+            self._cache, self._signature = data.copy(), self.__signature()
+        return data.copy()
+
+class AccountPool():
+    '''Clase encargada de llevar el estado de cada una de las cuentas de la sección [USERS]: tiempo restante conocido,
+    último error y hasta cuándo está bloqueada. Todo el estado se guarda en un único archivo JSON indexado por usuario,
+    que se lee en cada consulta y se actualiza cuenta por cuenta bajo su bloqueo (SessionStore.update), así no se
+    pierden los cambios de otros procesos que usan las mismas cuentas.
+    '''
+    domains = {'internet': '@nauta.com.cu', 'intranet': '@nauta.co.cu'}
+    EMPTY = {'left_time': None, 'updated': None, 'blocked_until': None, 'last_error': None}
+
+    def __init__(self, file_route:str, users:list, cooldown:float=1800):
+        self.file_route = file_route
+        self.users = users
+        self.cooldown = cooldown
+        self.store = SessionStore(file_route)
+
+    @property
+    def accounts(self) -> dict:
+        '''Estado de las cuentas de users. Solo cuesta un stat() si el archivo no cambió desde la última lectura.'''
+        try:
+            stored = self.store.load() or {}
+        except ValueError:
+            stored = {}
+        return {user: stored.get(user, self.EMPTY) for user in self.users}
+
+    def update(self, username:str, left_time:int|None=None, error:str|None=None, block:bool=False) -> None:
+        '''Función encargada de actualizar el estado de una cuenta y guardarlo.
+        left_time:  Tiempo restante en segundos (si se conoce).
+        error:      Mensaje de error devuelto por el servidor.
+        block:      Bloquear la cuenta durante cooldown segundos.
+        '''
+        if username not in self.users:
+            return
+        now = datetime.now()
+        def change(stored):
+            stored = stored if isinstance(stored, dict) else {}
+            account = dict(stored.get(username, self.EMPTY))
+            if left_time is not None:
+                account['left_time'] = left_time
+                account['updated'] = now.isoformat(timespec='seconds')
+            account['last_error'] = error
+            account['blocked_until'] = (now + timedelta(seconds=self.cooldown)).isoformat(timespec='seconds') if block else None
+            stored[username] = account
+            return stored
+        self.store.update(change)
+
+    @staticmethod
+    def __blocked(account:dict) -> bool:
+        return account['blocked_until'] is not None and datetime.fromisoformat(account['blocked_until']) > datetime.now()
+
+    def __left_time(self, account:dict) -> int|None:
+        if account['left_time'] == 0 and (account['updated'] is None or
+                                          datetime.fromisoformat(account['updated']) + timedelta(seconds=self.cooldown) <= datetime.now()):
+            return None
+        return account['left_time']
+
+    def is_blocked(self, username:str) -> bool:
+        return self.__blocked(self.accounts[username])
+
+    def known_left_time(self, username:str) -> int|None:
+        '''Tiempo restante conocido de la cuenta. Un saldo agotado caduca a los cooldown segundos (como los bloqueos),
+        porque la cuenta pudo recargarse; a partir de ahí se considera desconocido.'''
+        return self.__left_time(self.accounts[username])
+
+    def candidates(self, connection_type:str='internet') -> list:
+        '''Función encargada de devolver las cuentas disponibles para el tipo de conexión pedido, ordenadas de mayor
+        a menor tiempo restante. Las cuentas sin datos van después de las que tienen saldo conocido, y las cuentas sin
+        saldo o bloqueadas se excluyen.'''
+        domain = self.domains[connection_type]
+        accounts = {user: account for user, account in self.accounts.items() if user.endswith(domain)}
+        left_times = {user: self.__left_time(account) for user, account in accounts.items()}
+        available = [user for user, left_time in left_times.items() if left_time != 0 and not self.__blocked(accounts[user])]
+        return sorted(available, key=lambda user: (left_times[user] is not None, left_times[user] or 0), reverse=True)
+
+    def __str__(self):
+        lines = []
+        for user, account in self.accounts.items():
+            left_time = account['left_time']
+            left_time = '??:??:??' if left_time is None else '%.2d:%.2d:%.2d'%(left_time//3600, (left_time%3600)//60, left_time%60)
+            state = 'bloqueada hasta %s'%account['blocked_until'] if self.__blocked(account) else (account['last_error'] or 'ok')
+            lines.append('%s  %s  (%s)'%(user.ljust(32), left_time, state))
+        return '\n'.join(lines)
+
+class CircuitBreaker():
+    '''Interruptores de circuito de los inicios de sesión, uno por cuenta (los errores que los abren, estado anormal y
+    muchos intentos, son propios de cada cuenta). Cuando el portal responde threshold veces seguidas uno de esos
+    errores, el interruptor de la cuenta se abre y rechaza sus inicios de sesión durante cooldown segundos, sin llegar a
+    contactar al portal. Pasado ese tiempo deja pasar un intento (semiabierto): si el portal responde igual vuelve a
+    abrirse con el doble de espera (hasta max_cooldown), y si no, se cierra.
+    El estado se guarda en un archivo JSON (indexado por usuario) para que se respete entre ejecuciones.
+    '''
+    CLOSED = {'failures': 0, 'open_until': None, 'cooldown': None}
+
+    def __init__(self, file_route:str, threshold:int=3, cooldown:float=300, max_cooldown:float=3600):
+        self.store = SessionStore(file_route)
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+    def __states(self) -> dict:
+        try:
+            states = self.store.load()
+        except ValueError:
+            states = None
+        if not states or 'failures' in states:  # Vacío, inválido o del formato anterior (un solo interruptor).
+            return {}
+        return states
+
+    def remaining(self, username:str) -> float:
+        '''Segundos que faltan para que el interruptor de la cuenta deje pasar otro intento (0 si está cerrado o semiabierto).'''
+        open_until = self.__states().get(username, self.CLOSED)['open_until']
+        return max(0, open_until - time()) if open_until is not None else 0
+
+    def allow(self, username:str) -> bool:
+        return self.remaining(username) == 0
+
+    def record(self, username:str, tripped:bool) -> None:
+        '''Función encargada de registrar la respuesta de un inicio de sesión de la cuenta.
+        tripped:    El portal respondió que la cuenta está en estado anormal o que hubo muchos intentos.'''
+        states = self.__states()
+        state = dict(states.get(username, self.CLOSED))
+        if not tripped:
+            if username in states:
+                del states[username]
+                self.store.save(states)
+            return
+        state['failures'] += 1
+        if state['failures'] >= self.threshold:
+            state['cooldown'] = min(self.max_cooldown, state['cooldown'] * 2) if state['cooldown'] else self.cooldown
+            state['open_until'] = time() + state['cooldown']
+            metrics.inc('etecsa_logger_circuit_open_total')
+        states[username] = state
+        self.store.save(states)
+
+class RequestPolicy():
+    '''Política de las peticiones al portal. Se configura con las opciones de la sección [CONFIG]:
+    <endpoint>_connect_timeout, <endpoint>_read_timeout:    Tiempos máximos de espera de login, logout y query
+                                                            (por defecto connect_timeout y read_timeout).
+    query_retries, retry_backoff:   Reintentos de la consulta del tiempo restante (que es idempotente) ante errores de
+                                    conexión, tiempos agotados o respuestas 5xx, y espera base entre ellos en segundos.
+    hedge_queries:                  Si la consulta tarda más que el percentil 95 observado (a partir de
+                                    hedge_min_samples muestras), se envía una copia y se usa la primera respuesta.
+                                    Las latencias solo se guardan en memoria, así que solo se llega a hedge_min_samples
+                                    en procesos que duran (el demonio, el modo interactivo o watchdog); en cada orden
+                                    suelta de la línea de comandos no se envían copias.
+    breaker_threshold, breaker_cooldown, breaker_max_cooldown:  Opciones del CircuitBreaker de los inicios de sesión.
+    '''
+    endpoints = ('login', 'logout', 'query')
+
+    def __init__(self, options, breaker_file:str):
+        self.options = options
+        self.query_latencies = deque(maxlen=200)
+        self.breaker = CircuitBreaker(breaker_file, options.getint('breaker_threshold', fallback=3),
+                                      options.getfloat('breaker_cooldown', fallback=300),
+                                      options.getfloat('breaker_max_cooldown', fallback=3600))
+
+    def timeout(self, endpoint:str) -> tuple:
+        '''Tupla (conexión, lectura) con los tiempos máximos de espera del endpoint, en segundos.'''
+        return (self.options.getfloat('%s_connect_timeout'%endpoint, fallback=self.options.getfloat('connect_timeout', fallback=5.0)),
+                self.options.getfloat('%s_read_timeout'%endpoint, fallback=self.options.getfloat('read_timeout', fallback=15.0)))
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.options.getint('query_retries', fallback=2))
+
+    def backoff(self, attempt:int) -> float:
+        '''Espera antes del reintento número attempt (desde 0): exponencial con variación aleatoria.'''
+        return self.options.getfloat('retry_backoff', fallback=0.5) * 2**attempt * uniform(0.5, 1)
+
+    def observe(self, seconds:float) -> None:
+        self.query_latencies.append(seconds)
+
+    def hedge_delay(self) -> float|None:
+        '''Tiempo tras el cual enviar una copia de la consulta (el percentil 95 observado), o None si no se debe.'''
+        if not self.options.getboolean('hedge_queries', fallback=False):
+            return None
+        if len(self.query_latencies) < max(1, self.options.getint('hedge_min_samples', fallback=20)):
+            return None
+        ordered = sorted(self.query_latencies)
+        return ordered[ceil(len(ordered) * 0.95) - 1]
+
+LoginResult = namedtuple('LoginResult', ['error', 'attribute_uuid', 'tokens'])
+LoginResult.__doc__ = '''Resultado de analizar la respuesta de /LoginServlet.
+error:          Posición del mensaje de error encontrado, o -1 si no hay error.
+attribute_uuid: ATTRIBUTE_UUID de la sesión creada (o None).
+tokens:         Otros parámetros del portal encontrados en la respuesta (CSRFHW, loggerId, wlanuserip, ...).'''
+
+class LoginResponseParser():
+    '''Analizador incremental de la respuesta de /LoginServlet. Busca todos los mensajes de error, el marcador
+    ATTRIBUTE_UUID= y los parámetros del portal en una sola pasada sobre los bytes recibidos (sin decodificarlos),
+    y deja de analizar en cuanto se encuentra un error o el ATTRIBUTE_UUID.
+    '''
+    token_names = ['CSRFHW', 'loggerId', 'wlanuserip', 'wlanacname', 'wlanmac', 'ssid', 'usertime']
+
+    def __init__(self, error_messages:list):
+        self.errors = {}
+        for pos, error_msg in enumerate(error_messages):
+            for encoding in ['utf-8', 'latin-1']:
+                self.errors.setdefault(error_msg.encode(encoding), pos)
+        alternatives = sorted(self.errors, key=len, reverse=True)
+        self.pattern = re.compile(b'(?P<error>' + b'|'.join(map(re.escape, alternatives)) + b')'
+                                  b'|ATTRIBUTE_UUID=(?P<uuid>[0-9A-Za-z]{32})'
+                                  b'|(?P<token>' + '|'.join(self.token_names).encode() + b')(?:=|" value=")(?P<value>[^&"\'\\s<>]+)')
+        self.overlap = max(len(alternatives[0]), len('ATTRIBUTE_UUID=') + 32, 128)
+        self.buffer = b''
+        self.error = -1
+        self.attribute_uuid = None
+        self.tokens = {}
+
+    @property
+    def done(self) -> bool:
+        return self.error != -1 or self.attribute_uuid is not None
+
+    def feed(self, chunk:bytes, final:bool=False) -> bool:
+        '''Función encargada de analizar un nuevo fragmento de la respuesta. Devuelve True cuando ya se conoce el resultado.'''
+        if self.done:
+            return True
+        self.buffer += chunk
+        for match in self.pattern.finditer(self.buffer):
+            if match.group('error') is not None:
+                self.error = self.errors[match.group('error')]
+                return True
+            if match.group('uuid') is not None:
+                self.attribute_uuid = match.group('uuid').decode()
+                return True
+            if final or match.end() < len(self.buffer):  # Un valor al final del buffer puede estar incompleto.
+                self.tokens[match.group('token').decode()] = match.group('value').decode('latin-1')
+        self.buffer = self.buffer[-self.overlap:]
+        return False
+
+    def result(self) -> LoginResult:
+        return LoginResult(self.error, self.attribute_uuid, self.tokens)
+
+class UsageLedger():
+    '''Clase encargada de llevar el registro de uso de las sesiones en un archivo binario de solo anexado.
+    Cada sesión ocupa un registro de tamaño fijo (inicio, fin, tiempo restante inicial y final, cuenta, tipo de
+    conexión y resultado), y los nombres de las cuentas se guardan una sola vez en un archivo de texto aparte.
+    Como los registros se anexan en orden de cierre, las consultas por fecha buscan el primer registro con una
+    búsqueda binaria y luego leen el archivo por bloques, sin cargar todo el historial en memoria.
+    Desde la versión 2 cada registro lleva también el tráfico de la sesión (bytes recibidos y enviados, y caudal
+    máximo de cada sentido; -1 si no se midió). Los archivos de la versión 1 se leen igual y se convierten a la
+    versión 2 la primera vez que se anexa un registro.
+    Los registros se anexan bajo un bloqueo entre procesos (que también protege la asignación de los números de las
+    cuentas), y si el archivo termina en un registro incompleto se recorta antes de anexar.
+    '''
+    MAGIC = b'ETLG\x02'
+    # inicio, fin, tiempo inicial, tiempo final, cuenta, tipo de conexión, resultado, bytes recibidos, bytes enviados,
+    # caudal máximo recibido y enviado (bytes/s)
+    RECORD = struct.Struct('<qqiiHBBqqii')
+    VERSIONS = {b'ETLG\x01': struct.Struct('<qqiiHBB'), MAGIC: RECORD}
+    CONNECTION_TYPES = ['internet', 'intranet']
+    OUTCOMES = ['SUCCESS', 'FAILURE', 'OTHER']
+    BLOCK = 4096
+
+    def __init__(self, file_route:str, accounts_route:str):
+        self.file_route = file_route
+        self.accounts_route = accounts_route
+        self._accounts = None
+
+    @property
+    def accounts(self) -> list:
+        if self._accounts is None:
+            try:
+                with open(self.accounts_route, 'r') as file:
+                    self._accounts = file.read().splitlines()
+            except FileNotFoundError:
+                self._accounts = []
+        return self._accounts
+
+    def __account_id(self, account:str) -> int:
+        if account not in self.accounts:
+            os.makedirs(os.path.dirname(self.accounts_route), exist_ok=True)
+            with open(self.accounts_route, 'a') as file:
+                file.write(account + '\n')
+            self.accounts.append(account)
+        return self.accounts.index(account)
+
+    def __upgrade(self) -> None:
+        '''Función encargada de convertir un archivo de una versión anterior a la actual (sin datos de tráfico).'''
+        try:
+            with open(self.file_route, 'rb') as file:
+                magic = file.read(len(self.MAGIC))
+                content = file.read()
+        except FileNotFoundError:
+            return
+        if magic == self.MAGIC or magic not in self.VERSIONS:
+            return
+        old = self.VERSIONS[magic]
+        content = content[:len(content) - len(content) % old.size]
+        atomic_write(self.file_route, self.MAGIC + b''.join(self.RECORD.pack(*record, -1, -1, -1, -1) for record in old.iter_unpack(content)))
+
+    def append(self, account:str, connection_type:str|None, start:datetime, end:datetime,
+               initial_left_time:int|None, final_left_time:int|None, outcome:str, traffic:dict|None=None) -> None:
+        '''Función encargada de anexar el registro de una sesión.
+        traffic:    Resumen del tráfico de la sesión (ver TrafficSampler.summary), si se midió.'''
+        measured = lambda key: -1 if traffic is None or traffic.get(key) is None else min(int(traffic[key]), 2**31 - 1 if key.endswith('peak') else 2**63 - 1)
+        os.makedirs(os.path.dirname(self.file_route), exist_ok=True)
+        with FileLock(self.file_route + '.lock'):
+            self.__upgrade()
+            self._accounts = None  # Otro proceso pudo agregar cuentas desde la última lectura.
+            record = self.RECORD.pack(int(start.timestamp()), int(end.timestamp()),
+                                      -1 if initial_left_time is None else initial_left_time,
+                                      -1 if final_left_time is None else final_left_time,
+                                      self.__account_id(account),
+                                      self.CONNECTION_TYPES.index(connection_type) if connection_type in self.CONNECTION_TYPES else 255,
+                                      self.OUTCOMES.index(outcome) if outcome in self.OUTCOMES else 2,
+                                      measured('rx_bytes'), measured('tx_bytes'), measured('rx_peak'), measured('tx_peak'))
+            with open(self.file_route, 'ab') as file:
+                size = file.tell()
+                complete = size - (size - len(self.MAGIC)) % self.RECORD.size if size >= len(self.MAGIC) else 0
+                if complete != size:
+                    file.truncate(complete)  # Registro a medio escribir por un proceso que se interrumpió.
+                if complete == 0:
+                    file.write(self.MAGIC)
+                file.write(record)
+
+    def __first_record_after(self, file, record_struct:struct.Struct, count:int, since:int) -> int:
+        '''Búsqueda binaria del primer registro cuyo fin es posterior o igual a since.'''
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            file.seek(len(self.MAGIC) + middle * record_struct.size)
+            if record_struct.unpack(file.read(record_struct.size))[1] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, since:datetime|None=None, until:datetime|None=None):
+        '''Generador de los registros (como diccionarios) de las sesiones cerradas entre since y until.'''
+        try:
+            file = open(self.file_route, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            record_struct = self.VERSIONS.get(file.read(len(self.MAGIC)))
+            if record_struct is None:
+                return
+            count = (os.fstat(file.fileno()).st_size - len(self.MAGIC)) // record_struct.size
+            first = self.__first_record_after(file, record_struct, count, int(since.timestamp())) if since else 0
+            until = int(until.timestamp()) if until else None
+            file.seek(len(self.MAGIC) + first * record_struct.size)
+            while True:
+                block = file.read(record_struct.size * self.BLOCK)
+                block = block[:len(block) - len(block) % record_struct.size]
+                if not block:
+                    return
+                for start, end, initial, final, account, connection_type, outcome, *traffic in record_struct.iter_unpack(block):
+                    if until is not None and end >= until:
+                        return
+                    rx_bytes, tx_bytes, rx_peak, tx_peak = [None if value < 0 else value for value in traffic] or [None] * 4
+                    yield {'start': start, 'end': end,
+                           'initial_left_time': None if initial < 0 else initial,
+                           'final_left_time': None if final < 0 else final,
+                           'account': self.accounts[account] if account < len(self.accounts) else '?',
+                           'connection_type': self.CONNECTION_TYPES[connection_type] if connection_type < len(self.CONNECTION_TYPES) else None,
+                           'outcome': self.OUTCOMES[outcome],
+                           'rx_bytes': rx_bytes, 'tx_bytes': tx_bytes, 'rx_peak': rx_peak, 'tx_peak': tx_peak}
+
+    def report(self, since:datetime|None=None, until:datetime|None=None) -> dict:
+        '''Función encargada de acumular el uso por cuenta, por día y por hora de inicio. Devuelve
+        {'accounts': {cuenta: totales}, 'days': {día: {cuenta: totales}}, 'hours': {hora: totales}}, donde totales es
+        [sesiones, segundos, bytes transferidos, segundos de las sesiones con tráfico medido].'''
+        accounts, days, hours = {}, {}, {}
+        for record in self.records(since, until):
+            seconds = max(0, record['end'] - record['start'])
+            start = datetime.fromtimestamp(record['start'])
+            measured = record['rx_bytes'] is not None
+            for totals in (accounts.setdefault(record['account'], [0, 0, 0, 0]),
+                           days.setdefault(start.date().isoformat(), {}).setdefault(record['account'], [0, 0, 0, 0]),
+                           hours.setdefault(start.hour, [0, 0, 0, 0])):
+                totals[0] += 1
+                totals[1] += seconds
+                if measured:
+                    totals[2] += record['rx_bytes'] + record['tx_bytes']
+                    totals[3] += seconds
+        return {'accounts': accounts, 'days': days, 'hours': hours}
+
+    @staticmethod
+    def format_report(report:dict) -> str:
+        if not report['accounts']:
+            return 'No hay sesiones registradas.'
+        duration = lambda seconds: '%.2d:%.2d:%.2d'%(seconds//3600, (seconds%3600)//60, seconds%60)
+        throughput = lambda totals: '  %s, %s'%(TrafficSampler.format_bytes(totals[2]), TrafficSampler.format_bytes(totals[2] / totals[3], 'B/s')) if totals[3] else ''
+        lines = ['Uso por cuenta:']
+        for account, totals in sorted(report['accounts'].items()):
+            lines.append('  %s  %s  (%d sesiones)%s'%(account.ljust(32), duration(totals[1]), totals[0], throughput(totals)))
+        lines.append('Uso por día:')
+        for day, accounts in sorted(report['days'].items()):
+            for account, totals in sorted(accounts.items()):
+                lines.append('  %s  %s  %s  (%d sesiones)%s'%(day, account.ljust(32), duration(totals[1]), totals[0], throughput(totals)))
+        if any(totals[3] for totals in report['hours'].values()):
+            lines.append('Caudal promedio por hora de inicio:')
+            for hour, totals in sorted(report['hours'].items()):
+                if totals[3]:
+                    lines.append('  %.2d:00  %s  (%d sesiones)'%(hour, TrafficSampler.format_bytes(totals[2] / totals[3], 'B/s'), totals[0]))
+        return '\n'.join(lines)
+
+class ActionScheduler():
+    '''Planificador de acciones (iniciar o cerrar sesión) basado en un montículo ordenado por momento de ejecución.
+    Cada acción tiene un momento de ejecución (at, en segundos desde epoch) o una condición sobre el tiempo restante
+    estimado de la sesión (left_below, en segundos). Las acciones pendientes se guardan en un archivo JSON para que
+    sobrevivan a un reinicio. Los momentos se comparan con el reloj del sistema en cada paso y las esperas duran como
+    mucho max_wait segundos, porque el reloj monotónico (el de las esperas) no avanza mientras el equipo está
+    suspendido: así "sched lo 14:30" se ejecuta a las 14:30 aunque el equipo se haya suspendido entre tanto. Las
+    acciones cuyo momento pasó hace más de grace segundos (el equipo estuvo apagado o ningún proceso las ejecutó) se
+    descartan en vez de ejecutarse tarde.
+    Las acciones fallidas se reintentan con espera exponencial acotada.
+    Varios procesos (la línea de comandos, el modo interactivo, un demonio) pueden compartir el archivo: se vuelve a
+    leer en cada paso, cada cambio se hace bajo su bloqueo (SessionStore.update), los identificadores se asignan bajo
+    ese mismo bloqueo y cada acción se quita del archivo antes de ejecutarla, así solo la ejecuta un proceso.
+    '''
+    ACTIONS = ['login', 'logout']
+
+    def __init__(self, logger:'EtecsaLogger', file_route:str, max_attempts:int=8, max_backoff:float=60, prepare_lead:float=0,
+                 max_wait:float=30, grace:float=900):
+        self.logger = logger
+        self.file_route = file_route
+        self.store = SessionStore(file_route)
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.prepare_lead = prepare_lead
+        self.max_wait = max_wait
+        self.grace = grace
+        self.prepared = None
+        self.heap = []
+        self.actions = {}
+        self.stop_event = Event()
+        self.__reload()
+
+    @staticmethod
+    def __normalize(stored) -> dict:
+        '''Contenido del archivo como {'next_id': ..., 'actions': [...]} (las versiones anteriores guardaban solo la lista).'''
+        if isinstance(stored, list):
+            return {'next_id': max((action['id'] for action in stored), default=0) + 1, 'actions': stored}
+        return stored if isinstance(stored, dict) else {'next_id': 1, 'actions': []}
+
+    def __apply(self, stored) -> None:
+        actions = {action['id']: action for action in self.__normalize(stored)['actions']}
+        if actions != self.actions:
+            self.actions = actions
+            self.heap = [(self.__due(action), action['id']) for action in actions.values()]
+            heapq.heapify(self.heap)
+
+    def __reload(self) -> None:
+        '''Función encargada de leer las acciones guardadas (otro proceso pudo cambiarlas). Solo cuesta un stat() si el
+        archivo no cambió.'''
+        try:
+            stored = self.store.load()
+        except ValueError:
+            stored = None
+        self.__apply(stored)
+
+    def __update(self, change):
+        '''Función encargada de cambiar las acciones guardadas bajo el bloqueo del archivo. change recibe el contenido
+        (normalizado), lo modifica y devuelve un resultado, que se devuelve.'''
+        result = []
+        def modify(stored):
+            stored = self.__normalize(stored)
+            result.append(change(stored))
+            return stored
+        self.__apply(self.store.update(modify))
+        return result[0]
+
+    def __due(self, action:dict) -> float:
+        '''Momento de ejecución de la acción, en segundos desde epoch.'''
+        if action.get('retry_at'):
+            return action['retry_at']
+        if action.get('at') is not None:
+            return action['at']
+        left_time = time_to_seconds(self.logger.get_left_time())
+        if left_time is None:
+            return time() + 60  # Sin datos de la sesión: volver a comprobar en un minuto.
+        return time() + max(0, left_time - action['left_below'])
+
+    def schedule(self, action:str, at:float|None=None, left_below:float|None=None) -> int:
+        '''Función encargada de programar una acción. Devuelve su identificador.
+        action:     'login' o 'logout'.
+        at:         Momento de ejecución, en segundos desde epoch.
+        left_below: Ejecutar cuando el tiempo restante estimado sea menor a esta cantidad de segundos.
+        '''
+        if action not in self.ACTIONS or (at is None) == (left_below is None):
+            raise ValueError('Acción inválida.')
+        def add(stored):
+            action_id = stored['next_id']
+            stored['next_id'] += 1
+            stored['actions'].append({'id': action_id, 'action': action, 'at': at, 'left_below': left_below, 'attempts': 0, 'retry_at': None})
+            return action_id
+        return self.__update(add)
+
+    @staticmethod
+    def __remove(stored:dict, action:dict) -> bool:
+        '''Quita la acción del contenido si sigue igual (sin ejecutar, cancelar ni reprogramar por otro proceso).'''
+        if action not in stored['actions']:
+            return False
+        stored['actions'].remove(action)
+        return True
+
+    def cancel(self, action_id:int) -> int:
+        '''Función encargada de cancelar una acción pendiente.'''
+        def remove(stored):
+            actions = [action for action in stored['actions'] if action['id'] != action_id]
+            found, stored['actions'] = len(actions) != len(stored['actions']), actions
+            return found
+        return 0 if self.__update(remove) else 1
+
+    def __execute(self, action:dict, verbose:bool) -> bool:
+        '''Ejecuta una acción. Devuelve True si terminó (con éxito o con un error que no vale la pena reintentar).'''
+        print('\nCerrando sesión.' if action['action'] == 'logout' else '\nIniciando sesión.') if verbose else None
+        try:
+            if action['action'] == 'logout':
+                self.logger.logout(verbose=verbose)
+                return not self.logger.attribute_uuid  # Si aún hay datos de sesión fue un error de conexión.
+            self.logger.login(verbose=verbose)
+            return self.logger.last_error not in (None, 6) or bool(self.logger._check_connection())
+        except Exception as e:  # La acción ya se quitó del archivo: se reintenta en vez de perderla.
+            print('Error al ejecutar la acción %d: %s'%(action['id'], str(e) or type(e).__name__)) if verbose else None
+            return False
+
+    def step(self, verbose:bool=True) -> float|None:
+        '''Función encargada de ejecutar la próxima acción si ya llegó su momento (o de preparar el inicio de sesión si
+        falta menos de prepare_lead segundos). Devuelve los segundos que faltan para la próxima acción (0 si hay que
+        llamarla de nuevo enseguida; como mucho max_wait) o None si no quedan acciones.'''
+        self.__reload()
+        while self.heap:
+            due, action_id = self.heap[0]
+            if action_id not in self.actions:  # Acción cancelada o reprogramada.
+                heapq.heappop(self.heap)
+                continue
+            remaining = due - time()
+            if 0 < remaining <= self.prepare_lead and self.prepared != action_id and self.actions[action_id]['action'] == 'login':
+                self.prepared = action_id
+                self.logger.prepare(verbose=False)
+                return 0
+            if remaining > 0:
+                return min(remaining, self.max_wait)
+            heapq.heappop(self.heap)
+            self.prepared = None
+            action = self.actions[action_id]
+            if -remaining > self.grace:
+                if self.__update(lambda stored: self.__remove(stored, action)) and verbose:
+                    print('\nAcción %d (%s) descartada: debía ejecutarse a las %s.'%(action_id, action['action'],
+                          datetime.fromtimestamp(due).strftime('%Y-%m-%d %H:%M:%S')))
+                return 0
+            if action['left_below'] is not None and not action['retry_at']:
+                self.logger.reconcile_left_time()
+                left_time = time_to_seconds(self.logger.get_left_time())
+                if left_time is None or left_time > action['left_below']:
+                    # La sesión cambió: calcular de nuevo el momento de ejecución.
+                    heapq.heappush(self.heap, (self.__due(action), action_id))
+                    return 0
+            if not self.__update(lambda stored: self.__remove(stored, action)):
+                return 0  # Otro proceso la ejecutó, la canceló o la reprogramó.
+            if not self.__execute(action, verbose) and action['attempts'] + 1 < self.max_attempts:
+                retry = dict(action, attempts=action['attempts'] + 1, retry_at=time() + min(self.max_backoff, 2 ** (action['attempts'] + 1)))
+                self.__update(lambda stored: stored['actions'].append(retry))
+            return 0
+        return None
+
+    def run(self, until:int|None=None, verbose:bool=True, on_tick=None, tick:float=1.0) -> int:
+        '''Función encargada de ejecutar las acciones a medida que llega su momento.
+        until:      Terminar cuando se complete la acción con este identificador (o cuando no queden acciones).
+        on_tick:    Función que se llama al menos cada tick segundos mientras se espera, con (identificador, segundos restantes).
+        '''
+        self.stop_event.clear()
+        while not self.stop_event.is_set():
+            if until is not None and until not in self.actions:
+                break
+            remaining = self.step(verbose)
+            if remaining is None:
+                break
+            if remaining > 0:
+                if on_tick is not None:
+                    on_tick(self.heap[0][1], self.heap[0][0] - time())
+                self.stop_event.wait(min(remaining, tick) if on_tick is not None else remaining)
+        return 0 if until is None or until not in self.actions else 1
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def __str__(self):
+        if not self.actions:
+            return 'No hay acciones programadas.'
+        lines = []
+        for action in sorted(self.actions.values(), key=lambda action: action['id']):
+            if action['at'] is not None:
+                when = datetime.fromtimestamp(action['retry_at'] or action['at']).strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                when = 'cuando queden menos de %d segundos'%action['left_below']
+            lines.append('%d: %s %s%s'%(action['id'], action['action'], when, ' (reintento %d)'%action['attempts'] if action['attempts'] else ''))
+        return '\n'.join(lines)
+
+class MetricTimer():
+    '''Contexto que mide el tiempo de un bloque y lo registra en un histograma de Metrics.'''
+    def __init__(self, metrics:'Metrics', name:str, labels:dict, operation:str|None=None):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.operation = operation
+
+    def __enter__(self):
+        if self.operation is not None:
+            self.token = self.metrics.current_operation.set(self.operation)
+        self.span = span(self.labels.get('phase') or self.labels['operation'])
+        self.span.__enter__()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, perf_counter() - self.start, self.labels)
+        self.span.__exit__(*exc_info)
+        if self.operation is not None:
+            self.metrics.current_operation.reset(self.token)
+
+class Metrics():
+    '''Registro de métricas del proceso (contadores e histogramas) en formato de texto de Prometheus.
+    El estado puede acumularse entre ejecuciones en un archivo JSON y escribirse como archivo de texto para el
+    "textfile collector" de node_exporter, o servirse por HTTP.
+    '''
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    HELP = {'etecsa_logger_operation_seconds': 'Duración de las operaciones del logger.',
+            'etecsa_logger_phase_seconds': 'Duración de cada fase (probe, connect, post, parse) de las operaciones.',
+            'etecsa_logger_portal_errors_total': 'Mensajes de error devueltos por el portal.',
+            'etecsa_logger_ssl_errors_total': 'Errores al establecer la conexión SSL/TLS.',
+            'etecsa_logger_timeouts_total': 'Peticiones que excedieron el tiempo de espera.',
+            'etecsa_logger_connection_errors_total': 'Peticiones fallidas por otros errores de conexión.',
+            'etecsa_logger_retries_total': 'Reintentos de la consulta del tiempo restante.',
+            'etecsa_logger_hedged_requests_total': 'Copias de la consulta enviadas por superar el percentil 95.',
+            'etecsa_logger_circuit_open_total': 'Veces que se abrió el interruptor de los inicios de sesión.',
+            'etecsa_logger_circuit_rejected_total': 'Inicios de sesión rechazados con el interruptor abierto.',
+            'etecsa_logger_unrecognized_responses_total': 'Respuestas del portal que no se pudieron interpretar.',
+            }
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.current_operation = ContextVar('operation', default='none')
+
+    @staticmethod
+    def key(name:str, labels:dict|None=None) -> str:
+        if not labels:
+            return name
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return name + '{' + ','.join('%s="%s"'%(label, escape(value)) for label, value in sorted(labels.items())) + '}'
+
+    def inc(self, name:str, labels:dict|None=None, value:float=1) -> None:
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name:str, value:float, labels:dict|None=None) -> None:
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+            for pos, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    break
+            else:
+                pos = len(self.BUCKETS)
+            histogram['buckets'][pos] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def operation(self, name:str) -> MetricTimer:
+        '''Mide una operación completa; las fases medidas dentro del bloque quedan etiquetadas con su nombre.'''
+        return MetricTimer(self, 'etecsa_logger_operation_seconds', {'operation': name}, operation=name)
+
+    def phase(self, name:str) -> MetricTimer:
+        return MetricTimer(self, 'etecsa_logger_phase_seconds', {'operation': self.current_operation.get(), 'phase': name})
+
+    def observe_phase(self, name:str, value:float) -> None:
+        self.observe('etecsa_logger_phase_seconds', value, {'operation': self.current_operation.get(), 'phase': name})
+
+    def instrument(self, name:str):
+        '''Decorador que mide cada llamada a una función (o corrutina) como la operación name.'''
+        def decorator(function):
+            if function.__code__.co_flags & 0x80:  # CO_COROUTINE
+                @wraps(function)
+                async def wrapper(*args, **kwargs):
+                    with self.operation(name):
+                        return await function(*args, **kwargs)
+            else:
+                @wraps(function)
+                def wrapper(*args, **kwargs):
+                    with self.operation(name):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def state(self, reset:bool=False) -> dict:
+        with self.lock:
+            state = {'counters': dict(self.counters),
+                     'histograms': {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']} for key, value in self.histograms.items()}}
+            if reset:
+                self.counters, self.histograms = {}, {}
+        return state
+
+    @staticmethod
+    def merge(*states:dict) -> dict:
+        merged = {'counters': {}, 'histograms': {}}
+        for state in states:
+            for key, value in state.get('counters', {}).items():
+                merged['counters'][key] = merged['counters'].get(key, 0) + value
+            for key, value in state.get('histograms', {}).items():
+                histogram = merged['histograms'].setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], value['buckets'])]
+                histogram['sum'] += value['sum']
+                histogram['count'] += value['count']
+        return merged
+
+    @classmethod
+    def render(cls, state:dict) -> str:
+        '''Función encargada de convertir un estado al formato de texto de Prometheus.'''
+        lines, described = [], set()
+        def describe(name:str, type_:str):
+            if name not in described:
+                described.add(name)
+                lines.append('# HELP %s %s'%(name, cls.HELP.get(name, name)))
+                lines.append('# TYPE %s %s'%(name, type_))
+        for key, value in sorted(state['counters'].items()):
+            describe(key.split('{')[0], 'counter')
+            lines.append('%s %s'%(key, value))
+        for key, value in sorted(state['histograms'].items()):
+            name, _, labels = key.partition('{')
+            labels = labels.rstrip('}')
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in cls.BUCKETS] + ['+Inf'], value['buckets']):
+                cumulative += count
+                lines.append('%s_bucket{%sle="%s"} %d'%(name, labels + ',' if labels else '', bound, cumulative))
+            suffix = '{%s}'%labels if labels else ''
+            lines.append('%s_sum%s %r'%(name, suffix, value['sum']))
+            lines.append('%s_count%s %d'%(name, suffix, value['count']))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def load_state(state_file:str) -> dict:
+        try:
+            with open(state_file, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def persist(self, state_file:str, textfile:str|None=None) -> None:
+        '''Función encargada de sumar las métricas de este proceso al estado acumulado en state_file y, si se indica,
+        escribir el resultado en textfile (para el "textfile collector" de node_exporter).'''
+        with FileLock(state_file + '.lock'):
+            state = self.merge(self.load_state(state_file), self.state(reset=True))
+            atomic_write(state_file, json.dumps(state))
+            if textfile:
+                atomic_write(textfile, self.render(state))
+
+    def serve(self, port:int, state_file:str|None=None, host:str='127.0.0.1'):
+        '''Función encargada de servir las métricas (acumuladas más las de este proceso) en http://host:port/metrics
+        desde un hilo en segundo plano. Devuelve el servidor.'''
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from threading import Thread
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                state = metrics.merge(metrics.load_state(state_file) if state_file else {}, metrics.state())
+                body = metrics.render(state).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+metrics = Metrics()
+
+class LeftTimeEstimator():
+    '''Estimador del tiempo restante de la sesión a partir del último valor devuelto por el servidor.
+    El tiempo transcurrido se mide con un reloj monotónico que sigue contando durante la suspensión del equipo
+    (CLOCK_BOOTTIME en Linux), así que los cambios de hora no afectan la estimación. La próxima consulta al servidor
+    se programa en proporción al tiempo restante (fraction), entre min_interval y max_interval segundos, y se
+    adelanta al mínimo cuando la estimación y el servidor difieren en más de tolerance segundos.
+    '''
+    def __init__(self, min_interval:float=60, max_interval:float=3600, tolerance:float=30, fraction:float=0.25):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.tolerance = tolerance
+        self.fraction = fraction
+        self.reset()
+
+    @staticmethod
+    def clock() -> float:
+        if hasattr(time_module, 'CLOCK_BOOTTIME'):
+            return time_module.clock_gettime(time_module.CLOCK_BOOTTIME)
+        return monotonic()
+
+    def reset(self) -> None:
+        self.left_time = None
+        self.sync_clock = None
+        self.sync_wall = None
+        self.next_check = None
+
+    def elapsed(self) -> float:
+        '''Segundos transcurridos desde la última sincronización. Si el reloj monotónico es menor que el guardado
+        (el equipo se reinició) se usa el reloj de pared.'''
+        now = self.clock()
+        if now >= self.sync_clock:
+            return now - self.sync_clock
+        return max(0, time() - self.sync_wall)
+
+    def estimate(self) -> float|None:
+        '''Tiempo restante estimado en segundos, o None si nunca se sincronizó.'''
+        if self.left_time is None:
+            return None
+        return self.left_time - self.elapsed()
+
+    def sync(self, left_time:int) -> None:
+        '''Función encargada de registrar un tiempo restante devuelto por el servidor y programar la próxima consulta.'''
+        estimate = self.estimate()
+        interval = min(self.max_interval, max(self.min_interval, left_time * self.fraction))
+        if estimate is not None and abs(estimate - left_time) > self.tolerance:
+            interval = self.min_interval
+        self.left_time, self.sync_clock, self.sync_wall = left_time, self.clock(), time()
+        self.next_check = self.sync_clock + interval
+
+    def due(self) -> bool:
+        '''Indica si toca consultar el servidor.'''
+        return self.next_check is None or self.clock() >= self.next_check or (self.clock() < self.sync_clock)
+
+    def to_dict(self) -> dict|None:
+        if self.left_time is None:
+            return None
+        return {'left_time': self.left_time, 'clock': self.sync_clock, 'wall': self.sync_wall, 'next_check': self.next_check}
+
+    def load(self, data:dict|None) -> None:
+        if not data:
+            self.reset()
+            return
+        self.left_time, self.sync_clock, self.sync_wall, self.next_check = data['left_time'], data['clock'], data['wall'], data['next_check']
 
 class EtecsaLogger():
     ruta_script = os.path.dirname(argv[0]).replace('\\', '/')
     logger_data_folder = ruta_script + '/logger_data/'
     config_file = logger_data_folder + 'config.ini'
+    accounts_file = logger_data_folder + 'accounts.json'
     HOST = 'https://secure.etecsa.net:8443'
     login_endpoint = '/LoginServlet'
     logout_endpoint = '/LogoutServlet'
@@ -53,12 +1715,39 @@ class EtecsaLogger():
 
     def __init__(self):
         self.config = ConfigParser()
-        self.__load_config()
+        with span('load config'):
+            self.__load_config()
         self.attribute_uuid = None
         self.session_start_time = None
         self.initial_left_time = None
         self.connection_type = None
-        self._load_session_data(True if len(argv) == 1 and __name__ == '__main__' else False)
+        self.portal_tokens = {}
+        options = self.config['CONFIG']
+        self.estimator = LeftTimeEstimator(options.getfloat('estimator_min_interval', fallback=60),
+                                           options.getfloat('estimator_max_interval', fallback=3600),
+                                           options.getfloat('estimator_tolerance', fallback=30))
+        responses.configure(options.getint('capture_size', fallback=32), options.getint('capture_max_body', fallback=262144),
+                            options.getfloat('capture_dump_interval', fallback=300))
+        self._http = None
+        self._connection_cache = None
+        self._prober = None
+        self._pool = None
+        self._policy = None
+        self._prepared = None
+        self._users = None
+        self._traffic = None
+        self.traffic_baseline = None
+        self.last_traffic = None
+        self._ledger = None
+        self._scheduler = None
+        self._session_store = None
+        self._connection_store = None
+        self.last_error = None
+        self._stop_event = Event()
+        with span('load session'):
+            self._load_session_data(True if len(argv) == 1 and __name__ == '__main__' else False)
+        if self.config['CONFIG'].get('metrics_textfile'):
+            atexit.register(self.persist_metrics)
 
     def __load_config(self) -> None:
         '''Función encargada de cargar los datos especificados del archivo de configuración.
@@ -82,6 +1771,7 @@ class EtecsaLogger():
         error_msg = 'Archivo de configuración %s.'
         error = 0
         found = self.config.read(self.config_file)
+        self._config_signature = self.__config_signature()
 
         if len(found) != 1:
             error_msg = error_msg%'no encontrado'
@@ -105,111 +1795,435 @@ class EtecsaLogger():
         except KeyError:
             raise KeyError('El usuario a elegir en el archivo de configuración no existe en la lista de usuarios.')
 
-    def save_config(self, choosed_user:str) -> int:
-        '''Función encargada de guardar la configuracion del nuevo usuario a usar.
-        '''
-        if self.attribute_uuid != None:
-            print('Cierre la sesión primero y después cambie el usuario a usar.')
-            return 1
-        users = list(self.config['USERS'].keys())
-        ___ = [user.startswith(choosed_user) for user in users]
-        if ___.count(True) == 1:
-            choosed_user = users[___.index(True)]
-            print('Se ha elegido por las iniciales al usuario: %s'%choosed_user)
-        if not any([choosed_user.endswith(i) for i in ['@nauta.com.cu', '@nauta.co.cu']]):
-            print('Formato inválido. Ingrese un correo del tipo: \'@nauta.com.cu\' o \'@nauta.co.cu\'')
-            return 1
-        if not choosed_user in users:
-            print('Correo electrónico inválido. Elija uno entre los siguientes correos:')
-            for user in users:
-                print(user)
-            return 1
-        os.makedirs(os.path.dirname(self.config_file), exist_ok=True)        
-        with open(self.config_file, 'w') as config_file:
-            self.config['CONFIG'] = {'choose':choosed_user}
-            self.user_pass = {'username':choosed_user,
-                              'password':self.config['USERS'][choosed_user]}
-            self.config.write(config_file)
-        return 0
+    def __config_signature(self) -> int|None:
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
 
-    def __update_session_data(self, response:requests.Response) -> int:
-        '''Función encargada de analizar la respuesta de inicio de sesión, extraer el parámetro
-        ATTRIBUTE_UUID y crear la variable session_start_time a partir de la hora actual.
-        '''
-        self.session_start_time = datetime.now()
-        location_attribute_uuid = response.text.find('ATTRIBUTE_UUID=')
-        if location_attribute_uuid != -1:
-            self.attribute_uuid = response.text[location_attribute_uuid+15:location_attribute_uuid+15+32]  # 15 = len('ATTRIBUTE_UUID=')
-            return 0
-        else:
-            self.session_start_time = None
-            return 1
+    def reload_config(self) -> bool:
+        '''Función encargada de leer de nuevo el archivo de configuración si cambió desde la última lectura (otro proceso
+        pudo elegir otra cuenta o cambiar los usuarios). Si no hay una sesión abierta se pasa a la cuenta elegida en el
+        archivo. Devuelve True si se leyó.'''
+        signature = self.__config_signature()
+        if signature is None or signature == self._config_signature:
+            return False
+        config = ConfigParser()
+        try:
+            valid = len(config.read(self.config_file)) == 1 and config['CONFIG']['choose'] in config['USERS']
+        except (KeyError, ConfigError):
+            valid = False
+        if not valid:
+            return False  # Se mantiene la configuración anterior.
+        self.config, self._config_signature = config, signature
+        self._users, self._pool = None, None
+        if not self.attribute_uuid:
+            self._use_account(config['CONFIG']['choose'])
+        return True
+
+    @property
+    def timeout(self) -> tuple:
+        '''Tupla (conexión, lectura) con los tiempos máximos de espera de las peticiones, en segundos.
+        Se configuran con las opciones connect_timeout y read_timeout de la sección [CONFIG].'''
+        return (self.config['CONFIG'].getfloat('connect_timeout', fallback=5.0),
+                self.config['CONFIG'].getfloat('read_timeout', fallback=15.0))
+
+    @staticmethod
+    def _timed_adapter(pool_size:int) -> 'requests.adapters.HTTPAdapter':
+        '''Crea un HTTPAdapter cuyas conexiones registran el tiempo de conexión (DNS, TCP y TLS) en las métricas.'''
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        def timed(connection_class):
+            class TimedConnection(connection_class):
+                def connect(self):
+                    with metrics.phase('connect'):
+                        super().connect()
+                        if tracer is not None and connection_class is HTTPSConnection and hasattr(self, '_tcp_end'):
+                            # El saludo TLS ocurre dentro de connect(), justo después de abrir el socket TCP.
+                            tracer.record('tls', self._tcp_end, perf_counter(), next(tracer.ids), tracer.current.get(), {'host': self.host})
+                def _new_conn(self):
+                    host = self._dns_host
+                    address = dns_cache.get(host)
+                    if address is None and tracer is None:
+                        return super()._new_conn()
+                    if address is None:
+                        with span('dns', host=host):
+                            address = getaddrinfo(host, self.port, type=SOCK_STREAM)[0][4][0]
+                    self._dns_host = address
+                    try:
+                        with span('tcp', address=address):
+                            return super()._new_conn()
+                    except Exception:
+                        dns_cache.discard(host)
+                        raise
+                    finally:
+                        self._dns_host = host
+                        self._tcp_end = perf_counter()
+            return TimedConnection
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = timed(HTTPConnection)
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = timed(HTTPSConnection)
+        class TimedAdapter(requests.adapters.HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+            def send(self, request, *args, **kwargs):
+                with span('http', method=request.method, url=urlsplit(request.url).path):
+                    start = perf_counter()
+                    try:
+                        response = super().send(request, *args, **kwargs)
+                    except requests.exceptions.RequestException as e:
+                        responses.record(request.method, request.url, None, None, b'', perf_counter() - start, type(e).__name__)
+                        raise
+                    if kwargs.get('stream'):
+                        response.raw = CapturedStream(response.raw, request.method, request.url, response.status_code, response.headers, start)
+                    else:
+                        responses.record(request.method, request.url, response.status_code, response.headers, response.content, perf_counter() - start)
+                    return response
+        return TimedAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+
+    @property
+    def http(self) -> 'requests.Session':
+        '''Sesión HTTP persistente (keep-alive) compartida por login, get_left_time_from_server y logout.
+        El tamaño del pool de conexiones se configura con la opción pool_size de la sección [CONFIG].'''
+        if self._http is None:
+            pool_size = self.config['CONFIG'].getint('pool_size', fallback=2)
+            adapter = self._timed_adapter(pool_size)
+            self._http = requests.Session()
+            self._http.headers['Connection'] = 'keep-alive'
+            self._http.mount('https://', adapter)
+            self._http.mount('http://', adapter)
+        return self._http
+
+    def close(self) -> None:
+        '''Función encargada de cerrar las conexiones abiertas de la sesión HTTP.'''
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    @property
+    def pool(self) -> AccountPool:
+        '''Estado de las cuentas de la sección [USERS]. El tiempo de bloqueo tras "muchos intentos" se configura
+        con la opción pool_cooldown de [CONFIG], en segundos.'''
+        if self._pool is None:
+            self._pool = AccountPool(self.accounts_file, list(self.config['USERS'].keys()),
+                                     self.config['CONFIG'].getfloat('pool_cooldown', fallback=1800))
+        return self._pool
+
+    @property
+    def traffic(self) -> TrafficSampler:
+        '''Muestreador del tráfico de la sesión. Se configura con las opciones traffic_interval (segundos entre
+        muestras), traffic_samples (tamaño del buffer), traffic_interface (por defecto todas menos lo) y
+        traffic_sampler (para desactivarlo) de [CONFIG].'''
+        if self._traffic is None:
+            options = self.config['CONFIG']
+            self._traffic = TrafficSampler(options.getfloat('traffic_interval', fallback=1.0),
+                                           options.getint('traffic_samples', fallback=300),
+                                           options.get('traffic_interface'))
+        return self._traffic
+
+    def start_traffic_sampler(self) -> bool:
+        '''Función encargada de empezar a muestrear el tráfico en este proceso si hay una sesión abierta.'''
+        if not self.attribute_uuid or not self.config['CONFIG'].getboolean('traffic_sampler', fallback=True):
+            return False
+        return self.traffic.start()
+
+    def traffic_summary(self) -> dict|None:
+        '''Resumen del tráfico de la sesión actual. Los totales y el promedio se calculan con los contadores guardados
+        al iniciar la sesión (así sirven aunque la sesión se haya iniciado en otro proceso); el caudal actual y el
+        máximo salen del muestreador, si está corriendo en este proceso.'''
+        summary = self.traffic.summary() if self._traffic is not None and self._traffic.running else None
+        baseline = self.traffic_baseline
+        counters = self.traffic.read_counters() if baseline else None
+        if counters and baseline['boot_id'] == TrafficSampler.boot_id() and counters[0] >= baseline['rx'] and counters[1] >= baseline['tx']:
+            seconds = max(time() - baseline['time'], 1e-3)
+            received, sent = counters[0] - baseline['rx'], counters[1] - baseline['tx']
+            summary = dict(summary or {'rx_rate': None, 'tx_rate': None, 'rx_peak': None, 'tx_peak': None},
+                           seconds=round(seconds, 1), rx_bytes=received, tx_bytes=sent, rx_avg=received / seconds, tx_avg=sent / seconds)
+        return summary
+
+    @property
+    def users(self) -> PrefixIndex:
+        '''Índice de prefijos de los usuarios de la sección [USERS], para elegirlos por sus iniciales y completarlos.'''
+        if self._users is None:
+            self._users = PrefixIndex(self.config['USERS'].keys())
+        return self._users
+
+    @property
+    def policy(self) -> RequestPolicy:
+        '''Política de tiempos de espera, reintentos, consultas duplicadas e interruptor de circuito de las peticiones
+        al portal (ver RequestPolicy).'''
+        if self._policy is None:
+            self._policy = RequestPolicy(self.config['CONFIG'], self.logger_data_folder + 'breaker.json')
+        return self._policy
+
+    def _circuit_message(self) -> str|None:
+        '''Función encargada de comprobar el interruptor de circuito antes de un inicio de sesión. Devuelve el mensaje a
+        mostrar si está abierto, o None si se puede contactar al portal.'''
+        remaining = self.policy.breaker.remaining(self.user_pass['username'])
+        if not remaining:
+            return None
+        metrics.inc('etecsa_logger_circuit_rejected_total')
+        return 'El portal rechazó varios intentos seguidos. Inténtelo de nuevo en %d segundos.'%ceil(remaining)
+
+    @property
+    def ledger(self) -> UsageLedger:
+        '''Registro de uso de las sesiones (usage_ledger.bin en la carpeta de datos).'''
+        if self._ledger is None:
+            self._ledger = UsageLedger(self.logger_data_folder + 'usage_ledger.bin', self.logger_data_folder + 'usage_accounts.txt')
+        return self._ledger
+
+    @property
+    def scheduler(self) -> ActionScheduler:
+        '''Planificador de acciones (scheduled_actions.json en la carpeta de datos). Los reintentos se configuran con
+        las opciones schedule_max_attempts y schedule_max_backoff de [CONFIG], los inicios de sesión se preparan
+        prepare_lead segundos antes (0 para no prepararlos) y las acciones atrasadas más de schedule_grace segundos se
+        descartan.'''
+        if self._scheduler is None:
+            self._scheduler = ActionScheduler(self, self.logger_data_folder + 'scheduled_actions.json',
+                                              self.config['CONFIG'].getint('schedule_max_attempts', fallback=8),
+                                              self.config['CONFIG'].getfloat('schedule_max_backoff', fallback=60),
+                                              self.config['CONFIG'].getfloat('prepare_lead', fallback=10),
+                                              grace=self.config['CONFIG'].getfloat('schedule_grace', fallback=900))
+        return self._scheduler
+
+    def schedule(self, args:list, verbose:bool=True, return_str:bool=False):
+        '''Función encargada de gestionar las acciones programadas.
+        args:   [] para listarlas, ['l'|'lo', 'hora:minuto[:segundo]'] para programar un inicio o cierre de sesión a esa
+                hora, ['lo', '<hora:minuto:segundo'] para cerrar la sesión cuando quede menos de ese tiempo,
+                ['cancel', id] para cancelar una acción o ['run'] para ejecutar las acciones pendientes.
+        '''
+        to_return = 0
+        if not args:
+            to_print = str(self.scheduler)
+        elif args[0] == 'run':
+            try:
+                self.scheduler.run(verbose=verbose)
+                to_print = 'No quedan acciones programadas.'
+            except KeyboardInterrupt:
+                to_print = 'Planificador detenido.'
+        elif args[0] == 'cancel' and len(args) == 2 and args[1].isdigit():
+            to_return = self.scheduler.cancel(int(args[1]))
+            to_print = 'Acción cancelada.' if to_return == 0 else 'No existe la acción %s.'%args[1]
+        elif len(args) == 2 and args[0] in ['l', 'login', 'lo', 'logout']:
+            action = 'login' if args[0] in ['l', 'login'] else 'logout'
+            if args[1].startswith('<'):
+                seconds, to_print = self._parse_timer(args[1][1:])
+                if to_print is None:
+                    action_id = self.scheduler.schedule(action, left_below=seconds)
+            else:
+                try:
+                    hour = datetime.strptime(args[1], '%H:%M:%S' if args[1].count(':') == 2 else '%H:%M').time()
+                except ValueError:
+                    hour, to_print = None, 'Hora inválida. Ingrese una hora con formato: \'hora:minuto[:segundo]\''
+                if hour is not None:
+                    at = datetime.combine(datetime.now().date(), hour)
+                    at += timedelta(days=1) if at <= datetime.now() else timedelta()
+                    action_id = self.scheduler.schedule(action, at=at.timestamp())
+                    to_print = None
+            if to_print is None:
+                to_print = 'Acción %d programada.'%action_id
+            else:
+                to_return = 1
+        else:
+            to_print = 'Comando inválido. (Ej: -> "sched lo 14:30", "sched l 06:00", "sched lo <0:05:00", "sched cancel 1", "sched run")'
+            to_return = 1
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    @property
+    def metrics_state_file(self) -> str:
+        return self.logger_data_folder + 'metrics_state.json'
+
+    def persist_metrics(self) -> None:
+        '''Función encargada de acumular las métricas de este proceso en metrics_state.json y escribir el archivo de
+        texto de la opción metrics_textfile de [CONFIG] (para el "textfile collector" de node_exporter).'''
+        try:
+            metrics.persist(self.metrics_state_file, self.config['CONFIG'].get('metrics_textfile'))
+        except OSError as e:
+            print('No se pudieron guardar las métricas: %s'%e)
+
+    def show_metrics(self, args:list, verbose:bool=True, return_str:bool=False):
+        '''Función encargada de mostrar las métricas en formato de Prometheus (args vacío) o de servirlas por HTTP
+        (args = ['serve', puerto]; por defecto la opción metrics_port de [CONFIG]).'''
+        to_return = 0
+        if not args:
+            to_print = metrics.render(metrics.merge(metrics.load_state(self.metrics_state_file), metrics.state())).rstrip('\n')
+        elif args[0] == 'serve' and (len(args) == 1 or args[1].isdigit()):
+            port = int(args[1]) if len(args) > 1 else self.config['CONFIG'].getint('metrics_port', fallback=9877)
+            try:
+                self._metrics_server = metrics.serve(port, self.metrics_state_file)
+                to_print = 'Sirviendo métricas en http://127.0.0.1:%d/metrics'%self._metrics_server.server_address[1]
+            except OSError as e:
+                to_print, to_return = 'No se pudo abrir el puerto %d: %s'%(port, e), 1
+        else:
+            to_print, to_return = 'Comando inválido. (Ej: -> "metrics", "metrics serve 9877")', 1
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    def report(self, since:str|None=None, until:str|None=None, verbose:bool=True, return_str:bool=False):
+        '''Función encargada de mostrar el uso acumulado por cuenta y por día.
+        since, until:   Fechas con formato 'año-mes-día' (until no incluido).
+        '''
+        try:
+            since, until = [datetime.fromisoformat(date) if date else None for date in (since, until)]
+        except ValueError:
+            to_print, to_return = 'Fecha inválida. Ingrese una fecha con formato: \'año-mes-día\'', 1
+        else:
+            to_print, to_return = self.ledger.format_report(self.ledger.report(since, until)), 0
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    def save_config(self, choosed_user:str) -> int:
+        '''Función encargada de guardar la configuracion del nuevo usuario a usar.
+        '''
+        if self.attribute_uuid != None:
+            print('Cierre la sesión primero y después cambie el usuario a usar.')
+            return 1
+        resolved = self.users.resolve(choosed_user)
+        if resolved is not None and resolved != choosed_user:
+            choosed_user = resolved
+            print('Se ha elegido por las iniciales al usuario: %s'%choosed_user)
+        if not choosed_user.endswith(('@nauta.com.cu', '@nauta.co.cu')):
+            print('Formato inválido. Ingrese un correo del tipo: \'@nauta.com.cu\' o \'@nauta.co.cu\'')
+            return 1
+        if choosed_user not in self.users:
+            print('Correo electrónico inválido. Elija uno entre los siguientes correos:')
+            for user in self.config['USERS']:
+                print(user)
+            return 1
+        self._use_account(choosed_user, persist=True)
+        return 0
+
+    def _use_account(self, username:str, persist:bool=False) -> None:
+        '''Función encargada de cambiar el usuario a usar en memoria y, si persist es True, guardarlo también en el
+        archivo de configuración.'''
+        self.user_pass = {'username':username,
+                          'password':self.config['USERS'][username]}
+        if persist:
+            os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
+            with open(self.config_file, 'w') as config_file:
+                self.config['CONFIG']['choose'] = username
+                self.config.write(config_file)
+
+    def __update_session_data(self, attribute_uuid:str|None) -> int:
+        '''Función encargada de guardar el parámetro ATTRIBUTE_UUID extraído de la respuesta de inicio de sesión
+        y crear la variable session_start_time a partir de la hora actual.
+        '''
+        self.session_start_time = datetime.now()
+        if attribute_uuid is not None:
+            self.attribute_uuid = attribute_uuid
+            counters = TrafficSampler.available() and self.traffic.read_counters()
+            self.traffic_baseline = {'boot_id': TrafficSampler.boot_id(), 'rx': counters[0], 'tx': counters[1], 'time': time()} if counters else None
+            self.start_traffic_sampler()
+            return 0
+        else:
+            self.session_start_time = None
+            return 1
+
+    @property
+    def session_store(self) -> SessionStore:
+        '''Archivo de sesión (internet_session.json) compartido de forma segura entre procesos.'''
+        if self._session_store is None:
+            self._session_store = SessionStore(self.logger_data_folder + 'internet_session.json')
+        return self._session_store
+
+    @property
+    def connection_store(self) -> SessionStore:
+        '''Archivo (connection_check.json) con el resultado de la última comprobación de la conexión, para que lo
+        aprovechen también las órdenes sueltas de la línea de comandos y no solo el modo interactivo y el demonio.'''
+        if self._connection_store is None:
+            self._connection_store = SessionStore(self.logger_data_folder + 'connection_check.json')
+        return self._connection_store
+
+    def _cached_connection(self, ttl:float) -> tuple:
+        '''Devuelve (True, resultado) si hay una comprobación de la conexión de hace menos de ttl segundos, en memoria
+        o en connection_check.json (la pudo hacer otro proceso), o (False, None) si hay que comprobarla de nuevo.'''
+        fresh = lambda cached: cached is not None and 0 <= time() - cached[0] < ttl
+        if not fresh(self._connection_cache):
+            try:
+                content = self.connection_store.load()
+            except (OSError, ValueError):
+                content = None
+            if isinstance(content, dict) and isinstance(content.get('time'), (int, float)):
+                self._connection_cache = (content['time'], content.get('result'))
+        if fresh(self._connection_cache):
+            return True, self._connection_cache[1]
+        return False, None
+
+    def _remember_connection(self, result:str|None, valid:bool=True) -> None:
+        '''Función encargada de guardar el resultado de una comprobación de la conexión, o de descartar el guardado
+        si valid es False (al iniciar o cerrar la sesión).'''
+        self._connection_cache = (time(), result) if valid else None
+        try:
+            self.connection_store.save({'time': self._connection_cache[0], 'result': result} if valid else {})
+        except OSError:
+            pass
 
     def __save_session_data(self) -> int:
-        '''Función encargada de guardar los datos en el archivo internet_session.yaml.
+        '''Función encargada de guardar los datos en el archivo internet_session.json.
         '''
-        os.makedirs(self.logger_data_folder, exist_ok=True)
-        try:
-            with open(self.logger_data_folder+'internet_session.yaml' if os.access(self.logger_data_folder+'internet_session.yaml', os.F_OK) else self.logger_data_folder+'internet_session.yml', 'w') as file:
-                safe_dump({'ATTRIBUTE_UUID': self.attribute_uuid,
-                           'session_start_time': str(self.session_start_time) if self.session_start_time != None else None,
-                           'initial_left_time': self.initial_left_time,
-                           'connection_type': self.connection_type},
-                           file)
-        except FileNotFoundError:
-            print('Archivo %sinternet_session.yaml no encontrado!'%self.logger_data_folder)
+        try:
+            self.session_store.save({'ATTRIBUTE_UUID': self.attribute_uuid,
+                                     'username': self.user_pass['username'] if self.attribute_uuid else None,
+                                     'session_start_time': str(self.session_start_time) if self.session_start_time != None else None,
+                                     'initial_left_time': self.initial_left_time,
+                                     'connection_type': self.connection_type,
+                                     'left_time_sync': self.estimator.to_dict(),
+                                     'traffic': self.traffic_baseline})
+        except OSError as e:
+            print('No se pudo guardar el archivo %sinternet_session.json: %s'%(self.logger_data_folder, e))
             return 1
         return 0
 
+    def __migrate_session_data(self) -> dict|None:
+        '''Función encargada de convertir el archivo de sesión antiguo internet_session.yml (o .yaml) al formato
+        JSON. Devuelve los datos migrados, o None si no hay archivo antiguo.
+        '''
+        for extension in ['yml', 'yaml']:
+            old_file = self.logger_data_folder + 'internet_session.%s'%extension
+            if not os.access(old_file, os.F_OK):
+                continue
+            from yaml import safe_load
+            with open(old_file, 'r') as file:
+                content = safe_load(file) or {}
+            self.attribute_uuid = content.get('ATTRIBUTE_UUID')
+            self.initial_left_time = content.get('initial_left_time')
+            self.connection_type = content.get('connection_type')
+            self.session_start_time = datetime.fromisoformat(content['session_start_time']) if content.get('session_start_time') else None
+            if self.__save_session_data() == 0:
+                os.remove(old_file)
+            return content
+        return None
+
     def _load_session_data(self, verbose:bool=False) -> None:
-        '''Función encargada de cargar los datos de sesión del archivo internet_session.yaml.
+        '''Función encargada de cargar los datos de sesión del archivo internet_session.json.
+        Si solo existe el archivo antiguo internet_session.yml (o .yaml), se convierte al nuevo formato.
         '''
-        for i in range(2):
-            try:
-                ok = [0, 0, 0, 0]
-                with open(self.logger_data_folder + 'internet_session.%s'%['yml', 'yaml'][i], 'r') as file:
-                    content = safe_load(file)
-                    self.attribute_uuid = content['ATTRIBUTE_UUID']
-                    ok[0] = 1
-                    self.initial_left_time = content['initial_left_time']
-                    ok[1] = 1
-                    self.connection_type = content['connection_type']
-                    ok[2] = 1
-                try:
-                    self.session_start_time = datetime.fromisoformat(content['session_start_time'])
-                    ok[3] = 1
-                except TypeError:
-                    self.session_start_time = None
-                if all(ok) and verbose:
-                    print('Datos de sesión cargados con éxito.') if verbose else None
-                return
-            except FileNotFoundError:
-                print('Archivo con los datos de sesión no encontrado.') if (verbose and i == 1) else None
-
-    def __html(self, source:bytes|str, name_of_html='response.html', save=True) -> int:
-        '''Función encargada de trabajar con el archivo html que responde el servidor.
-        save:   Guarda el archivo html en la ruta self.logger_data_folder/response.html si save es True, de otra manera lo elimina si es que existe.'''
-        if not isinstance(source, (bytes, str)):
-            raise TypeError('El argumento -> source <- debe ser de tipo bytes o str')
-        if not isinstance(name_of_html, str):
-            raise TypeError('El argumento -> name_of_html <- debe ser de tipo str')
-        if isinstance(save, bool):
-            abs_route = self.logger_data_folder + name_of_html
-            if save:
-                with open(abs_route, 'wb' if isinstance(source, bytes) else 'w') as file:
-                    file.write(source)
-                return 0
+        try:
+            content = self.session_store.load()
+        except ValueError:
+            print('Archivo con los datos de sesión inválido.') if verbose else None
+            return
+        if content is None:
+            if self.__migrate_session_data() is None:
+                print('Archivo con los datos de sesión no encontrado.') if verbose else None
             else:
-                if os.access(abs_route, os.F_OK):
-                    try:
-                        os.remove(abs_route)
-                    except PermissionError:
-                        print('No tiene suficientes permisos para eliminar el archivo html: {}'.format(abs_route))
-                    return 0
-                return 1
-        else:
-            raise Exception('Llamada a la función EtecsaLogger.html() incorrecta. Especifique el parámetro save como True o False')
+                print('Datos de sesión cargados con éxito.') if verbose else None
+            return
+        self.attribute_uuid = content.get('ATTRIBUTE_UUID')
+        self.initial_left_time = content.get('initial_left_time')
+        self.connection_type = content.get('connection_type')
+        self.session_start_time = datetime.fromisoformat(content['session_start_time']) if content.get('session_start_time') else None
+        self.estimator.load(content.get('left_time_sync'))
+        self.traffic_baseline = content.get('traffic')
+        username = content.get('username')
+        if self.attribute_uuid and username in self.config['USERS'] and username != self.user_pass['username']:
+            self._use_account(username)  # La sesión la abrió otro proceso con otra cuenta (por ejemplo, con auto).
+        print('Datos de sesión cargados con éxito.') if verbose else None
 
+    @metrics.instrument('get_left_time')
     def get_left_time_from_server(self) -> str:
         '''Función encargada de obtener el tiempo restante de la sesión al momento de crearla.
         '''
@@ -219,13 +2233,61 @@ class EtecsaLogger():
                            'username': self.user_pass['username'],
                            'ATTRIBUTE_UUID': self.attribute_uuid,
                            }
-                response = requests.post(url=self.HOST+self.get_time_endpoint, data=payload, timeout=10)
+                with metrics.phase('post'):
+                    response = self._post_query(payload)
                 if response.text != 'errorop':
+                    self._sync_left_time(response.text)
                     return response.text
-            except requests.exceptions.SSLError:
-                pass
+            except requests.exceptions.RequestException as e:  # Consulta de mejor esfuerzo: la sesión ya existe.
+                self._count_request_error(e)
         return '??:??:??'
 
+    def _timed_query(self, payload:dict) -> 'requests.Response':
+        start = perf_counter()
+        response = self.http.post(url=self.HOST+self.get_time_endpoint, data=payload, timeout=self.policy.timeout('query'))
+        self.policy.observe(perf_counter() - start)
+        return response
+
+    def _hedged_query(self, payload:dict) -> 'requests.Response':
+        '''Función encargada de enviar la consulta y, si tarda más que el percentil 95 observado, una copia. Devuelve la
+        primera respuesta recibida, o lanza la excepción de la última petición si ambas fallan.'''
+        delay = self.policy.hedge_delay()
+        if delay is None:
+            return self._timed_query(payload)
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            pending = [executor.submit(copy_context().run, self._timed_query, payload)]
+            done, _ = futures.wait(pending, timeout=delay)
+            if not done:
+                metrics.inc('etecsa_logger_hedged_requests_total', {'endpoint': 'query'})
+                pending.append(executor.submit(copy_context().run, self._timed_query, payload))
+            for future in futures.as_completed(pending):
+                try:
+                    return future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+            raise error
+        finally:
+            executor.shutdown(wait=False)
+
+    def _post_query(self, payload:dict) -> 'requests.Response':
+        '''Función encargada de enviar la consulta del tiempo restante con la política de reintentos: los errores de
+        conexión, los tiempos agotados y las respuestas 5xx se reintentan hasta query_retries veces.'''
+        for attempt in range(self.policy.retries + 1):
+            last = attempt == self.policy.retries
+            try:
+                response = self._hedged_query(payload)
+            except requests.exceptions.SSLError:
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if last:
+                    raise
+            else:
+                if response.status_code < 500 or last:
+                    return response
+            metrics.inc('etecsa_logger_retries_total', {'endpoint': 'query'})
+            sleep(self.policy.backoff(attempt))
+
     def onTime(self) -> int:
         '''Función encargada de devolver el tiempo que la sesión ha estado activa.
         '''
@@ -234,18 +2296,41 @@ class EtecsaLogger():
             onTime = (datetime.now() - self.session_start_time).total_seconds()
         return onTime
 
+    def _sync_left_time(self, left_time:str) -> None:
+        '''Función encargada de registrar el tiempo restante devuelto por el servidor en el estimador y en las cuentas.'''
+        seconds = time_to_seconds(left_time)
+        if seconds is None:
+            self._capture_error('query')
+        self.pool.update(self.user_pass['username'], left_time=seconds)
+        if seconds is not None:
+            self.estimator.sync(seconds)
+
+    def reconcile_left_time(self) -> int:
+        '''Función encargada de consultar el tiempo restante al servidor si el estimador lo indica (cada vez más a
+        menudo a medida que se acerca el final de la sesión o si la estimación no coincidía con el servidor).
+        Devuelve 0 si se consultó al servidor con éxito.'''
+        if not self.attribute_uuid or not self.estimator.due():
+            return 1
+        return self._finish_reconcile(self.get_left_time_from_server())
+
+    def _finish_reconcile(self, left_time:str) -> int:
+        if left_time == '??:??:??':
+            return 1
+        self.__save_session_data()
+        return 0
+
     def get_left_time(self) -> str:
         '''Función encargada de calcular el tiempo restante de la sesión. (Si es que existe alguna.)
+        Se usa el estimador sincronizado con el servidor y, si no tiene datos, el tiempo inicial menos el tiempo en línea.
         '''
         if not self.attribute_uuid:
             return 'No existen los datos de la sesión.'
-        try:
-            hours, minutes, seconds = map(lambda x:int(x), self.initial_left_time.split(':'))
-        except (AttributeError, ValueError):
-            return '??:??:??'
-        time = hours*3600 + minutes*60 + seconds
-        on_time = self.onTime()
-        left_time = time - on_time
+        left_time = self.estimator.estimate()
+        if left_time is None:
+            initial_left_time = time_to_seconds(self.initial_left_time)
+            if initial_left_time is None:
+                return '??:??:??'
+            left_time = initial_left_time - self.onTime()
         if left_time < 0:
             return 'Se agotó el tiempo de la sesión.'
         left_hours = left_time//3600
@@ -256,69 +2341,289 @@ class EtecsaLogger():
     def reestablecer_variables(self, save_to_file:bool=False) -> None:
         '''Función encargada de reestablecer los valores de las variables a su valor por defecto (None).'''
         self.attribute_uuid, self.session_start_time, self.initial_left_time, self.connection_type = [None for i in range(4)]
+        self.estimator.reset()
+        self.traffic_baseline = None
+        if self._traffic is not None:
+            self._traffic.stop()
         if save_to_file:
             self.__save_session_data()
 
-    def _check_connection(self, timeout:float=1) -> str:
+    @property
+    def prober(self) -> ICMPProber:
+        '''Sondeador ICMP compartido por _check_connection y el comando ping.'''
+        if self._prober is None:
+            self._prober = ICMPProber()
+        return self._prober
+
+    def _http_probe(self, timeout:float=1.0) -> int:
+        '''Función encargada de comprobar la salida a internet mediante HTTP (no necesita privilegios de root).
+        Devuelve 0 si la URL de prueba (opción probe_url de [CONFIG]) responde con 204, de otra manera (portal cautivo,
+        sin red) devuelve 1.
+        '''
+        probe_url = self.config['CONFIG'].get('probe_url', fallback='http://clients3.google.com/generate_204')
+        try:
+            response = requests.get(probe_url, allow_redirects=False, timeout=(timeout, timeout))
+        except requests.exceptions.RequestException:
+            return 1
+        return 0 if response.status_code == 204 else 1
+
+    @metrics.instrument('check_connection')
+    def _check_connection(self, timeout:float=1, use_cache:bool=True) -> str:
         '''Función encargada de chequear si existe conexión a internet.
+        Las pruebas (ping a internet, ping a la intranet y prueba HTTP) se lanzan a la vez y se toma la primera
+        respuesta útil. El resultado se guarda durante check_ttl segundos (opción de [CONFIG]), en memoria y en
+        connection_check.json.
         timeout:    Tiempo máximo del ping, en segundos.
+        use_cache:  Usar el último resultado si aún no ha caducado.
         '''
-        internet, intranet = None, None
-        internet = True if ping('8.8.8.8', timeout) == 0 else False
-        if not internet:
-            intranet = True if ping('190.92.127.78', timeout) == 0 else False
-        return 'internet' if internet else ('intranet' if intranet else None)
+        ttl = self.config['CONFIG'].getfloat('check_ttl', fallback=5.0)
+        if use_cache:
+            cached, result = self._cached_connection(ttl)
+            if cached:
+                return result
+        result = None
+        probe_start = perf_counter()
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        icmp = executor.submit(lambda: self.prober.ping_many(['8.8.8.8', '190.92.127.78'], timeout, until='8.8.8.8'))
+        http = executor.submit(self._http_probe, timeout)
+        try:
+            for future in futures.as_completed([icmp, http], timeout=timeout*2):
+                try:
+                    answer = future.result()
+                except OSError:
+                    continue
+                if future is http:
+                    if answer == 0:
+                        result = 'internet'
+                        break
+                elif answer['8.8.8.8'] is not None:
+                    result = 'internet'
+                    break
+                elif answer['190.92.127.78'] is not None:
+                    result = 'intranet'
+        except futures.TimeoutError:
+            pass
+        executor.shutdown(wait=False, cancel_futures=True)
+        metrics.observe_phase('probe', perf_counter() - probe_start)
+        self._remember_connection(result)
+        return result
+
+    def _count_request_error(self, error:Exception) -> None:
+        '''Función encargada de contar los errores SSL, los tiempos de espera agotados y los demás errores de conexión
+        en las métricas.'''
+        if isinstance(error, requests.exceptions.Timeout):
+            metrics.inc('etecsa_logger_timeouts_total', {'operation': metrics.current_operation.get()})
+        elif isinstance(error, requests.exceptions.SSLError):
+            metrics.inc('etecsa_logger_ssl_errors_total', {'operation': metrics.current_operation.get()})
+        else:
+            metrics.inc('etecsa_logger_connection_errors_total', {'operation': metrics.current_operation.get()})
+
+    def _request_error(self, error:Exception) -> str:
+        '''Función encargada de traducir la excepción de una petición fallida a un mensaje para el usuario.'''
+        self._count_request_error(error)
+        if isinstance(error, requests.exceptions.Timeout) and not isinstance(error, requests.exceptions.ConnectionError):
+            return 'El servidor no respondió en un tiempo dado.'
+        if isinstance(error, requests.exceptions.SSLError):
+            to_print = 'Hubo un error al establecer la conexión SSL/TLS con el servidor.'
+        else:
+            to_print = 'Hubo un error al realizar la petición.'
+        return to_print + ' Inténtelo de nuevo.'
+
+    def _parse_login_response(self, chunks) -> LoginResult:
+        '''Función encargada de analizar la respuesta de /LoginServlet, dada como un iterable de fragmentos en bytes.
+        Deja de consumir fragmentos en cuanto se conoce el resultado. Si no hay error, se guarda el ATTRIBUTE_UUID
+        de la respuesta.
+        '''
+        parser = LoginResponseParser(self.__error_messages)
+        for chunk in chunks:
+            if parser.feed(chunk):
+                break
+        else:
+            parser.feed(b'', final=True)
+        result = parser.result()
+        # Sin error ni ATTRIBUTE_UUID la respuesta no se reconoce: last_error queda en None, como tras un error de conexión.
+        self.last_error = result.error if result.error != -1 or result.attribute_uuid is not None else None
+        self.portal_tokens = result.tokens
+        self.policy.breaker.record(self.user_pass['username'], result.error in (4, 5))
+        if result.error != -1:
+            metrics.inc('etecsa_logger_portal_errors_total', {'message': self.__error_messages[result.error]})
+            if result.error in (0, 4, 5):
+                self.pool.update(self.user_pass['username'], left_time=0 if result.error == 0 else None,
+                                 error=self.__error_messages[result.error], block=result.error != 0)
+        else:
+            self.__update_session_data(result.attribute_uuid)
+        return result
+
+    @staticmethod
+    def _drain(response, limit:int=65536) -> None:
+        '''Función encargada de descartar el resto de una respuesta leída en modo stream para que la conexión pueda
+        volver al pool. Si quedan más de limit bytes se cierra la conexión.'''
+        received = 0
+        if not response._content_consumed:  # Si el analizador leyó la respuesta completa no queda nada que descartar.
+            for chunk in response.iter_content(chunk_size=8192):
+                received += len(chunk)
+                if received > limit:
+                    break
+        response.close()
+
+    def _capture_error(self, operation:str) -> None:
+        '''Función encargada de guardar la captura de las últimas respuestas cuando el portal respondió algo que no se
+        pudo interpretar (por ejemplo, porque cambió el formato de sus páginas).'''
+        metrics.inc('etecsa_logger_unrecognized_responses_total', {'operation': operation})
+        file_route = responses.dump_on_error(self.logger_data_folder, operation)
+        if file_route is not None:
+            print('Respuesta no reconocida del portal. Últimas respuestas guardadas en "%s".'%file_route)
+
+    def capture(self, args:list, verbose:bool=True, return_str:bool=False):
+        '''Función encargada de mostrar las últimas respuestas capturadas (args vacío) o de guardarlas en un archivo
+        zip en logger_data (['dump']).'''
+        to_return = 0
+        if args not in ([], ['dump']):
+            to_print, to_return = 'Comando inválido. (Ej: -> "capture", "capture dump")', 1
+        elif not len(responses):
+            to_print, to_return = 'No hay respuestas capturadas.', 1 if args else 0
+        elif not args:
+            to_print = '%s\n%d respuestas, %s comprimidas.'%(responses, len(responses), TrafficSampler.format_bytes(responses.memory()))
+        else:
+            file_route = responses.file_route(self.logger_data_folder)
+            to_print = '%d respuestas guardadas en "%s".'%(responses.dump(file_route), file_route)
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    def _error_message(self, p_error:int) -> str:
+        return self.__error_messages[p_error]
+
+    def _save_new_session(self) -> None:
+        '''Función encargada de guardar los datos de la sesión recién creada antes de consultar el tiempo restante, así
+        se puede cerrar aunque la consulta falle o el proceso termine antes de tiempo.'''
+        self.connection_type = 'internet' if self.user_pass['username'].endswith('@nauta.com.cu') else 'intranet'
+        self.__save_session_data()
+
+    def _finish_login(self) -> str:
+        '''Función encargada de guardar los datos de la sesión recién creada (una vez conocido el tiempo restante).
+        Devuelve el mensaje a mostrar.'''
+        self.__save_session_data()
+        self._remember_connection(None, valid=False)
+        return 'Conexión a {connection_type} creada.\nCuenta: {username}\nTiempo disponible: {left_time}'.format(connection_type=self.connection_type.upper(), username=self.user_pass['username'], left_time=self.initial_left_time)
+
+    def _parse_logout_response(self, text:str) -> tuple:
+        '''Función encargada de analizar la respuesta de /LogoutServlet y reestablecer los datos de la sesión.
+        Devuelve la tupla (mensaje, estado).'''
+        to_return = 1
+        actual_time = self.get_left_time()
+        traffic = self.traffic_summary()
+        if text == "logoutcallback('SUCCESS');":
+            self.pool.update(self.user_pass['username'], left_time=time_to_seconds(actual_time))
+        if isinstance(self.session_start_time, datetime):
+            outcome = {"logoutcallback('SUCCESS');": 'SUCCESS', "logoutcallback('FAILURE');": 'FAILURE'}.get(text, 'OTHER')
+            self.ledger.append(self.user_pass['username'], self.connection_type, self.session_start_time, datetime.now(),
+                               time_to_seconds(self.initial_left_time), time_to_seconds(actual_time), outcome, traffic)
+        self.reestablecer_variables()
+        self._remember_connection(None, valid=False)
+        if text not in ("logoutcallback('SUCCESS');", "logoutcallback('FAILURE');"):
+            self._capture_error('logout')
+        if text == "logoutcallback('SUCCESS');":
+            self.__save_session_data()
+            self.stop_watchdog()  # Si la vigilancia siguiera en curso, volvería a iniciar la sesión.
+            to_print = 'Sesión cerrada con éxito. (Tiempo restante: {actual_time})'.format(actual_time=actual_time)
+            if traffic is not None:
+                self.last_traffic = traffic
+                to_print += '\nTráfico: %s'%TrafficSampler.format_summary(traffic)
+            to_return = 0
+        elif text == "logoutcallback('FAILURE');":
+            self.__save_session_data()
+            to_print = 'Hubo un fallo al cerrar la sesión debido a datos incorrectos o a una sesión vencida.'
+        else:
+            to_print = text
+        return to_print, to_return
+
+    @metrics.instrument('prepare')
+    def prepare(self, verbose:bool=True, return_str:bool=False):
+        '''Función encargada de preparar el próximo inicio de sesión: resuelve y guarda la dirección del portal, abre la
+        conexión TLS (que queda abierta en el pool) y obtiene los parámetros del formulario del portal (CSRFHW,
+        wlanuserip, ...), de modo que login() solo tenga que enviar la petición POST. La preparación caduca a los
+        prepare_ttl segundos (opción de [CONFIG]) o al usarse.
+        '''
+        to_return = 1
+        options = self.config['CONFIG']
+        parts = urlsplit(self.HOST)
+        try:
+            with metrics.phase('dns'):
+                address = dns_cache.resolve(parts.hostname, parts.port or 443, options.getfloat('dns_ttl', fallback=300))
+            with metrics.phase('get'):
+                response = self.http.get(url=self.HOST+'/', timeout=self.policy.timeout('login'), stream=True)
+            with metrics.phase('parse'):
+                tokens = self._parse_portal_form(response.iter_content(chunk_size=1024))
+            self._drain(response)
+        except requests.exceptions.RequestException as e:
+            to_print = self._request_error(e)
+        except OSError:
+            to_print = 'No se pudo resolver la dirección de %s.'%parts.hostname
+        else:
+            self._prepared = (monotonic() + options.getfloat('prepare_ttl', fallback=60), tokens)
+            to_print = 'Inicio de sesión preparado. (%s, %d parámetros del portal)'%(address, len(tokens))
+            to_return = 0
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    def _parse_portal_form(self, chunks) -> dict:
+        '''Función encargada de extraer los parámetros del formulario del portal, dado como un iterable de fragmentos en bytes.'''
+        parser = LoginResponseParser(self.__error_messages)
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.feed(b'', final=True)
+        return parser.tokens
+
+    def _login_payload(self) -> dict:
+        '''Datos de la petición a /LoginServlet: el usuario y la contraseña, más los parámetros del portal obtenidos
+        por prepare() si aún no caducaron. Cada preparación se usa una sola vez.'''
+        prepared, self._prepared = self._prepared, None
+        if prepared is None or monotonic() > prepared[0]:
+            return self.user_pass
+        return dict(prepared[1], **self.user_pass)
 
+    @metrics.instrument('login')
     def login(self, verbose:bool=True, return_str:bool=False):
         '''Función encargada de iniciar la sesión de internet.
         '''
         hay_conexion = self._check_connection()
         to_return = 1
-        if not hay_conexion:
+        self.last_error = None
+        circuit_message = self._circuit_message() if not hay_conexion else None
+        if circuit_message:
+            to_print = circuit_message
+        elif not hay_conexion:
             #Peticion POST a /LoginServlet con los datos username y password.
-            exception = 1
             try:
-                response = requests.post(url=self.HOST+self.login_endpoint,
-                                         data=self.user_pass,
-                                         allow_redirects=True
-                                         )
-                exception = 0
-            
-            except requests.exceptions.ConnectionError as e:
-
-                if isinstance(e, requests.exceptions.SSLError):
-                    to_print = 'Hubo un error al establecer la conexión SSL/TLS con el servidor.'
-                else:
-                    to_print = 'Hubo un error al realizar la petición.'
-
-                to_print += ' Inténtelo de nuevo.'
-
-            except requests.exceptions.Timeout:
-                to_print = 'El servidor no respondió en un tiempo dado.'
-            
-            if not exception:
-                for pos, error_msg in enumerate(self.__error_messages):
-                    if error_msg in response.text:
-                        p_error = pos
-                        break
-                else:
-                    p_error = -1 # No error in response
-
-                if p_error != -1:
-                    to_print = self.__error_messages[p_error]
+                with metrics.phase('post'):
+                    response = self.http.post(url=self.HOST+self.login_endpoint,
+                                              data=self._login_payload(),
+                                              allow_redirects=True,
+                                              timeout=self.policy.timeout('login'),
+                                              stream=True
+                                              )
+                with metrics.phase('parse'):
+                    result = self._parse_login_response(response.iter_content(chunk_size=1024))
+                self._drain(response)
+            except requests.exceptions.RequestException as e:
+                to_print = self._request_error(e)
+            else:
+                if result.error != -1:
+                    to_print = self._error_message(result.error)
+                elif result.attribute_uuid is None:
+                    self._capture_error('login')
+                    to_print = 'No se reconoció la respuesta del portal (no contiene el ATTRIBUTE_UUID de la sesión).'
                 else:
-                    self.__update_session_data(response)
+                    self._save_new_session()
                     self.initial_left_time = self.get_left_time_from_server()
-                    self.connection_type = 'internet' if self.user_pass['username'].endswith('@nauta.com.cu') else 'intranet'
-                    self.__save_session_data()
-                    #self.__html(response.content, save=True) # For debugging
-                    to_print = 'Conexión a {connection_type} creada.\nCuenta: {username}\nTiempo disponible: {left_time}'.format(connection_type=self.connection_type.upper(), username=self.user_pass['username'], left_time=self.initial_left_time)
+                    to_print = self._finish_login()
                     to_return = 0
         else:
             to_print = 'Ya hay conexión. (%s)'%hay_conexion
         print(to_print) if verbose else None
         return to_print if return_str else to_return
 
+    @metrics.instrument('logout')
     def logout(self, verbose:bool=True, return_str:bool=False):
         '''Función encargada de cerrar la sesión. (Si es que existe alguna.)
         '''
@@ -326,90 +2631,197 @@ class EtecsaLogger():
         to_return = 1
         if self.attribute_uuid:
             #Peticion POST a /LogoutServlet con los datos username y ATTRIBUTE_UUID.
-            exception = 1
             try:
-                response = requests.post(url=self.HOST+self.logout_endpoint,
-                                         data={'username': self.user_pass['username'],
-                                               'ATTRIBUTE_UUID': self.attribute_uuid},
-                                               allow_redirects=True
-                                               )
-                exception = 0
-            except requests.exceptions.ConnectionError as e:
-
-                if isinstance(e, requests.exceptions.SSLError):
-                    to_print = 'Hubo un error al establecer la conexión SSL/TLS con el servidor.'
-                else:
-                    to_print = 'Hubo un error al realizar la petición.'
-
-                to_print += ' Inténtelo de nuevo.'
-
-            except requests.exceptions.Timeout:
-                to_print = 'El servidor no respondió en un tiempo dado.'
-
-            if not exception:
-                #self.__html(response.content, save=False) # For debugging
-                actual_time = self.get_left_time()
-                self.reestablecer_variables()
-                if response.text == "logoutcallback('SUCCESS');":
-                    self.__save_session_data()
-                    to_print = 'Sesión cerrada con éxito. (Tiempo restante: {actual_time})'.format(actual_time=actual_time)
-                    to_return = 0
-                elif response.text == "logoutcallback('FAILURE');":
-                    self.__save_session_data()
-                    to_print = 'Hubo un fallo al cerrar la sesión debido a datos incorrectos o a una sesión vencida.'
-                else:
-                    to_print = response.text
+                with metrics.phase('post'):
+                    response = self.http.post(url=self.HOST+self.logout_endpoint,
+                                              data={'username': self.user_pass['username'],
+                                                    'ATTRIBUTE_UUID': self.attribute_uuid},
+                                              allow_redirects=True,
+                                              timeout=self.policy.timeout('logout')
+                                              )
+            except requests.exceptions.RequestException as e:
+                to_print = self._request_error(e)
+            else:
+                with metrics.phase('parse'):
+                    to_print, to_return = self._parse_logout_response(response.text)
         else:
             to_print = 'No existen los datos de la sesión.'
         print(to_print) if verbose else None
         return to_print if return_str else to_return
 
+    def auto_login(self, connection_type:str='internet', verbose:bool=True, return_str:bool=False):
+        '''Función encargada de iniciar la sesión con la cuenta con más tiempo restante para el tipo de conexión pedido.
+        Si el servidor responde que la cuenta no tiene saldo o que hubo muchos intentos, se pasa a la siguiente cuenta.
+        '''
+        to_return = 1
+        if connection_type not in AccountPool.domains:
+            to_print = 'Tipo de conexión inválido. Elija entre: %s'%', '.join(AccountPool.domains)
+        elif self.attribute_uuid:
+            to_print = 'Cierre la sesión primero y después cambie el usuario a usar.'
+        else:
+            to_print = 'No hay cuentas disponibles para %s.'%connection_type
+            chosen = self.user_pass
+            for username in self.pool.candidates(connection_type):
+                if not self.policy.breaker.allow(username):
+                    continue  # La cuenta tiene el interruptor abierto: se pasa a la siguiente sin contactar al portal.
+                self._use_account(username)
+                print('Probando con la cuenta: %s'%username) if verbose else None
+                to_print = self.login(verbose=False, return_str=True)
+                if self.attribute_uuid:
+                    self._use_account(username, persist=True)
+                    to_return = 0
+                    break
+                if self.last_error not in (0, 4, 5):
+                    break
+                print(to_print) if verbose else None
+            if to_return:
+                self.user_pass = chosen  # Ninguna cuenta sirvió: se mantiene la elegida en la configuración.
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    def watchdog(self, verbose:bool=True, session=None) -> int:
+        '''Función encargada de vigilar la conexión y volver a iniciar la sesión cuando se cae.
+        El intervalo entre chequeos se duplica mientras el enlace esté estable (de watchdog_min_interval a
+        watchdog_max_interval segundos, opciones de [CONFIG]) y vuelve al mínimo tras una caída. Los inicios de sesión
+        fallidos se reintentan con espera exponencial aleatoria (watchdog_backoff, hasta watchdog_backoff_max); si el
+        servidor está ocupado o hubo muchos intentos la espera parte de watchdog_busy_backoff, y tras un error inesperado
+        (por ejemplo, de conexión en la consulta del tiempo restante) de watchdog_backoff.
+        Se detiene con Ctrl-C, con stop_watchdog() o al cerrar la sesión, también desde otro proceso: el archivo de
+        sesión se lee de nuevo en cada chequeo, así un "logger.py lo" no se deshace con un nuevo inicio de sesión.
+        session:    Ejecutor (de un solo hilo) en el que hacer las peticiones al portal, para no pisar el estado de la
+                    sesión que usan otras órdenes. Por defecto se hacen en el hilo actual.
+        '''
+        options = self.config['CONFIG']
+        min_interval = options.getfloat('watchdog_min_interval', fallback=5)
+        max_interval = options.getfloat('watchdog_max_interval', fallback=120)
+        backoff = options.getfloat('watchdog_backoff', fallback=5)
+        busy_backoff = options.getfloat('watchdog_busy_backoff', fallback=60)
+        backoff_max = options.getfloat('watchdog_backoff_max', fallback=900)
+        log = lambda msg: print('[%s] %s'%(datetime.now().strftime('%H:%M:%S'), msg)) if verbose else None
+        def call(function, *args, **kwargs):
+            if session is None:
+                return function(*args, **kwargs)
+            # En la cola de session puede haber un cierre de sesión que detenga la vigilancia antes de esta petición.
+            return session.submit(lambda: None if self._stop_event.is_set() else function(*args, **kwargs)).result()
+        interval, failures, down = min_interval, 0, 0
+        self._stop_event.clear()
+        self.start_traffic_sampler()
+        log('Vigilando la conexión. (Ctrl-C para salir)')
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    if call(self._session_closed_elsewhere):
+                        log('La sesión se cerró desde otro proceso.')
+                        break
+                    connected = call(self._check_connection, use_cache=False)
+                    if self._stop_event.is_set():
+                        break
+                    if connected:
+                        down = 0
+                        call(self.reconcile_left_time)
+                        self._stop_event.wait(interval)
+                        interval = min(interval*2, max_interval)
+                        continue
+                    interval = min_interval
+                    down += 1
+                    if down < 2 and self.attribute_uuid:
+                        # Confirmar la caída antes de volver a iniciar la sesión, dejando el inicio de sesión preparado.
+                        call(self.prepare, verbose=False)
+                        self._stop_event.wait(min_interval)
+                        continue
+                    log('Sin conexión. Iniciando sesión.')
+                    to_print = call(self.login, verbose=False, return_str=True)
+                    if self._stop_event.is_set():
+                        break
+                    log(to_print)
+                    if self.last_error == -1 or call(self._check_connection):
+                        failures, down = 0, 0
+                        self._stop_event.wait(min_interval)
+                        continue
+                    failures += 1
+                    base = busy_backoff if self.last_error in (4, 5, 6) else backoff
+                    delay = max(uniform(base, min(backoff_max, base * 2**failures)), self.policy.breaker.remaining(self.user_pass['username']))
+                except Exception as e:
+                    failures += 1
+                    delay = uniform(backoff, min(backoff_max, backoff * 2**failures))
+                    log('Error inesperado: %s'%(str(e) or type(e).__name__))
+                log('Reintentando en %.1f segundos.'%delay)
+                self._stop_event.wait(delay)
+        except KeyboardInterrupt:
+            pass
+        log('Vigilancia detenida.')
+        return 0
+
+    def _session_closed_elsewhere(self) -> bool:
+        '''Función encargada de leer de nuevo el archivo de sesión, que otro proceso pudo cambiar. Devuelve True si había
+        una sesión y ya no está (se cerró a propósito).'''
+        had_session = bool(self.attribute_uuid)
+        self._load_session_data()
+        return had_session and not self.attribute_uuid
+
+    def stop_watchdog(self) -> None:
+        '''Función encargada de detener el bucle de watchdog().'''
+        self._stop_event.set()
+
+    @staticmethod
+    def _parse_timer(time_:str) -> tuple:
+        '''Función encargada de convertir un tiempo con formato 'hora:minuto:segundo' (o 'minuto:segundo' o
+        'segundo') a segundos. Devuelve la tupla (segundos, mensaje de error o None).'''
+        correccion = 'Ingrese una cantidad de tiempo con formato: \'hora:minuto:segundo\''
+        hours, minutes, seconds = 0, 0, 0
+        n_sep = time_.count(':')
+        try:
+            if n_sep == 2:
+                hours, minutes, seconds = [float(i) for i in time_.split(':')]
+            elif n_sep == 1:
+                minutes, seconds = [float(i) for i in time_.split(':')]
+            elif n_sep == 0:
+                seconds = float(time_)
+            else:
+                return 0, 'Formato inválido. %s'%correccion
+        except ValueError:
+            return 0, 'Datos inválidos. %s'%correccion
+        return float(hours*60**2 + minutes*60 + seconds), None
+
     def time_that(self, time_:str, verbose=True, return_str:bool=False):
         '''Función encargada de establecer un temporizador después del cual se cerrará la sesión.
+        El cierre se programa en el planificador, por lo que si el proceso se interrumpe de otra forma que no sea
+        Ctrl-C, queda pendiente para la próxima vez que se ejecute "sched run".
         '''
+        to_return = 1
+        action_id = None
+        self.start_traffic_sampler()
         try:
             if not self.attribute_uuid:
                 to_print = 'No existen los datos de la sesión.'
-                to_return = 1
             else:
-                correccion = 'Ingrese una cantidad de tiempo con formato: \'hora:minuto:segundo\''
-                hours, minutes, seconds = 0, 0, 0
-                n_sep = time_.count(':')
-                to_return = 0
-                try:
-                    if n_sep == 2:
-                        hours, minutes, seconds = [float(i) for i in time_.split(':')]
-                    elif n_sep == 1:
-                        minutes, seconds = [float(i) for i in time_.split(':')]
-                    elif n_sep == 0:
-                        seconds = float(time_)
-                    else:
-                        to_print = 'Formato inválido. %s'%correccion
-                        to_return = 1
-                except ValueError:
-                    to_print = 'Datos inválidos. %s'%correccion
-                    to_return = 1
-                if not to_return:
-                    time_to_shutdown = float(hours*60**2 + minutes*60 + seconds)
-                    print('Waiting %0.2d:%0.2d:%0.3f'%(hours, minutes, seconds))
+                time_to_shutdown, to_print = self._parse_timer(time_)
+                if to_print is None:
+                    print('Waiting %0.2d:%0.2d:%06.3f'%(time_to_shutdown//3600, (time_to_shutdown%3600)//60, time_to_shutdown%60))
+                    action_id = self.scheduler.schedule('logout', at=time() + time_to_shutdown)
                     try:
-                        for i in tqdm(range(100)):
-                            sleep(time_to_shutdown/100)
-                    except NameError:
-                        total_movements = 50
-                        bar = ['-' for i in range(total_movements)]
-                        percentage = 0
-                        for i in range(total_movements):
-                            bar[i] = '#'
-                            percentage += round(1/total_movements*100)
-                            print(''.join(bar) + ' %d'%percentage + '%', end='\r', flush=True)
-                            sleep(time_to_shutdown/total_movements)
-                    print('\nCerrando sesión.')
-                    status = 1
-                    while status == 1:
-                        status = self.logout(verbose=verbose, return_str=return_str)
-                    return status
+                        from tqdm import tqdm
+                        bar = tqdm(total=100)
+                        def on_tick(action, remaining):
+                            if action == action_id:
+                                bar.update(int(100 * (1 - remaining / time_to_shutdown)) - bar.n if time_to_shutdown else 0)
+                    except ModuleNotFoundError:
+                        print('Módulo tqdm no encontrado. Ejecute "pip install tqdm" para obtenerlo.')
+                        bar = None
+                        def on_tick(action, remaining):
+                            if action != action_id:
+                                return
+                            done = int(50 * (1 - remaining / time_to_shutdown)) if time_to_shutdown else 50
+                            print('#'*done + '-'*(50 - done) + ' %d'%(done*2) + '%', end='\r', flush=True)
+                    to_return = self.scheduler.run(until=action_id, verbose=verbose, on_tick=on_tick,
+                                                   tick=max(0.05, min(1.0, time_to_shutdown / 100)))
+                    if bar is not None:
+                        bar.update(100 - bar.n)
+                        bar.close()
+                    to_print = 'Temporizador terminado.' if to_return == 0 else 'No se pudo cerrar la sesión.'
         except KeyboardInterrupt:
+            if action_id is not None:
+                self.scheduler.cancel(action_id)
             to_print = 'Abortando temporizador.'
             to_return = 1
         print(to_print) if verbose else None
@@ -421,13 +2833,28 @@ class EtecsaLogger():
         msg_list = ['config --->  Muestra la configuración establecida. (Usuario a usar en la sesión.)',
                     'choose --->  Permite cambiar el usuario a usar en la sesión. (Ej: -> "choose usuario@nauta.com.cu")',
                     'l      --->  Inicia sesión con la cuenta de ETECSA \'%s\'.'%self.config['CONFIG']['choose'],
+                    'auto   --->  Inicia sesión con la cuenta con más tiempo restante. (Ej: -> "auto intranet")',
+                    'pool   --->  Muestra el estado de todas las cuentas.',
+                    'metrics -->  Muestra las métricas o las sirve por HTTP. (Ej: -> "metrics serve 9877")',
+                    'report --->  Muestra el uso por cuenta y por día. (Ej: -> "report 2026-01-01 2026-02-01")',
+                    'traffic -->  Muestra el tráfico y el caudal (actual, promedio y máximo) de la sesión.',
+                    'prep   --->  Prepara el próximo inicio de sesión (DNS, conexión TLS y parámetros del portal).',
                     'lo     --->  Termina la sesión. (Si es que existe una.)',
+                    'w      --->  Vigila la conexión y vuelve a iniciar la sesión si se cae.',
                     't      --->  Intenta determinar cuanto tiempo restante le queda a la cuenta.',
                     'time   --->  Programa el apagado de la sesión en un tiempo especificado. (Ej: -> "time 2:3" ==> [2 minutos y 3 segundos])',
+                    'timers --->  Muestra las tareas en segundo plano y las acciones programadas, con su progreso.',
+                    'cancel --->  Cancela una acción programada o una tarea en segundo plano. (Ej: -> "cancel 1", "cancel %2")',
+                    'sched  --->  Programa acciones. (Ej: -> "sched lo 14:30", "sched l 06:00", "sched lo <0:05:00", "sched cancel 1", "sched run")',
+                    'capture -->  Muestra las últimas respuestas del portal o las guarda en un zip en logger_data. (Ej: -> "capture", "capture dump")',
                     'load   --->  Intenta cargar un archivo de configuración existente.',
+                    'trace  --->  Registra los tiempos de cada comando en logger_data. (Ej: -> "trace on", "trace on chrome", "trace off", "logger.py --trace=chrome gt")',
+                    'daemon --->  Mantiene la sesión y las conexiones en memoria y atiende las órdenes l, lo, t, choose, time, prep, capture, auto, pool, sched y cancel de la línea de comandos. (Ej: -> "logger.py daemon", "logger.py daemon stop")',
                     'h      --->  Muestra el panel de ayuda.',
                     ]
-        help_msg = bar+'\nPanel de ayuda:\nComando      Descripción\n%s\n\n'%'\n'.join(msg_list).strip('\n')+bar
+        help_msg = bar+'\nPanel de ayuda:\nComando      Descripción\n%s\n\n'%'\n'.join(msg_list).strip('\n')
+        help_msg += 'Los usuarios y los comandos de consulta pueden escribirse por sus iniciales (si no son ambiguas); los demás\n'
+        help_msg += 'comandos necesitan su nombre completo. Todos se completan con Tab.\n'+bar
         return help_msg
     @property
     def config_msg(self):
@@ -438,6 +2865,9 @@ class EtecsaLogger():
              'Tiempo restante al momento de iniciar sesión': self.initial_left_time,
              'Tipo de conexión': self.connection_type.capitalize() if self.connection_type else None,
              }
+        traffic = self.traffic_summary() if self.attribute_uuid else None
+        if traffic is not None:
+            d['Tráfico'] = TrafficSampler.format_summary(traffic)
         for i in d:
             data += '%s: %s\n'%(i, d[i])
         bar_width = 18
@@ -446,110 +2876,1342 @@ class EtecsaLogger():
         config_msg = '{first_line}\n{content}\n{last_line}'.format(first_line=first_line, content=data, last_line='#'*len(first_line))
         return config_msg
 
-#################################################################### MAIN ####################################################################
+class AsyncResponse():
+    '''Respuesta de AsyncHTTPClient, con los mismos atributos básicos que requests.Response.'''
+    def __init__(self, url:str, status_code:int, headers:dict, content:bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
 
-def main():
-    logger = EtecsaLogger()
-
-    if len(argv) > 1:        
-        arg_1 = argv[1].lower().strip('-/')
-        if arg_1 == 'l':
-            if len(argv) == 2:
-                logger.login()
-            elif len(argv) == 3:
-                if argv[2].isdigit():
-                    logger.login()
-                    logger.time_that(argv[2])
-        elif arg_1 == 'lo':
-            logger.logout()
-        elif arg_1 in ['t?', 'gt']:
-            print(logger.get_left_time())
-        elif arg_1 in ['time', 'timer', 'timethat', 'time_that', 't']:
-            if not logger.attribute_uuid:
-                print('No existen los datos de la sesión.')
-                exit(1)
-            e = input('Ingrese un tiempo a esperar: ') if len(argv) < 3 else argv[2]
-            if e == 'q':
-                exit(0)
-            logger.time_that(e)
-        elif arg_1 in ['c', 'choose', 'e', 'elegir']:
-            username = input('Ingrese el usuario: ') if len(argv) < 3 else argv[2]
-            if username == 'q':
-                exit(0)
-            logger.save_config(username)
-        elif arg_1 in ['config', 'options', 'opciones']:
-            print(logger.config_msg)
-        elif arg_1 in ['h', 'help', '/?', '?']:
-            print(logger.help)
-    else:
-        try:
+    @property
+    def encoding(self) -> str:
+        content_type = self.headers.get('content-type', '')
+        for param in content_type.split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'charset':
+                return value.strip('"\'')
+        return 'ISO-8859-1' if content_type.startswith('text/') else 'utf-8'
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding, errors='replace')
+
+class AsyncHTTPClient():
+    '''Cliente HTTP/1.1 mínimo sobre asyncio, con conexiones keep-alive reutilizables.
+    pool_size:  Número máximo de conexiones abiertas a la vez.
+    timeout:    Tupla (conexión, lectura) con los tiempos máximos de espera, en segundos.
+    '''
+    def __init__(self, pool_size:int=2, timeout:tuple=(5.0, 15.0)):
+        self.timeout = timeout
+        self.idle = {}
+        self.semaphore = asyncio.Semaphore(pool_size)
+        self.ssl_context = ssl.create_default_context()
+
+    async def __connect(self, scheme:str, host:str, port:int, timeout:tuple) -> tuple:
+        key = (scheme, host, port)
+        while self.idle.get(key):
+            reader, writer = self.idle[key].pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        address = dns_cache.get(host)
+        with metrics.phase('connect'):
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(address or host, port,
+                                                                                ssl=self.ssl_context if scheme == 'https' else None,
+                                                                                server_hostname=host if scheme == 'https' else None),
+                                                        timeout[0])
+            except (OSError, asyncio.TimeoutError):
+                dns_cache.discard(host)
+                raise
+        return reader, writer, False
+
+    @staticmethod
+    async def __read_body(reader:'asyncio.StreamReader', headers:dict) -> tuple:
+        '''Lee el cuerpo de la respuesta. Devuelve (cuerpo, la conexión puede reutilizarse).'''
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
             while True:
-                entrada = input('-> ').lower().strip('-/ ')
-                entrada_lista = entrada.split()
-                if entrada == '':
-                    continue
-                elif entrada in ['l', 'login']:
-                    try:
-                        logger.login()
-                    except requests.ConnectionError:
-                        print('Error de conexión.')
-                elif entrada in ['lo', 'logout']:
-                    try:
-                        logger.logout()
-                    except requests.ConnectionError:
-                        print('Error de conexión.')
-                elif entrada in ['t?', 'gt']:
-                    print(logger.get_left_time())
-                elif entrada in ['onlinetime', 'online_time', 'ontime']:
-                    print(logger.onTime())
-                elif any([entrada.split()[0] == i for i in ['time', 'timer', 'timethat', 'time_that', 't']]):
-                    if not logger.attribute_uuid:
-                        print('No existen los datos de la sesión.')
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readuntil(b'\r\n')
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return b''.join(chunks), True
+        if 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length'])), True
+        return await reader.read(), False
+
+    async def request(self, method:str, url:str, data:dict|None=None, timeout:tuple|None=None, max_redirects:int=5) -> AsyncResponse:
+        '''Función encargada de realizar una petición HTTP, siguiendo hasta max_redirects redirecciones.'''
+        timeout = timeout or self.timeout
+        for _ in range(max_redirects + 1):
+            with span('http', method=method, url=urlsplit(url).path):
+                start = perf_counter()
+                try:
+                    response = await self.__request(method, url, data, timeout)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    responses.record(method, url, None, None, b'', perf_counter() - start, type(e).__name__)
+                    raise
+            responses.record(method, url, response.status_code, response.headers, response.content, perf_counter() - start)
+            if response.status_code not in (301, 302, 303, 307, 308) or 'location' not in response.headers:
+                return response
+            url = urljoin(url, response.headers['location'])
+            if response.status_code in (301, 302, 303):
+                method, data = 'GET', None
+        return response
+
+    async def __request(self, method:str, url:str, data:dict|None, timeout:tuple) -> AsyncResponse:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        body = urlencode(data).encode() if data is not None else b''
+        head = ['%s %s HTTP/1.1'%(method, (parts.path or '/') + ('?' + parts.query if parts.query else '')),
+                'Host: %s'%parts.netloc,
+                'Connection: keep-alive',
+                'Accept-Encoding: identity',
+                'User-Agent: etecsa-logger']
+        if data is not None:
+            head += ['Content-Type: application/x-www-form-urlencoded', 'Content-Length: %d'%len(body)]
+        message = ('\r\n'.join(head) + '\r\n\r\n').encode() + body
+        async with self.semaphore:
+            for attempt in range(2):
+                reader, writer, reused = await self.__connect(parts.scheme, parts.hostname, port, timeout)
+                try:
+                    writer.write(message)
+                    await writer.drain()
+                    status_line = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout[1])
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    writer.close()
+                    if reused and attempt == 0:  # La conexión guardada fue cerrada por el servidor.
                         continue
-                    time_to_wait = False
-                    res = entrada.strip().split()
-                    if len(res) == 1:
-                        time_to_wait = input('Ingrese un tiempo a esperar: ')
-                    elif len(res) == 2:
-                        time_to_wait = res[1]
-                    if time_to_wait == 'q':
-                        exit(0)
-                    r = logger.time_that(time_to_wait) if time_to_wait else None
-                    print() if r else None
-                elif entrada == 'load':
-                    logger._load_session_data(True)
-                elif any([word in entrada for word in ['choose', 'elegir']] + [entrada.split()[0] in i for i in ['c', 'e']]):
-                    username = False
-                    res = entrada.split()
-                    if len(res) == 1:
-                        username = input('Ingrese el usuario: ')
-                        if username == 'q':
-                            print()
-                            continue
-                    elif len(res) == 2:
-                        username = res[1]
-                    r = logger.save_config(username) if username else None
-                    print() if r else None
-                elif entrada == 'config':
-                    print(logger.config_msg)
-                elif entrada in ['h', 'help', '/?', '?']:
-                    print(logger.help)
-                elif entrada in ['cls', 'clear']:
-                    clear_screen()
-                elif entrada in ['ping', 'p']:
-                    os.system('ping 1.1.1.1 -n 1')
-                    print()
-                elif entrada == 'q':
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+            lines = status_line.decode('iso-8859-1').split('\r\n')
+            status_code = int(lines[0].split()[1])
+            headers = {}
+            for line in lines[1:]:
+                if line:
+                    key, _, value = line.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+            try:
+                content, keep_alive = await asyncio.wait_for(self.__read_body(reader, headers), timeout[1])
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive and headers.get('connection', '').lower() != 'close':
+                self.idle.setdefault((parts.scheme, parts.hostname, port), []).append((reader, writer))
+            else:
+                writer.close()
+        return AsyncResponse(url, status_code, headers, content)
+
+    async def post(self, url:str, data:dict, timeout:tuple|None=None) -> AsyncResponse:
+        return await self.request('POST', url, data, timeout)
+
+    async def get(self, url:str, timeout:tuple|None=None, max_redirects:int=5) -> AsyncResponse:
+        return await self.request('GET', url, None, timeout, max_redirects)
+
+    async def close(self) -> None:
+        '''Función encargada de cerrar todas las conexiones guardadas.'''
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle = {}
+
+class AsyncEtecsaLogger(EtecsaLogger):
+    '''Versión asíncrona de EtecsaLogger para usar dentro de un bucle de eventos de asyncio.
+    login, logout, auto_login, get_left_time_from_server, _check_connection, watchdog y time_that son corrutinas;
+    el análisis de las respuestas y los archivos de sesión se comparten con EtecsaLogger. Las acciones programadas
+    (scheduler, schedule) no están disponibles, porque ActionScheduler llama a esos métodos sin esperarlos.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._client = None
+        self._watchdog_stop = None
+
+    @property
+    def client(self) -> AsyncHTTPClient:
+        '''Cliente HTTP asíncrono persistente (keep-alive), equivalente a EtecsaLogger.http.'''
+        if self._client is None:
+            self._client = AsyncHTTPClient(self.config['CONFIG'].getint('pool_size', fallback=2), self.timeout)
+        return self._client
+
+    async def close(self) -> None:
+        '''Función encargada de cerrar las conexiones abiertas.'''
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        super().close()
+
+    def _count_request_error(self, error:Exception) -> None:
+        if isinstance(error, asyncio.TimeoutError):
+            metrics.inc('etecsa_logger_timeouts_total', {'operation': metrics.current_operation.get()})
+        elif isinstance(error, ssl.SSLError):
+            metrics.inc('etecsa_logger_ssl_errors_total', {'operation': metrics.current_operation.get()})
+        else:
+            metrics.inc('etecsa_logger_connection_errors_total', {'operation': metrics.current_operation.get()})
+
+    def _request_error(self, error:Exception) -> str:
+        self._count_request_error(error)
+        if isinstance(error, asyncio.TimeoutError):
+            return 'El servidor no respondió en un tiempo dado.'
+        if isinstance(error, ssl.SSLError):
+            to_print = 'Hubo un error al establecer la conexión SSL/TLS con el servidor.'
+        else:
+            to_print = 'Hubo un error al realizar la petición.'
+        return to_print + ' Inténtelo de nuevo.'
+
+    async def _http_probe(self, timeout:float=1.0) -> int:
+        probe_url = self.config['CONFIG'].get('probe_url', fallback='http://clients3.google.com/generate_204')
+        try:
+            response = await self.client.get(probe_url, timeout=(timeout, timeout), max_redirects=0)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            return 1
+        return 0 if response.status_code == 204 else 1
+
+    @metrics.instrument('check_connection')
+    async def _check_connection(self, timeout:float=1, use_cache:bool=True) -> str:
+        ttl = self.config['CONFIG'].getfloat('check_ttl', fallback=5.0)
+        if use_cache:
+            cached, result = self._cached_connection(ttl)
+            if cached:
+                return result
+        result = None
+        probe_start = perf_counter()
+        http = asyncio.ensure_future(self._http_probe(timeout))
+        try:
+            icmp = asyncio.ensure_future(self.prober.async_ping_many(['8.8.8.8', '190.92.127.78'], timeout, until='8.8.8.8'))
+        except OSError:
+            icmp = None
+        pending = {task for task in (icmp, http) if task is not None}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout*2, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    answer = task.result()
+                    if task is http:
+                        if answer == 0:
+                            result = 'internet'
+                    elif answer['8.8.8.8'] is not None:
+                        result = 'internet'
+                    elif answer['190.92.127.78'] is not None and result is None:
+                        result = 'intranet'
+                if result == 'internet':
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+        metrics.observe_phase('probe', perf_counter() - probe_start)
+        self._remember_connection(result)
+        return result
+
+    @metrics.instrument('get_left_time')
+    async def get_left_time_from_server(self) -> str:
+        if self.attribute_uuid:
+            try:
+                payload = {'op': 'getLeftTime',
+                           'username': self.user_pass['username'],
+                           'ATTRIBUTE_UUID': self.attribute_uuid,
+                           }
+                with metrics.phase('post'):
+                    response = await self._post_query(payload)
+                if response.text != 'errorop':
+                    self._sync_left_time(response.text)
+                    return response.text
+            # IncompleteReadError es un EOFError (conexión cerrada a mitad de la respuesta) y ValueError llega con un
+            # cuerpo chunked mal formado. La consulta es de mejor esfuerzo: la sesión ya existe.
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError) as e:
+                self._count_request_error(e)
+        return '??:??:??'
+
+    async def _timed_query(self, payload:dict) -> AsyncResponse:
+        start = perf_counter()
+        response = await self.client.post(self.HOST+self.get_time_endpoint, payload, timeout=self.policy.timeout('query'))
+        self.policy.observe(perf_counter() - start)
+        return response
+
+    async def _hedged_query(self, payload:dict) -> AsyncResponse:
+        delay = self.policy.hedge_delay()
+        if delay is None:
+            return await self._timed_query(payload)
+        tasks = [asyncio.ensure_future(self._timed_query(payload))]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            metrics.inc('etecsa_logger_hedged_requests_total', {'endpoint': 'query'})
+            tasks.append(asyncio.ensure_future(self._timed_query(payload)))
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    return await task
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    error = e
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _post_query(self, payload:dict) -> AsyncResponse:
+        for attempt in range(self.policy.retries + 1):
+            last = attempt == self.policy.retries
+            try:
+                response = await self._hedged_query(payload)
+            except ssl.SSLError:
+                raise
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                if last:
+                    raise
+            else:
+                if response.status_code < 500 or last:
+                    return response
+            metrics.inc('etecsa_logger_retries_total', {'endpoint': 'query'})
+            await asyncio.sleep(self.policy.backoff(attempt))
+
+    async def reconcile_left_time(self) -> int:
+        if not self.attribute_uuid or not self.estimator.due():
+            return 1
+        return self._finish_reconcile(await self.get_left_time_from_server())
+
+    @metrics.instrument('prepare')
+    async def prepare(self, verbose:bool=True, return_str:bool=False):
+        to_return = 1
+        options = self.config['CONFIG']
+        parts = urlsplit(self.HOST)
+        try:
+            with metrics.phase('dns'):
+                address = await asyncio.get_running_loop().run_in_executor(
+                    None, dns_cache.resolve, parts.hostname, parts.port or 443, options.getfloat('dns_ttl', fallback=300))
+        except OSError:
+            to_print = 'No se pudo resolver la dirección de %s.'%parts.hostname
+        else:
+            try:
+                with metrics.phase('get'):
+                    response = await self.client.get(self.HOST+'/', timeout=self.policy.timeout('login'))
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                to_print = self._request_error(e)
+            else:
+                with metrics.phase('parse'):
+                    tokens = self._parse_portal_form([response.content])
+                self._prepared = (monotonic() + options.getfloat('prepare_ttl', fallback=60), tokens)
+                to_print = 'Inicio de sesión preparado. (%s, %d parámetros del portal)'%(address, len(tokens))
+                to_return = 0
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    @metrics.instrument('login')
+    async def login(self, verbose:bool=True, return_str:bool=False):
+        hay_conexion = await self._check_connection()
+        to_return = 1
+        self.last_error = None
+        circuit_message = self._circuit_message() if not hay_conexion else None
+        if circuit_message:
+            to_print = circuit_message
+        elif not hay_conexion:
+            try:
+                with metrics.phase('post'):
+                    response = await self.client.post(self.HOST+self.login_endpoint, self._login_payload(), timeout=self.policy.timeout('login'))
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                to_print = self._request_error(e)
+            else:
+                with metrics.phase('parse'):
+                    result = self._parse_login_response([response.content])
+                if result.error != -1:
+                    to_print = self._error_message(result.error)
+                elif result.attribute_uuid is None:
+                    self._capture_error('login')
+                    to_print = 'No se reconoció la respuesta del portal (no contiene el ATTRIBUTE_UUID de la sesión).'
+                else:
+                    self._save_new_session()
+                    self.initial_left_time = await self.get_left_time_from_server()
+                    to_print = self._finish_login()
+                    to_return = 0
+        else:
+            to_print = 'Ya hay conexión. (%s)'%hay_conexion
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    @metrics.instrument('logout')
+    async def logout(self, verbose:bool=True, return_str:bool=False):
+        self._load_session_data()
+        to_return = 1
+        if self.attribute_uuid:
+            try:
+                with metrics.phase('post'):
+                    response = await self.client.post(self.HOST+self.logout_endpoint,
+                                                      {'username': self.user_pass['username'],
+                                                       'ATTRIBUTE_UUID': self.attribute_uuid},
+                                                      timeout=self.policy.timeout('logout'))
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                to_print = self._request_error(e)
+            else:
+                with metrics.phase('parse'):
+                    to_print, to_return = self._parse_logout_response(response.text)
+        else:
+            to_print = 'No existen los datos de la sesión.'
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    async def auto_login(self, connection_type:str='internet', verbose:bool=True, return_str:bool=False):
+        to_return = 1
+        if connection_type not in AccountPool.domains:
+            to_print = 'Tipo de conexión inválido. Elija entre: %s'%', '.join(AccountPool.domains)
+        elif self.attribute_uuid:
+            to_print = 'Cierre la sesión primero y después cambie el usuario a usar.'
+        else:
+            to_print = 'No hay cuentas disponibles para %s.'%connection_type
+            chosen = self.user_pass
+            for username in self.pool.candidates(connection_type):
+                if not self.policy.breaker.allow(username):
+                    continue  # La cuenta tiene el interruptor abierto: se pasa a la siguiente sin contactar al portal.
+                self._use_account(username)
+                print('Probando con la cuenta: %s'%username) if verbose else None
+                to_print = await self.login(verbose=False, return_str=True)
+                if self.attribute_uuid:
+                    self._use_account(username, persist=True)
+                    to_return = 0
                     break
-                elif len(entrada_lista) == 2:
-                    if (entrada_lista[0] in ['l', 'login']) and entrada_lista[1].isdigit():
-                        logger.login()
-                        logger.time_that(entrada_lista[1])
+                if self.last_error not in (0, 4, 5):
+                    break
+                print(to_print) if verbose else None
+            if to_return:
+                self.user_pass = chosen  # Ninguna cuenta sirvió: se mantiene la elegida en la configuración.
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+    async def watchdog(self, verbose:bool=True) -> int:
+        options = self.config['CONFIG']
+        min_interval = options.getfloat('watchdog_min_interval', fallback=5)
+        max_interval = options.getfloat('watchdog_max_interval', fallback=120)
+        backoff = options.getfloat('watchdog_backoff', fallback=5)
+        busy_backoff = options.getfloat('watchdog_busy_backoff', fallback=60)
+        backoff_max = options.getfloat('watchdog_backoff_max', fallback=900)
+        log = lambda msg: print('[%s] %s'%(datetime.now().strftime('%H:%M:%S'), msg)) if verbose else None
+        interval, failures, down = min_interval, 0, 0
+        stop = asyncio.Event()
+        self._watchdog_stop = (asyncio.get_running_loop(), stop)
+        async def wait(delay:float) -> None:
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self.start_traffic_sampler()
+        log('Vigilando la conexión.')
+        while not stop.is_set():
+            try:
+                if self._session_closed_elsewhere():
+                    log('La sesión se cerró desde otro proceso.')
+                    break
+                if await self._check_connection(use_cache=False):
+                    down = 0
+                    await self.reconcile_left_time()
+                    await wait(interval)
+                    interval = min(interval*2, max_interval)
+                    continue
+                interval = min_interval
+                down += 1
+                if down < 2 and self.attribute_uuid:
+                    await self.prepare(verbose=False)
+                    await wait(min_interval)
+                    continue
+                log('Sin conexión. Iniciando sesión.')
+                log(await self.login(verbose=False, return_str=True))
+                if self.last_error == -1 or await self._check_connection():
+                    failures, down = 0, 0
+                    await wait(min_interval)
+                    continue
+                failures += 1
+                base = busy_backoff if self.last_error in (4, 5, 6) else backoff
+                delay = max(uniform(base, min(backoff_max, base * 2**failures)), self.policy.breaker.remaining(self.user_pass['username']))
+            except Exception as e:
+                failures += 1
+                delay = uniform(backoff, min(backoff_max, backoff * 2**failures))
+                log('Error inesperado: %s'%(str(e) or type(e).__name__))
+            log('Reintentando en %.1f segundos.'%delay)
+            await wait(delay)
+        log('Vigilancia detenida.')
+        self._watchdog_stop = None
+        return 0
+
+    def stop_watchdog(self) -> None:
+        '''Función encargada de detener el bucle de watchdog(). Puede llamarse desde otro hilo.'''
+        super().stop_watchdog()
+        if self._watchdog_stop is not None:
+            loop, stop = self._watchdog_stop
+            try:
+                loop.call_soon_threadsafe(stop.set)
+            except RuntimeError:  # El bucle de eventos ya terminó.
+                pass
+
+    @property
+    def scheduler(self) -> ActionScheduler:
+        raise NotImplementedError('Las acciones programadas no están disponibles en AsyncEtecsaLogger.')
+
+    def schedule(self, args:list, verbose:bool=True, return_str:bool=False):
+        to_print = 'Las acciones programadas no están disponibles en el modo asíncrono. (Use time_that o EtecsaLogger)'
+        print(to_print) if verbose else None
+        return to_print if return_str else 1
+
+    async def time_that(self, time_:str, verbose=True, return_str:bool=False):
+        to_return = 1
+        if not self.attribute_uuid:
+            to_print = 'No existen los datos de la sesión.'
+        else:
+            time_to_shutdown, to_print = self._parse_timer(time_)
+            if to_print is None:
+                try:
+                    await asyncio.sleep(time_to_shutdown)
+                except asyncio.CancelledError:
+                    print('Abortando temporizador.') if verbose else None
+                    raise
                 else:
-                    print('Comando inválido.')
+                    options = self.config['CONFIG']
+                    max_attempts = options.getint('schedule_max_attempts', fallback=8)
+                    max_backoff = options.getfloat('schedule_max_backoff', fallback=60)
+                    for attempt in range(1, max_attempts + 1):
+                        to_return = await self.logout(verbose=verbose)
+                        if not self.attribute_uuid or attempt == max_attempts:
+                            return to_return
+                        await asyncio.sleep(min(max_backoff, 2 ** attempt))
+        print(to_print) if verbose else None
+        return to_print if return_str else to_return
+
+class ControlDaemon():
+    '''Demonio que mantiene en memoria un EtecsaLogger (datos de sesión, pool de conexiones HTTP y acciones programadas)
+    y atiende órdenes por un socket Unix local, así cada orden se responde sin iniciar el intérprete, leer la
+    configuración ni abrir conexiones nuevas.
+    Protocolo: una conexión por orden, con una línea JSON de petición ({"op": "status", "args": []}) y una de respuesta
+    ({"code": 0, "message": "...", "data": ...}). Las órdenes se atienden de una en una en el mismo hilo que ejecuta
+    las acciones programadas, por lo que el estado del logger no necesita bloqueos. Antes de cada orden se leen de
+    nuevo la configuración y el archivo de sesión, por si otro proceso los cambió. Un error en una orden o en una
+    acción programada se registra y el demonio sigue atendiendo.
+    '''
+    OPS = ['login', 'logout', 'status', 'choose', 'timer', 'prepare', 'capture', 'auto', 'pool', 'schedule', 'shutdown']
+
+    def __init__(self, logger:EtecsaLogger, socket_path:str, client_timeout:float=5.0):
+        self.logger = logger
+        self.socket_path = socket_path
+        self.client_timeout = client_timeout
+        self.running = False
+
+    def serve(self, verbose:bool=True) -> int:
+        '''Función encargada de escuchar en el socket hasta recibir la orden shutdown o Ctrl-C.'''
+        if AF_UNIX is None:
+            print('Este sistema no admite sockets Unix.') if verbose else None
+            return 1
+        try:
+            daemon_request(self.socket_path, 'status', timeout=1.0)
+        except (OSError, ValueError):
+            pass
+        else:
+            print('Ya hay un demonio escuchando en %s.'%self.socket_path) if verbose else None
+            return 1
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # Socket de un demonio que terminó sin borrarlo.
+        server = socket(AF_UNIX, SOCK_STREAM)
+        old_umask = os.umask(0o177)  # Solo el usuario actual puede conectarse.
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(16)
+        self.running = True
+        print('Escuchando en %s. (Ctrl-C para salir)'%self.socket_path) if verbose else None
+        log = lambda msg: print('[%s] %s'%(datetime.now().strftime('%H:%M:%S'), msg)) if verbose else None
+        try:
+            while self.running:
+                try:
+                    timeout = self.logger.scheduler.step(verbose=verbose)
+                except Exception as e:
+                    log('Error en las acciones programadas: %s'%(str(e) or type(e).__name__))
+                    timeout = self.logger.scheduler.max_backoff
+                if timeout == 0:
+                    continue
+                ready, _, _ = select([server], [], [], timeout)
+                if ready:
+                    try:
+                        self.__accept(server)
+                    except Exception as e:
+                        log('Error al atender una orden: %s'%(str(e) or type(e).__name__))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+        print('Demonio detenido.') if verbose else None
+        return 0
+
+    def __accept(self, server:socket) -> None:
+        connection, _ = server.accept()
+        with connection:
+            connection.settimeout(self.client_timeout)
+            try:
+                request = json.loads(connection.makefile('rb').readline(65536))
+                response = self.handle(request['op'], list(request.get('args') or []))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                response = {'code': 1, 'message': 'Petición inválida. (%s)'%e, 'data': None}
+            try:
+                connection.sendall(json.dumps(response).encode() + b'\n')
+            except OSError:
+                pass
+
+    def handle(self, op:str, args:list) -> dict:
+        '''Función encargada de ejecutar una orden. Lo que la orden imprime se devuelve como mensaje.'''
+        if op not in self.OPS:
+            return {'code': 1, 'message': 'Operación inválida. Elija entre: %s'%', '.join(self.OPS), 'data': None}
+        output = StringIO()
+        with redirect_stdout(output), span('daemon', op=op):
+            try:
+                self.logger.reload_config()  # Otro proceso pudo elegir otra cuenta.
+                self.logger._load_session_data()  # Otro proceso pudo iniciar o cerrar la sesión.
+                if not self.logger.start_traffic_sampler():
+                    self.logger.traffic.stop()
+                code, data = getattr(self, '_op_' + op)(args)
+            except Exception as e:
+                code, data = 1, None
+                print('Error: %s'%e)
+        return {'code': code, 'message': output.getvalue().strip(), 'data': data}
+
+    def _op_login(self, args:list) -> tuple:
+        code = self.logger.login()
+        if code == 0 and args:
+            code = self._op_timer(args[:1])[0]
+        return code, None
+
+    def _op_logout(self, args:list) -> tuple:
+        return self.logger.logout(), None
+
+    def _op_status(self, args:list) -> tuple:
+        logger = self.logger
+        data = {'username': logger.user_pass['username'],
+                'connected': bool(logger.attribute_uuid),
+                'connection_type': logger.connection_type,
+                'session_start_time': logger.session_start_time.isoformat(timespec='seconds') if isinstance(logger.session_start_time, datetime) else None,
+                'initial_left_time': logger.initial_left_time,
+                'left_time': logger.get_left_time(),
+                'actions': sorted(logger.scheduler.actions.values(), key=lambda action: action['id']),
+                'traffic': logger.traffic_summary(),
+                }
+        print(logger.config_msg)
+        print('Tiempo restante: %s'%data['left_time'])
+        return 0, data
+
+    def _op_choose(self, args:list) -> tuple:
+        if len(args) != 1:
+            print('Indique el usuario a elegir.')
+            return 1, None
+        return self.logger.save_config(args[0]), None
+
+    def _op_timer(self, args:list) -> tuple:
+        '''args: [] para listar las acciones, [tiempo] para cerrar la sesión dentro de ese tiempo o ['cancel', id].'''
+        scheduler = self.logger.scheduler
+        if not args:
+            print(scheduler)
+            return 0, None
+        if args[0] == 'cancel' and len(args) == 2 and str(args[1]).isdigit():
+            code = scheduler.cancel(int(args[1]))
+            print('Acción cancelada.' if code == 0 else 'No existe la acción %s.'%args[1])
+            return code, None
+        if not self.logger.attribute_uuid:
+            print('No existen los datos de la sesión.')
+            return 1, None
+        seconds, error = self.logger._parse_timer(str(args[0]))
+        if error is not None:
+            print(error)
+            return 1, None
+        action_id = scheduler.schedule('logout', at=time() + seconds)
+        print('Cierre de sesión programado para las %s. (Acción %d)'%(datetime.fromtimestamp(time() + seconds).strftime('%H:%M:%S'), action_id))
+        return 0, {'id': action_id}
+
+    def _op_prepare(self, args:list) -> tuple:
+        return self.logger.prepare(), None
+
+    def _op_capture(self, args:list) -> tuple:
+        return self.logger.capture([str(arg) for arg in args]), None
+
+    def _op_auto(self, args:list) -> tuple:
+        return self.logger.auto_login(str(args[0]) if args else 'internet'), None
+
+    def _op_pool(self, args:list) -> tuple:
+        print(self.logger.pool)
+        return 0, None
+
+    def _op_schedule(self, args:list) -> tuple:
+        if args[:1] == ['run']:
+            print('El demonio ya ejecuta las acciones programadas.')
+            return 0, None
+        return self.logger.schedule([str(arg) for arg in args]), None
+
+    def _op_shutdown(self, args:list) -> tuple:
+        self.running = False
+        print('Deteniendo el demonio.')
+        return 0, None
+
+class DaemonUnavailable(OSError):
+    '''No hay un demonio escuchando: la orden no llegó a enviarse.'''
+
+def daemon_request(socket_path:str, op:str, args:list|None=None, timeout:float=60.0) -> dict:
+    '''Función encargada de enviar una orden al demonio y devolver su respuesta. Lanza DaemonUnavailable si no hay un
+    demonio escuchando en socket_path, y OSError o ValueError si la conexión falla después de enviar la orden.'''
+    if AF_UNIX is None:
+        raise DaemonUnavailable('Este sistema no admite sockets Unix.')
+    with socket(AF_UNIX, SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailable(*e.args) from e
+        client.sendall(json.dumps({'op': op, 'args': args or []}).encode() + b'\n')
+        return json.loads(client.makefile('rb').readline())
+
+#################################################################### MAIN ####################################################################
+
+def trace_file(folder:str, format:str) -> str:
+    '''Función encargada de devolver la ruta del archivo de trazas según el formato.'''
+    return os.path.join(folder, 'trace.json' if format == 'chrome' else 'trace.jsonl')
+
+def parse_trace_flag() -> None:
+    '''Función encargada de quitar de argv la opción --trace[=jsonl|chrome] y activar el trazado si aparece.'''
+    for arg in argv[1:]:
+        name, _, format = arg.partition('=')
+        if name == '--trace':
+            argv.remove(arg)
+            enable_tracing(trace_file(EtecsaLogger.logger_data_folder, format or 'jsonl'), format or 'jsonl')
+            return
+
+def daemon_socket() -> str:
+    return EtecsaLogger.logger_data_folder + 'logger.sock'
+
+Command = namedtuple('Command', ['names', 'handler', 'remote', 'complete', 'background', 'abbrev'])
+
+class CommandRegistry():
+    '''Registro declarativo de los comandos, compartido por la línea de comandos y el modo interactivo.
+    Cada comando se registra con sus nombres, una función handler(logger, args, interactive) que devuelve el código de
+    salida, y opcionalmente remote(args), que traduce la orden a una petición (op, args[, campo]) para el demonio, y
+    complete(logger, text), que devuelve los valores con los que completar su argumento. background indica cómo se
+    ejecuta en el modo interactivo: None en primer plano, 'session' en segundo plano junto con el resto de las
+    peticiones al portal (de una en una) y 'thread' en segundo plano en su propio hilo. Los nombres se buscan en un
+    diccionario y, si no existen, como prefijo único en un PrefixIndex; solo se ejecutan por un prefijo los comandos
+    registrados con abbrev (los de consulta), para que una inicial no inicie o cierre una sesión por error.
+    '''
+    def __init__(self):
+        self.commands = {}
+        self.index = PrefixIndex()
+
+    def command(self, *names:str, remote=None, complete=None, background=None, abbrev=False):
+        def register(handler):
+            command = Command(names, handler, remote, complete, background, abbrev)
+            for name in names:
+                self.commands[name] = command
+                self.index.add(name)
+            return handler
+        return register
+
+    def find(self, word:str, any_prefix:bool=False) -> Command|None:
+        '''Comando con ese nombre o, si no existe, el único cuyos nombres empiezan por word. Por un prefijo solo se
+        devuelven los comandos con abbrev, salvo con any_prefix (para completar sus argumentos, sin ejecutarlos).'''
+        command = self.commands.get(word)
+        if command is not None:
+            return command
+        name = self.index.resolve(word)
+        if name is not None:
+            command = self.commands[name]
+        else:
+            matches = {self.commands[name] for name in self.index.complete(word)} if word else set()
+            command = matches.pop() if len(matches) == 1 else None  # Varios alias del mismo comando.
+        return command if command is not None and (command.abbrev or any_prefix) else None
+
+    def complete(self, prefix:str) -> list:
+        return self.index.complete(prefix)
+
+commands = CommandRegistry()
+
+def run_command(logger:EtecsaLogger, words:list, interactive:bool=False) -> int:
+    '''Función encargada de ejecutar un comando (su nombre seguido de sus argumentos). Devuelve el código de salida.'''
+    command = commands.find(words[0])
+    if command is None:
+        print('Comando inválido.')
+        return 1
+    with span('command', command=' '.join(words)):
+        try:
+            return command.handler(logger, words[1:], interactive) or 0
+        except requests.ConnectionError:
+            print('Error de conexión.')
+            return 1
+
+@commands.command('l', 'login', remote=lambda args: ('login', args[:1]) if not args or args[0].isdigit() else None,
+                  background='session')
+def login_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    to_return = logger.login()
+    if args and args[0].isdigit():
+        to_return = logger.time_that(args[0])
+    return to_return
+
+@commands.command('lo', 'logout', remote=lambda args: ('logout', []), background='session')
+def logout_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.logout()
+
+@commands.command('auto', remote=lambda args: ('auto', args[:1]), background='session',
+                  complete=lambda logger, text: [domain for domain in AccountPool.domains if domain.startswith(text)])
+def auto_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.auto_login(args[0] if args else 'internet')
+
+@commands.command('pool', remote=lambda args: ('pool', []), background='session', abbrev=True)
+def pool_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    print(logger.pool)
+
+@commands.command('report', abbrev=True)
+def report_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.report(*args[:2])
+
+@commands.command('sched', 'schedule', remote=lambda args: ('schedule', args) if args[:1] != ['run'] else None)
+def schedule_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.schedule(args)
+
+@commands.command('metrics')
+def metrics_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    to_return = logger.show_metrics(args)
+    if to_return == 0 and args[:1] == ['serve'] and not interactive:
+        try:
+            Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return to_return
+
+@commands.command('prep', 'prepare', remote=lambda args: ('prepare', []), background='session')
+def prepare_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.prepare()
+
+@commands.command('status', remote=lambda args: ('status', []), abbrev=True)
+def status_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    print(logger.config_msg)
+    print('Tiempo restante: %s'%logger.get_left_time())
+
+@commands.command('daemon', remote=lambda args: ('shutdown', []) if args[:1] == ['stop'] else None)
+def daemon_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    if args[:1] == ['stop']:
+        print('No hay un demonio escuchando.')
+        return 1
+    return ControlDaemon(logger, daemon_socket()).serve()
+
+@commands.command('w', 'watchdog', background='thread')
+def watchdog_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.watchdog()
+
+@commands.command('t?', 'gt', remote=lambda args: ('status', [], 'left_time'))
+def left_time_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    if interactive:
+        logger.reconcile_left_time()
+    print(logger.get_left_time())
+
+@commands.command('traffic', abbrev=True)
+def traffic_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    traffic = logger.traffic_summary() if logger.attribute_uuid else None
+    if traffic is None:
+        print('No hay datos del tráfico de la sesión.')
+        return 1
+    print('Tráfico: %s'%TrafficSampler.format_summary(traffic))
+
+@commands.command('ontime', 'onlinetime', 'online_time', abbrev=True)
+def online_time_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    print(logger.onTime())
+
+@commands.command('time', 'timer', 'timethat', 'time_that', 't', remote=lambda args: ('timer', args[:1]) if args else None)
+def timer_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    if not logger.attribute_uuid:
+        print('No existen los datos de la sesión.')
+        return 1
+    time_to_wait = args[0] if args else input('Ingrese un tiempo a esperar: ')
+    if time_to_wait == 'q':
+        exit(0)
+    to_return = logger.time_that(time_to_wait) if time_to_wait else 1
+    print() if interactive and to_return else None
+    return to_return
+
+@commands.command('timers', abbrev=True)
+def timers_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    print(logger.scheduler)
+
+@commands.command('cancel', remote=lambda args: ('schedule', ['cancel', args[0]]) if len(args) == 1 and args[0].isdigit() else None,
+                  complete=lambda logger, text: [str(i) for i in sorted(logger.scheduler.actions) if str(i).startswith(text)])
+def cancel_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    if len(args) != 1 or not args[0].isdigit():
+        print('Comando inválido. (Ej: -> "cancel 1")')
+        return 1
+    return logger.schedule(['cancel', args[0]])
+
+@commands.command('capture', remote=lambda args: ('capture', args))
+def capture_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return logger.capture(args)
+
+@commands.command('trace')
+def trace_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    if args[:1] == ['on']:
+        trace_format = 'chrome' if args[1:2] == ['chrome'] else 'jsonl'
+        enable_tracing(trace_file(logger.logger_data_folder, trace_format), trace_format)
+        print('Trazado activado (%s).'%trace_format)
+    elif args[:1] == ['off']:
+        file_route = disable_tracing()
+        print('Traza guardada en "%s".'%file_route if file_route else 'El trazado no estaba activado.')
+    else:
+        print('Comando inválido. (Ej: -> "trace on", "trace on chrome", "trace off")')
+        return 1
+
+@commands.command('load')
+def load_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    logger._load_session_data(True)
+
+@commands.command('c', 'choose', 'e', 'elegir', remote=lambda args: ('choose', args) if len(args) == 1 else None,
+                  complete=lambda logger, text: logger.users.complete(text), background='session')
+def choose_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    username = args[0] if args else input('Ingrese el usuario: ')
+    if username == 'q':
+        print() if interactive else None
+        return 0
+    to_return = logger.save_config(username) if username else 1
+    print() if interactive and to_return else None
+    return to_return
+
+@commands.command('config', 'options', 'opciones', abbrev=True)
+def config_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    print(logger.config_msg)
+
+@commands.command('h', 'help', '?', abbrev=True)
+def help_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    print(logger.help)
+
+@commands.command('cls', 'clear', abbrev=True)
+def clear_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    return clear_screen()
+
+@commands.command('ping', 'p', background='thread')
+def ping_command(logger:EtecsaLogger, args:list, interactive:bool) -> int:
+    host = args[0] if args else '1.1.1.1'
+    count = int(args[1]) if len(args) > 1 and args[1].isdigit() else 4
+    try:
+        for rtt in logger.prober.ping(host, count):
+            print('Respuesta desde %s: tiempo=%.1f ms'%(host, rtt*1000) if rtt is not None else 'Tiempo de espera agotado para %s.'%host)
+    except OSError as e:
+        print('No se pudo enviar el ping: %s'%e)
+        return 1
+    stats = logger.prober.statistics(host)
+    print('Enviados: {sent}, recibidos: {received}, pérdida: {loss:.0f}%'.format(**stats))
+    if stats['received']:
+        print('RTT (ms): mín {min:.1f} / prom {avg:.1f} / p50 {p50:.1f} / p90 {p90:.1f} / máx {max:.1f}'.format(**stats))
+    print()
+
+def forward_to_daemon() -> int|None:
+    '''Función encargada de enviar la orden de la línea de comandos al demonio, si hay uno escuchando, y mostrar su
+    respuesta. Devuelve el código de salida, o None si la orden debe ejecutarse en este proceso (solo cuando no se pudo
+    conectar con el demonio).'''
+    command = commands.find(argv[1].lower().strip('-/'))
+    request = command.remote(argv[2:]) if command is not None and command.remote is not None else None
+    if request is None or not os.path.exists(daemon_socket()):
+        return None
+    try:
+        response = daemon_request(daemon_socket(), *request[:2])
+    except DaemonUnavailable:
+        return None
+    except (OSError, ValueError) as e:
+        # La orden ya se envió: ejecutarla aquí podría repetirla (por ejemplo, dos inicios de sesión).
+        print('No se recibió la respuesta del demonio: %s'%(str(e) or type(e).__name__))
+        return 1
+    if len(request) > 2 and response['data']:
+        print(response['data'][request[2]])
+    elif response['message']:
+        print(response['message'])
+    return response['code']
+
+def enable_completion(logger:EtecsaLogger) -> None:
+    '''Función encargada de activar el completado con Tab de los comandos y sus argumentos en el modo interactivo
+    (si está disponible el módulo readline).'''
+    try:
+        import readline
+    except ModuleNotFoundError:  # Windows
+        return
+    def complete(text:str, state:int) -> str|None:
+        words = readline.get_line_buffer()[:readline.get_begidx()].split()
+        if not words:
+            options = commands.complete(text)
+        else:
+            command = commands.find(words[0].lower(), any_prefix=True)
+            options = command.complete(logger, text) if command is not None and command.complete is not None else []
+        return options[state] if state < len(options) else None
+    readline.set_completer_delims(' ')
+    readline.set_completer(complete)
+    readline.parse_and_bind('bind ^I rl_complete' if 'libedit' in (readline.__doc__ or '') else 'tab: complete')
+
+class StatusLine():
+    '''Línea de estado fija en la última fila de la terminal. El resto de las filas se convierte en una región de
+    desplazamiento, así la entrada y la salida corren por encima sin borrarla. Solo se activa si la salida es una
+    terminal que admite secuencias ANSI.'''
+    def __init__(self, stream):
+        self.stream = stream
+        self.enabled = os.name != 'nt' and stream.isatty() and os.environ.get('TERM', 'dumb') != 'dumb'
+        self.rows = 0
+        self.text = None
+
+    def show(self, text:str) -> None:
+        '''Función encargada de dibujar el texto en la línea de estado (solo si cambió o cambió el tamaño de la terminal).'''
+        if not self.enabled:
+            return
+        columns, rows = get_terminal_size()
+        if rows != self.rows:
+            if not self.rows:
+                self.stream.write('\n\x1b[1A')  # Dejar libre la última fila si el cursor estaba en ella.
+            self.stream.write('\x1b7\x1b[1;%dr\x1b8'%(rows - 1))
+            self.rows, self.text = rows, None
+        if text != self.text:
+            self.stream.write('\x1b7\x1b[%d;1H\x1b[2K%s\x1b8'%(rows, text[:columns - 1]))
+            self.stream.flush()
+            self.text = text
+
+    def close(self) -> None:
+        '''Función encargada de borrar la línea de estado y devolver la región de desplazamiento a toda la terminal.'''
+        if self.rows:
+            self.stream.write('\x1b7\x1b[r\x1b[%d;1H\x1b[2K\x1b8'%self.rows)
+            self.stream.flush()
+            self.rows = 0
+
+class ShellOutput():
+    '''Salida estándar del modo interactivo. Lo que escriben los hilos marcados con capture() se entrega línea a
+    línea a emit (que lo muestra desde el bucle de eventos); lo demás va directo a la terminal.'''
+    def __init__(self, stream, emit):
+        self.stream = stream
+        self.emit = emit
+        self.local = local()
+
+    def capture(self) -> None:
+        self.local.buffer = []
+
+    def write(self, text:str) -> int:
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        if '\n' in text:
+            lines = ''.join(buffer).split('\n')
+            buffer[:] = [lines.pop()]
+            for line in lines:
+                self.emit(line)
+        return len(text)
+
+    def flush(self) -> None:
+        '''Función encargada de entregar la línea incompleta del hilo actual, si la hay.'''
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer and ''.join(buffer):
+            self.emit(''.join(buffer).rstrip('\r'))
+            buffer.clear()
+        self.stream.flush()
+
+    def __getattr__(self, attribute:str):
+        return getattr(self.stream, attribute)  # fileno, isatty, encoding... (input() los usa para activar readline)
+
+ShellJob = namedtuple('ShellJob', ['id', 'name', 'start', 'future', 'stop'])
+
+class InteractiveShell():
+    '''Modo interactivo sobre un bucle de eventos de asyncio. La entrada se lee en un hilo aparte, así mientras corren
+    temporizadores, sondeos o peticiones al portal se pueden seguir escribiendo comandos:
+    - Los comandos con background='session' (l, lo, auto, pool, prep, choose) se ejecutan en segundo plano, de uno en
+      uno y en el mismo hilo que las acciones programadas, por lo que el estado de la sesión no necesita bloqueos. Los
+      que tienen background='thread' (w, ping) usan su propio hilo; w espera en él, pero hace sus peticiones al portal
+      en el hilo de la sesión, y se detiene al cerrar la sesión. Los demás se ejecutan en primer plano.
+    - time y "l <segundos>" programan el cierre de la sesión en el planificador en vez de esperar; el bucle ejecuta
+      las acciones programadas a medida que llega su momento (ya no hace falta "sched run").
+    - t? responde con el tiempo estimado y, si hace falta, lo confirma con el servidor en segundo plano.
+    - timers muestra las tareas (%1, %2, ...) y las acciones programadas (1, 2, ...) en curso, y cancel las cancela.
+    Lo que escriben las tareas en segundo plano aparece sobre la línea que se está escribiendo, y el progreso, en una
+    línea de estado al pie de la terminal.
+    '''
+    def __init__(self, logger:EtecsaLogger, prompt:str='-> ', refresh:float=1.0):
+        self.logger = logger
+        self.prompt = prompt
+        self.refresh = refresh
+        self.jobs = {}
+        self.timers = {}  # Identificador de la acción -> momento en que se programó (para mostrar el progreso).
+        self.reading = False
+        self.overrides = {login_command: self.__login, timer_command: self.__time, left_time_command: self.__left_time,
+                          schedule_command: self.__schedule, timers_command: self.__timers,
+                          cancel_command: self.__cancel, watchdog_command: self.__watchdog, choose_command: self.__choose}
+
+    def run(self) -> int:
+        '''Función encargada de ejecutar el modo interactivo hasta recibir "q", fin de archivo o Ctrl-C.'''
+        try:
+            import termios
+        except ModuleNotFoundError:  # Windows
+            termios = None
+        terminal = termios.tcgetattr(0) if termios is not None and os.isatty(0) else None
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.__main())
         except KeyboardInterrupt:
             pass
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+            if terminal is not None:
+                termios.tcsetattr(0, termios.TCSADRAIN, terminal)  # readline pudo quedar a medio leer una línea.
+        return 0
+
+    async def __main(self) -> None:
+        from itertools import count
+        from sys import stdout
+        self.loop = asyncio.get_running_loop()
+        self.stream = stdout
+        self.output = ShellOutput(self.stream, lambda line: self.loop.call_soon_threadsafe(self.echo, line))
+        self.status = StatusLine(self.stream)
+        self.worker = futures.ThreadPoolExecutor(1, 'session', initializer=self.output.capture)
+        self.threads = futures.ThreadPoolExecutor(8, 'job', initializer=self.output.capture)
+        self.job_ids = count(1)
+        self.lines = asyncio.Queue()
+        self.ready = Event()
+        self.wakeup = asyncio.Event()
+        try:
+            import readline
+        except ModuleNotFoundError:  # Windows
+            readline = None
+        self.readline = readline
+        background = [asyncio.create_task(self.__run_scheduler()), asyncio.create_task(self.__show_status())]
+        Thread(target=self.__read, name='input', daemon=True).start()
+        try:
+            with redirect_stdout(self.output):
+                while True:
+                    line = await self.lines.get()
+                    if line is None or line.lower().strip('-/ ') == 'q':
+                        break
+                    words = line.lower().strip('-/ ').split()
+                    if words:
+                        self.dispatch(words)
+                    if tracer is not None and tracer.format == 'jsonl':
+                        tracer.flush()
+                    self.ready.set()
+        finally:
+            for task in background:
+                task.cancel()
+            self.logger.stop_watchdog()
+            self.status.close()
+            self.threads.shutdown(wait=False, cancel_futures=True)
+            self.worker.shutdown(wait=False, cancel_futures=True)
+            if self.logger.scheduler.actions:
+                print('Quedan %d acciones programadas. (Ejecútelas con "sched run")'%len(self.logger.scheduler.actions))
+
+    def __read(self) -> None:
+        '''Hilo encargado de leer la entrada. Tras cada línea espera a que se despache, por si el comando pide datos.'''
+        while True:
+            self.reading = True
+            try:
+                line = input(self.prompt)
+            except EOFError:
+                line = None
+            self.reading = False
+            self.loop.call_soon_threadsafe(self.lines.put_nowait, line)
+            if line is None:
+                return
+            self.ready.wait()
+            self.ready.clear()
+
+    def echo(self, text:str) -> None:
+        '''Función encargada de mostrar una línea de una tarea en segundo plano sin romper la línea que se está escribiendo.'''
+        if self.reading and self.status.enabled:
+            buffer = self.readline.get_line_buffer() if self.readline is not None else ''
+            self.stream.write('\r\x1b[K%s\n%s%s'%(text, self.prompt, buffer))
+        else:
+            self.stream.write(text + '\n')
+        self.stream.flush()
+
+    def dispatch(self, words:list) -> None:
+        '''Función encargada de ejecutar un comando en primer plano o lanzarlo como tarea en segundo plano.'''
+        command = commands.find(words[0])
+        if command is None:
+            print('Comando inválido.')
+        elif command.handler in self.overrides:
+            self.overrides[command.handler](words[1:])
+        elif command.background is not None:
+            self.submit(command.names[0], run_command, self.logger, words, True,
+                        executor=self.worker if command.background == 'session' else self.threads)
+        else:
+            run_command(self.logger, words, interactive=True)
+
+    def submit(self, name:str, function, *args, executor=None, stop=None) -> int:
+        '''Función encargada de lanzar una tarea en segundo plano (por defecto en el hilo de la sesión). Devuelve su
+        identificador. stop es la función que la detiene si ya empezó.'''
+        job_id = next(self.job_ids)
+        future = (executor or self.worker).submit(self.__call, function, args)
+        self.jobs[job_id] = ShellJob(job_id, name, monotonic(), future, stop)
+        future.add_done_callback(lambda future: self.__done(job_id, future))
+        return job_id
+
+    def __done(self, job_id:int, future) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.__finish, job_id, future)
+        except RuntimeError:  # La tarea terminó después de cerrar el modo interactivo.
+            pass
+
+    def __call(self, function, args:tuple):
+        try:
+            return function(*args)
+        finally:
+            self.output.flush()
+
+    def __finish(self, job_id:int, future) -> None:
+        self.jobs.pop(job_id, None)
+        self.wakeup.set()  # La tarea pudo programar o cancelar acciones.
+        if not future.cancelled() and future.exception() is not None:
+            self.echo('La tarea %%%d terminó con un error: %s'%(job_id, future.exception()))
+
+    async def __run_scheduler(self) -> None:
+        '''Tarea encargada de ejecutar las acciones programadas (en el hilo de la sesión) a medida que llega su momento.'''
+        while True:
+            self.wakeup.clear()
+            try:
+                remaining = await self.loop.run_in_executor(self.worker, self.__call, self.logger.scheduler.step, ())
+            except requests.ConnectionError:
+                self.echo('Error de conexión.')
+                remaining = self.logger.scheduler.max_backoff
+            if remaining == 0:
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __show_status(self) -> None:
+        while True:
+            self.status.show(' | '.join(self.entries(bar_width=10)))
+            await asyncio.sleep(self.refresh)
+
+    def entries(self, bar_width:int) -> list:
+        '''Función encargada de describir el tiempo restante, las tareas en curso y las acciones programadas.'''
+        entries = ['Restante: %s'%self.logger.get_left_time()] if self.logger.attribute_uuid else []
+        now = monotonic()
+        for job in list(self.jobs.values()):
+            entries.append('%%%d %s (%s)'%(job.id, job.name, seconds_to_time(now - job.start)))
+        for action in sorted(list(self.logger.scheduler.actions.values()), key=lambda action: action['id']):
+            due = action['retry_at'] or action['at']
+            if due is None:
+                entries.append('%d %s cuando queden %s'%(action['id'], action['action'], seconds_to_time(action['left_below'])))
+                continue
+            left = max(0, due - time())
+            entry = '%d %s en %s'%(action['id'], action['action'], seconds_to_time(ceil(left)))
+            start = self.timers.get(action['id'])
+            if start is not None and due > start:
+                done = int(bar_width * min(1, (time() - start) / (due - start)))
+                entry += ' [%s%s]'%('#'*done, '-'*(bar_width - done))
+            entries.append(entry)
+        return entries
+
+    def __schedule_timer(self, seconds:float) -> None:
+        action_id = self.logger.scheduler.schedule('logout', at=time() + seconds)
+        self.timers[action_id] = time()
+        self.logger.start_traffic_sampler()
+        print('Temporizador %d: la sesión se cerrará a las %s.'%(action_id, datetime.fromtimestamp(time() + seconds).strftime('%H:%M:%S')))
+
+    def __login(self, args:list) -> None:
+        seconds = None
+        if args and args[0].isdigit():
+            seconds, _ = self.logger._parse_timer(args[0])
+        def login():
+            run_command(self.logger, ['login'], True)
+            if seconds is not None and self.logger.attribute_uuid:
+                self.__schedule_timer(seconds)
+        self.submit('login', login)
+
+    def __time(self, args:list) -> None:
+        if not self.logger.attribute_uuid:
+            print('No existen los datos de la sesión.')
+            return
+        time_to_wait = args[0] if args else input('Ingrese un tiempo a esperar: ')
+        if time_to_wait in ('', 'q'):
+            return
+        seconds, to_print = self.logger._parse_timer(time_to_wait)
+        if to_print is not None:
+            print(to_print)
+            return
+        self.submit('time', self.__schedule_timer, seconds)
+
+    def __left_time(self, args:list) -> None:
+        print(self.logger.get_left_time())
+        if self.logger.attribute_uuid and self.logger.estimator.due():
+            def reconcile():
+                if self.logger.reconcile_left_time() == 0:
+                    print('Tiempo restante según el servidor: %s'%self.logger.get_left_time())
+            self.submit('t?', reconcile)
+
+    def __schedule(self, args:list) -> None:
+        if args[:1] == ['run']:
+            print('Las acciones programadas ya se ejecutan en segundo plano.')
+        elif not args:
+            print(self.logger.scheduler)
+        else:
+            self.submit('sched', self.logger.schedule, args)
+
+    def __timers(self, args:list) -> None:
+        print('\n'.join(self.entries(bar_width=30)) or 'No hay tareas ni acciones programadas.')
+
+    def __cancel(self, args:list) -> None:
+        if len(args) != 1 or not args[0].lstrip('%').isdigit():
+            print('Comando inválido. (Ej: -> "cancel 1" para una acción programada, "cancel %1" para una tarea)')
+        elif not args[0].startswith('%'):
+            self.timers.pop(int(args[0]), None)
+            self.submit('cancel', self.logger.schedule, ['cancel', args[0]])
+        else:
+            job = self.jobs.get(int(args[0][1:]))
+            if job is None:
+                print('No existe la tarea %s.'%args[0])
+            elif job.future.cancel():
+                print('Tarea %s cancelada.'%args[0])
+            elif job.stop is not None:
+                job.stop()
+                print('Deteniendo la tarea %s.'%args[0])
+            else:
+                print('La tarea %s no se puede cancelar; terminará por sí sola.'%args[0])
+
+    def __watchdog(self, args:list) -> None:
+        if any(job.name == 'watchdog' for job in self.jobs.values()):
+            print('La vigilancia ya está en curso.')
+            return
+        def watchdog():
+            with span('command', command='watchdog'):
+                return self.logger.watchdog(session=self.worker)  # Las esperas en su hilo; las peticiones, en el de la sesión.
+        self.submit('watchdog', watchdog, executor=self.threads, stop=self.logger.stop_watchdog)
+
+    def __choose(self, args:list) -> None:
+        username = args[0] if args else input('Ingrese el usuario: ')
+        if username in ('', 'q'):
+            return
+        self.submit('choose', run_command, self.logger, ['choose', username], True)
+
+def main():
+    if len(argv) > 1:
+        with span('daemon request'):
+            code = forward_to_daemon()
+        if code is not None:
+            exit(code)
+    with span('startup'):
+        logger = EtecsaLogger()
+
+    if len(argv) > 1:
+        exit(run_command(logger, [argv[1].lower().strip('-/')] + argv[2:]))
+    else:
+        enable_completion(logger)
+        logger.start_traffic_sampler()
+        InteractiveShell(logger).run()
         print('\nSaliendo...')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parse_trace_flag()
+    with span('main', command=' '.join(argv[1:])):
+        main()
@@ -0,0 +1,502 @@
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logger
+from logger import AccountPool, ActionScheduler, CircuitBreaker, CommandRegistry, EtecsaLogger, FileLock, LeftTimeEstimator, LoginResponseParser, PrefixIndex, ResponseCapture, SessionStore, TrafficSampler, UsageLedger
+
+ERROR_MESSAGES = EtecsaLogger._EtecsaLogger__error_messages
+UUID = '0123456789ABCDEF0123456789ABCDEF'
+
+
+class UsageLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file_route = os.path.join(self.folder.name, 'usage.bin')
+        self.accounts_route = os.path.join(self.folder.name, 'usage_accounts.txt')
+        self.ledger = UsageLedger(self.file_route, self.accounts_route)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def append(self, ledger, account, start, end, traffic=None):
+        ledger.append(account, 'internet', datetime.fromtimestamp(start), datetime.fromtimestamp(end), 3600, 3600 - (end - start),
+                      'SUCCESS', traffic)
+
+    def test_round_trip(self):
+        self.append(self.ledger, 'a@nauta.com.cu', 1000, 1600, {'rx_bytes': 2048, 'tx_bytes': 512, 'rx_peak': 100, 'tx_peak': 50})
+        self.ledger.append('b@nauta.co.cu', 'intranet', datetime.fromtimestamp(2000), datetime.fromtimestamp(2300), None, None, 'FAILURE')
+        records = list(UsageLedger(self.file_route, self.accounts_route).records())
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0], {'start': 1000, 'end': 1600, 'initial_left_time': 3600, 'final_left_time': 3000,
+                                      'account': 'a@nauta.com.cu', 'connection_type': 'internet', 'outcome': 'SUCCESS',
+                                      'rx_bytes': 2048, 'tx_bytes': 512, 'rx_peak': 100, 'tx_peak': 50})
+        self.assertEqual(records[1]['account'], 'b@nauta.co.cu')
+        self.assertEqual(records[1]['connection_type'], 'intranet')
+        self.assertEqual(records[1]['outcome'], 'FAILURE')
+        self.assertIsNone(records[1]['initial_left_time'])
+        self.assertIsNone(records[1]['rx_bytes'])
+
+    def test_records_between_dates(self):
+        for number in range(200):
+            self.append(self.ledger, 'a@nauta.com.cu', 10000 + number * 100, 10050 + number * 100)
+        since, until = datetime.fromtimestamp(10050 + 37 * 100), datetime.fromtimestamp(10050 + 150 * 100)
+        ends = [record['end'] for record in self.ledger.records(since, until)]
+        self.assertEqual(ends, [10050 + number * 100 for number in range(37, 150)])
+        self.assertEqual(list(self.ledger.records(datetime.fromtimestamp(10 ** 9))), [])
+
+    def test_report(self):
+        self.append(self.ledger, 'a@nauta.com.cu', 1000, 1600, {'rx_bytes': 1000, 'tx_bytes': 200})
+        self.append(self.ledger, 'a@nauta.com.cu', 2000, 2400)
+        self.append(self.ledger, 'b@nauta.com.cu', 3000, 3100)
+        report = self.ledger.report()
+        self.assertEqual(report['accounts'], {'a@nauta.com.cu': [2, 1000, 1200, 600], 'b@nauta.com.cu': [1, 100, 0, 0]})
+        day = datetime.fromtimestamp(1000).date().isoformat()
+        self.assertEqual(report['days'][day]['a@nauta.com.cu'][:2], [2, 1000])
+        self.assertIn('a@nauta.com.cu', UsageLedger.format_report(report))
+
+    def test_partial_record_is_truncated_before_appending(self):
+        self.append(self.ledger, 'a@nauta.com.cu', 1000, 1600)
+        with open(self.file_route, 'ab') as file:
+            file.write(b'\x01' * (UsageLedger.RECORD.size // 2))  # Escritura interrumpida.
+        self.append(self.ledger, 'a@nauta.com.cu', 2000, 2600)
+        self.assertEqual(os.path.getsize(self.file_route), len(UsageLedger.MAGIC) + 2 * UsageLedger.RECORD.size)
+        self.assertEqual([record['end'] for record in self.ledger.records()], [1600, 2600])
+
+    def test_account_ids_are_shared_between_instances(self):
+        other = UsageLedger(self.file_route, self.accounts_route)
+        other.accounts  # Cachea la lista (vacía) de cuentas, como un proceso que ya estaba corriendo.
+        self.append(self.ledger, 'a@nauta.com.cu', 1000, 1600)
+        self.append(other, 'b@nauta.com.cu', 2000, 2600)
+        self.assertEqual([record['account'] for record in UsageLedger(self.file_route, self.accounts_route).records()],
+                         ['a@nauta.com.cu', 'b@nauta.com.cu'])
+
+    def test_version_1_file_is_upgraded(self):
+        old = struct.Struct('<qqiiHBB')
+        with open(self.accounts_route, 'w') as file:
+            file.write('a@nauta.com.cu\n')
+        with open(self.file_route, 'wb') as file:
+            file.write(b'ETLG\x01' + old.pack(1000, 1600, 3600, 3000, 0, 0, 0))
+        self.append(self.ledger, 'a@nauta.com.cu', 2000, 2600)
+        with open(self.file_route, 'rb') as file:
+            self.assertEqual(file.read(len(UsageLedger.MAGIC)), UsageLedger.MAGIC)
+        records = list(self.ledger.records())
+        self.assertEqual([record['end'] for record in records], [1600, 2600])
+        self.assertIsNone(records[0]['rx_bytes'])
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file_route = os.path.join(self.folder.name, 'session.json')
+        self.store = SessionStore(self.file_route)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_save_and_load(self):
+        self.assertIsNone(self.store.load())
+        self.store.save({'ATTRIBUTE_UUID': UUID})
+        self.assertEqual(SessionStore(self.file_route).load(), {'ATTRIBUTE_UUID': UUID})
+        self.store.load()['ATTRIBUTE_UUID'] = None  # Se devuelve una copia.
+        self.assertEqual(self.store.load(), {'ATTRIBUTE_UUID': UUID})
+
+    def test_changes_from_other_processes_are_seen(self):
+        self.store.save({'ATTRIBUTE_UUID': UUID})
+        self.store.load()
+        SessionStore(self.file_route).save({'ATTRIBUTE_UUID': None, 'username': 'otro@nauta.com.cu'})
+        self.assertEqual(self.store.load()['username'], 'otro@nauta.com.cu')
+
+    def test_invalid_file(self):
+        with open(self.file_route, 'w') as file:
+            file.write('{')
+        with self.assertRaises(ValueError):
+            self.store.load()
+        self.assertEqual(self.store.update(lambda content: {'invalid': content is None}), {'invalid': True})
+
+    def test_concurrent_updates_are_not_lost(self):
+        def work():
+            store = SessionStore(self.file_route)
+            for _ in range(50):
+                store.update(lambda content: {'count': (content or {}).get('count', 0) + 1})
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.store.load(), {'count': 200})
+        self.assertEqual(sorted(os.listdir(self.folder.name)), ['session.json', 'session.json.lock'])  # Sin temporales.
+
+
+@unittest.skipIf(logger.fcntl is None, 'flock no disponible')
+class FileLockTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.lock_route = os.path.join(self.folder.name, 'data', 'session.json.lock')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def is_locked(self, exclusive:bool) -> bool:
+        with open(self.lock_route, 'a+') as file:
+            try:
+                logger.fcntl.flock(file.fileno(), (logger.fcntl.LOCK_EX if exclusive else logger.fcntl.LOCK_SH) | logger.fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            logger.fcntl.flock(file.fileno(), logger.fcntl.LOCK_UN)
+            return False
+
+    def test_exclusive_lock(self):
+        with FileLock(self.lock_route):
+            self.assertTrue(self.is_locked(exclusive=False))
+        self.assertFalse(self.is_locked(exclusive=True))
+
+    def test_shared_lock(self):
+        with FileLock(self.lock_route, exclusive=False):
+            self.assertFalse(self.is_locked(exclusive=False))
+            self.assertTrue(self.is_locked(exclusive=True))
+
+
+class LeftTimeEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.wall = 1700000000.0
+        self.real_time = logger.time
+        logger.time = lambda: self.wall
+        self.estimator = LeftTimeEstimator(min_interval=60, max_interval=3600, tolerance=30, fraction=0.25)
+        self.estimator.clock = lambda: self.now
+
+    def tearDown(self):
+        logger.time = self.real_time
+
+    def advance(self, seconds:float) -> None:
+        self.now += seconds
+        self.wall += seconds
+
+    def test_estimate_follows_the_clock(self):
+        self.assertIsNone(self.estimator.estimate())
+        self.assertTrue(self.estimator.due())
+        self.estimator.sync(3600)
+        self.advance(600)
+        self.assertEqual(self.estimator.estimate(), 3000)
+
+    def test_next_check_is_proportional_and_bounded(self):
+        self.estimator.sync(3600)
+        self.advance(899)
+        self.assertFalse(self.estimator.due())
+        self.advance(1)
+        self.assertTrue(self.estimator.due())
+        self.estimator.reset()
+        self.estimator.sync(100)
+        self.assertEqual(self.estimator.next_check, self.now + 60)
+        self.estimator.reset()
+        self.estimator.sync(10**6)
+        self.assertEqual(self.estimator.next_check, self.now + 3600)
+
+    def test_mismatch_checks_again_soon(self):
+        self.estimator.sync(3600)
+        self.advance(600)
+        self.estimator.sync(2900)  # El servidor descontó 100 s más de lo estimado.
+        self.assertEqual(self.estimator.next_check, self.now + 60)
+
+    def test_reboot_falls_back_to_the_wall_clock(self):
+        self.estimator.sync(3600)
+        data = self.estimator.to_dict()
+        self.now = 5.0  # El equipo se reinició: el reloj monotónico empieza de nuevo.
+        self.wall += 600
+        other = LeftTimeEstimator()
+        other.clock = lambda: self.now
+        other.load(data)
+        self.assertEqual(other.estimate(), 3000)
+        self.assertTrue(other.due())
+        other.load(None)
+        self.assertIsNone(other.estimate())
+
+
+class StubLogger():
+    attribute_uuid = 'x'
+
+    def __init__(self):
+        self.logouts = 0
+
+    def logout(self, verbose=True):
+        self.logouts += 1
+        self.attribute_uuid = None
+        return 0
+
+
+class ActionSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.logger = StubLogger()
+        self.scheduler = ActionScheduler(self.logger, os.path.join(self.folder.name, 'actions.json'), max_wait=30)
+        self.real_time = logger.time
+
+    def tearDown(self):
+        logger.time = self.real_time
+        self.folder.cleanup()
+
+    def test_waits_are_bounded_by_max_wait(self):
+        self.scheduler.schedule('logout', at=self.real_time() + 3600)
+        self.assertLessEqual(self.scheduler.step(verbose=False), 30)
+
+    def test_wall_clock_deadline_survives_suspend(self):
+        action_id = self.scheduler.schedule('logout', at=self.real_time() + 600)
+        self.scheduler.step(verbose=False)
+        logger.time = lambda: self.real_time() + 900  # El reloj del sistema avanzó durante una suspensión.
+        self.assertEqual(self.scheduler.step(verbose=False), 0)
+        self.assertNotIn(action_id, self.scheduler.actions)
+        self.assertEqual(self.logger.logouts, 1)
+
+    def test_failed_action_is_retried(self):
+        def logout(verbose=True):
+            raise ConnectionError('portal caído')
+        self.logger.logout = logout
+        action_id = self.scheduler.schedule('logout', at=self.real_time() - 1)
+        self.assertEqual(self.scheduler.step(verbose=False), 0)
+        retry = ActionScheduler(self.logger, self.scheduler.file_route).actions[action_id]
+        self.assertEqual(retry['attempts'], 1)
+
+    def test_actions_are_reloaded_from_file(self):
+        action_id = self.scheduler.schedule('logout', at=self.real_time() + 600)
+        reloaded = ActionScheduler(self.logger, self.scheduler.file_route)
+        self.assertIn(action_id, reloaded.actions)
+        self.assertEqual(reloaded.cancel(action_id), 0)
+        self.assertEqual(ActionScheduler(self.logger, self.scheduler.file_route).actions, {})
+
+    def test_processes_share_the_file(self):
+        other = ActionScheduler(StubLogger(), self.scheduler.file_route)
+        first = self.scheduler.schedule('logout', at=self.real_time() + 600)
+        second = other.schedule('logout', at=self.real_time() + 1200)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.scheduler.cancel(second), 0)
+        other.step(verbose=False)
+        self.assertEqual(list(other.actions), [first])
+
+    def test_action_runs_in_one_process(self):
+        other_logger = StubLogger()
+        other = ActionScheduler(other_logger, self.scheduler.file_route)
+        self.scheduler.schedule('logout', at=self.real_time() - 1)
+        other.step(verbose=False)
+        self.assertEqual(self.scheduler.step(verbose=False), None)
+        self.assertEqual(self.logger.logouts + other_logger.logouts, 1)
+
+    def test_stale_actions_are_dropped(self):
+        action_id = self.scheduler.schedule('logout', at=self.real_time() - 3600)
+        self.scheduler.step(verbose=False)
+        self.assertNotIn(action_id, self.scheduler.actions)
+        self.assertEqual(self.logger.logouts, 0)
+
+    def test_reads_the_old_list_format(self):
+        with open(self.scheduler.file_route, 'w') as file:
+            json.dump([{'id': 3, 'action': 'logout', 'at': self.real_time() + 600, 'left_below': None, 'attempts': 0, 'retry_at': None}], file)
+        scheduler = ActionScheduler(self.logger, self.scheduler.file_route)
+        self.assertEqual(list(scheduler.actions), [3])
+        self.assertEqual(scheduler.schedule('logout', at=self.real_time() + 600), 4)
+
+
+class AccountPoolTest(unittest.TestCase):
+    USERS = ['a@nauta.com.cu', 'b@nauta.com.cu', 'c@nauta.co.cu']
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file_route = os.path.join(self.folder.name, 'accounts.json')
+        self.pool = AccountPool(self.file_route, self.USERS)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_candidates_order_and_exclusions(self):
+        self.pool.update('a@nauta.com.cu', left_time=60)
+        self.pool.update('b@nauta.com.cu', left_time=3600)
+        self.assertEqual(self.pool.candidates('internet'), ['b@nauta.com.cu', 'a@nauta.com.cu'])
+        self.pool.update('b@nauta.com.cu', error='muchos intentos', block=True)
+        self.pool.update('a@nauta.com.cu', left_time=0)
+        self.assertEqual(self.pool.candidates('internet'), [])
+        self.assertEqual(self.pool.candidates('intranet'), ['c@nauta.co.cu'])
+
+    def test_updates_from_other_processes_are_kept(self):
+        other = AccountPool(self.file_route, self.USERS)
+        self.assertIsNone(self.pool.known_left_time('a@nauta.com.cu'))  # Ambos leyeron el archivo (vacío).
+        other.update('a@nauta.com.cu', left_time=120)
+        self.pool.update('b@nauta.com.cu', left_time=300)
+        fresh = AccountPool(self.file_route, self.USERS)
+        self.assertEqual(fresh.known_left_time('a@nauta.com.cu'), 120)
+        self.assertEqual(fresh.known_left_time('b@nauta.com.cu'), 300)
+        self.assertEqual(self.pool.known_left_time('a@nauta.com.cu'), 120)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.breaker = CircuitBreaker(os.path.join(self.folder.name, 'breaker.json'), threshold=2, cooldown=60)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_opens_per_account(self):
+        self.breaker.record('a@nauta.com.cu', True)
+        self.assertTrue(self.breaker.allow('a@nauta.com.cu'))
+        self.breaker.record('a@nauta.com.cu', True)
+        self.assertFalse(self.breaker.allow('a@nauta.com.cu'))
+        self.assertGreater(self.breaker.remaining('a@nauta.com.cu'), 0)
+        self.assertTrue(self.breaker.allow('b@nauta.com.cu'))
+
+    def test_success_closes_only_that_account(self):
+        for username in ('a@nauta.com.cu', 'b@nauta.com.cu'):
+            self.breaker.record(username, True)
+        self.breaker.record('a@nauta.com.cu', False)
+        self.breaker.record('a@nauta.com.cu', True)
+        self.breaker.record('b@nauta.com.cu', True)
+        self.assertTrue(self.breaker.allow('a@nauta.com.cu'))
+        self.assertFalse(self.breaker.allow('b@nauta.com.cu'))
+
+    def test_old_single_state_is_ignored(self):
+        self.breaker.store.save({'failures': 5, 'open_until': logger.time() + 600, 'cooldown': 600})
+        self.assertTrue(self.breaker.allow('a@nauta.com.cu'))
+
+
+class ResponseCaptureTest(unittest.TestCase):
+    UUID = '0123456789ABCDEF0123456789ABCDEF'
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.capture = ResponseCapture(size=4)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_secrets_are_redacted(self):
+        body = ('<input type="hidden" name="CSRFHW" value="abc123">'
+                '<a href="/x?ATTRIBUTE_UUID=%s&loggerId=LOGGERX">salir</a>'%self.UUID).encode()
+        self.capture.record('POST', 'https://portal/LoginServlet;jsessionid=SECRETO', 200,
+                            {'Set-Cookie': 'JSESSIONID=SECRETO; Path=/', 'Content-Type': 'text/html'}, body, 0.1)
+        file_route = os.path.join(self.folder.name, 'capture.zip')
+        self.assertEqual(self.capture.dump(file_route), 1)
+        with zipfile.ZipFile(file_route) as archive:
+            content = b''.join(archive.read(name) for name in archive.namelist())
+        for secret in (b'abc123', self.UUID.encode(), b'SECRETO', b'LOGGERX'):
+            self.assertNotIn(secret, content)
+        self.assertIn(b'text/html', content)
+
+    def test_input_tags_are_redacted_in_any_form(self):
+        tags = ['<input value="%s" name="ATTRIBUTE_UUID">',
+                "<input type='hidden' name='ATTRIBUTE_UUID' value='%s'>",
+                '<INPUT\n  name = "attribute_uuid"\n  value = "%s" />',
+                '<input name=ATTRIBUTE_UUID value=%s>']
+        for tag in tags:
+            redacted = ResponseCapture.redact((tag%self.UUID).encode())
+            self.assertNotIn(self.UUID.encode(), redacted, tag)
+            self.assertIn(ResponseCapture.REDACTED.encode(), redacted)
+        other = '<input name="username" value="%s">'%self.UUID
+        self.assertEqual(ResponseCapture.redact(other.encode()), other.encode())
+
+    def test_error_dumps_are_rate_limited(self):
+        self.capture.record('GET', 'https://portal/', 200, {}, b'x', 0.1)
+        self.assertIsNotNone(self.capture.dump_on_error(self.folder.name + os.sep, 'login'))
+        self.assertIsNone(self.capture.dump_on_error(self.folder.name + os.sep, 'login'))
+
+
+@unittest.skipUnless(TrafficSampler.available(), 'requiere /proc/net/dev')
+class TrafficSamplerTest(unittest.TestCase):
+    def test_restart_leaves_one_thread(self):
+        sampler = TrafficSampler(interval=0.01)
+        self.assertTrue(sampler.start())
+        first = sampler.thread
+        sampler.stop()
+        self.assertFalse(first.is_alive())
+        self.assertTrue(sampler.start())
+        self.assertIsNot(sampler.thread, first)
+        sampler.stop()
+        self.assertFalse(sampler.running)
+
+
+class LoginResponseParserTest(unittest.TestCase):
+    def parse(self, body:bytes, chunk_size:int):
+        parser = LoginResponseParser(ERROR_MESSAGES)
+        for start in range(0, len(body), chunk_size):
+            if parser.feed(body[start:start + chunk_size]):
+                break
+        else:
+            parser.feed(b'', final=True)
+        return parser.result()
+
+    def test_attribute_uuid_split_across_chunks(self):
+        body = b'<html>' + b'x' * 500 + b'ATTRIBUTE_UUID=' + UUID.encode() + b'&CSRFHW=abc123&loggerId=LOGGERX</html>'
+        for chunk_size in (1, 7, 64, len(body)):
+            result = self.parse(body, chunk_size)
+            self.assertEqual(result.error, -1)
+            self.assertEqual(result.attribute_uuid, UUID)
+
+    def test_error_messages_in_utf8_and_latin1(self):
+        for encoding in ('utf-8', 'latin-1'):
+            body = b'<script>alert("' + ERROR_MESSAGES[6].encode(encoding) + b'")</script>'
+            for chunk_size in (3, len(body)):
+                result = self.parse(body, chunk_size)
+                self.assertEqual(result.error, 6)
+                self.assertIsNone(result.attribute_uuid)
+
+    def test_portal_tokens(self):
+        body = b'<input type="hidden" name="CSRFHW" value="abc123"><input name="wlanuserip" value="10.0.0.1">' + b' ' * 300
+        result = self.parse(body, 16)
+        self.assertEqual(result.tokens, {'CSRFHW': 'abc123', 'wlanuserip': '10.0.0.1'})
+
+    def test_unrecognized_response(self):
+        result = self.parse(b'<html>nuevo formato</html>', 4)
+        self.assertEqual((result.error, result.attribute_uuid), (-1, None))
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = PrefixIndex(['login', 'logout', 'l', 'lo', 'auto', 'a@nauta.com.cu'])
+
+    def test_resolve(self):
+        self.assertEqual(self.index.resolve('l'), 'l')
+        self.assertEqual(self.index.resolve('logi'), 'login')
+        self.assertEqual(self.index.resolve('au'), 'auto')
+        self.assertIsNone(self.index.resolve('log'))  # Ambiguo.
+        self.assertIsNone(self.index.resolve('x'))
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete('lo'), ['lo', 'login', 'logout'])
+        self.assertEqual(self.index.complete('a'), ['a@nauta.com.cu', 'auto'])
+        self.assertEqual(self.index.complete('z'), [])
+        self.assertEqual(len(self.index.complete('')), 6)
+
+    def test_contains_and_len(self):
+        self.index.add('login')
+        self.assertEqual(len(self.index), 6)
+        self.assertIn('lo', self.index)
+        self.assertNotIn('log', self.index)
+
+
+
+class CommandRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = CommandRegistry()
+        for names, abbrev in ((('l', 'login'), False), (('lo', 'logout'), False), (('auto',), False),
+                              (('report',), True), (('h', 'help'), True)):
+            self.registry.command(*names, abbrev=abbrev)(lambda logger, args, interactive: 0)
+
+    def test_full_names(self):
+        self.assertEqual(self.registry.find('login').names, ('l', 'login'))
+        self.assertEqual(self.registry.find('lo').names, ('lo', 'logout'))
+        self.assertEqual(self.registry.find('auto').names, ('auto',))
+
+    def test_prefix_only_for_abbrev_commands(self):
+        self.assertEqual(self.registry.find('rep').names, ('report',))
+        self.assertEqual(self.registry.find('hel').names, ('h', 'help'))
+        self.assertIsNone(self.registry.find('a'))
+        self.assertIsNone(self.registry.find('logo'))
+        self.assertEqual(self.registry.find('a', any_prefix=True).names, ('auto',))
+
+if __name__ == '__main__':
+    unittest.main()
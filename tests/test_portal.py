@@ -0,0 +1,300 @@
+import asyncio
+import importlib.util
+import os
+import shutil
+import sys
+import threading
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import logger
+
+
+class PortalTestCase(unittest.TestCase):
+    '''Pruebas contra el portal simulado de benchmark.py, con una carpeta de datos temporal por prueba.'''
+    base = logger.EtecsaLogger
+    options = 'query_retries = 0\n'
+
+    def setUp(self):
+        self.portal = benchmark.MockPortal().start()
+        self.portal.server.handle_error = lambda request, address: None  # Sin trazas de las conexiones cortadas a propósito.
+        self.Logger = benchmark.make_logger_class(self.portal.url, self.base)
+        with open(self.Logger.config_file, 'a') as file:
+            file.write(self.options)
+
+    def tearDown(self):
+        self.portal.stop()
+        shutil.rmtree(self.Logger.logger_data_folder, ignore_errors=True)
+
+    def break_queries(self) -> None:
+        '''Hace que el portal corte la conexión al recibir la consulta del tiempo restante.'''
+        def query(data):
+            raise ConnectionResetError
+        self.portal.query = query
+
+
+class LoginTest(PortalTestCase):
+    def test_login_and_logout(self):
+        client = self.Logger()
+        self.assertEqual(client.login(verbose=False), 0)
+        self.assertEqual(client.initial_left_time, '10:00:00')
+        self.assertEqual(self.Logger().logout(verbose=False), 0)
+        self.assertEqual(self.portal.sessions, {})
+
+    def test_failed_query_keeps_the_session(self):
+        self.break_queries()
+        client = self.Logger()
+        self.assertEqual(client.login(verbose=False), 0)
+        self.assertEqual(client.initial_left_time, '??:??:??')
+        self.assertEqual(client.session_store.load()['ATTRIBUTE_UUID'], client.attribute_uuid)
+        self.assertEqual(self.Logger().logout(verbose=False), 0)
+
+    @unittest.skipIf(importlib.util.find_spec('yaml') is None, 'PyYAML no instalado')
+    def test_yaml_session_is_migrated(self):
+        old_file = self.Logger.logger_data_folder + 'internet_session.yml'
+        with open(old_file, 'w') as file:
+            file.write('ATTRIBUTE_UUID: ABC123\nconnection_type: internet\ninitial_left_time: 01:00:00\n'
+                       'session_start_time: \'2024-01-01 10:00:00\'\n')
+        client = self.Logger()
+        client._load_session_data()
+        self.assertEqual(client.attribute_uuid, 'ABC123')
+        self.assertEqual(client.session_start_time, datetime(2024, 1, 1, 10))
+        self.assertFalse(os.path.exists(old_file))
+        self.assertEqual(client.session_store.load()['initial_left_time'], '01:00:00')
+
+    def test_connection_check_is_shared(self):
+        self.Logger()._remember_connection('intranet')
+        client = self.Logger()
+        self.assertEqual(client._cached_connection(5), (True, 'intranet'))
+        self.assertEqual(client._cached_connection(0), (False, None))
+        self.assertEqual(client.login(verbose=False), 0)
+        self.assertEqual(self.Logger()._cached_connection(5), (False, None))
+        self.assertEqual(client.logout(verbose=False), 0)
+
+
+
+
+class WatchdogTest(PortalTestCase):
+    options = 'query_retries = 0\nwatchdog_min_interval = 0.05\nwatchdog_max_interval = 0.05\nwatchdog_backoff = 0.01\n'
+
+    def setUp(self):
+        super().setUp()
+        portal = self.portal
+        class Logger(self.Logger):
+            def _check_connection(self, *args, **kwargs):
+                return 'internet' if self.attribute_uuid in portal.sessions else None  # Hay internet mientras dure la sesión.
+        self.Logger = Logger
+
+    def start(self, client) -> threading.Thread:
+        thread = threading.Thread(target=client.watchdog, kwargs={'verbose': False}, daemon=True)
+        thread.start()
+        return thread
+
+    def test_stops_after_logout_from_another_process(self):
+        client = self.Logger()
+        self.assertEqual(client.login(verbose=False), 0)
+        thread = self.start(client)
+        self.assertEqual(self.Logger().logout(verbose=False), 0)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.portal.sessions, {})
+
+    def test_survives_unexpected_errors(self):
+        client = self.Logger()
+        calls = []
+        def check(*args, **kwargs):
+            calls.append(1)
+            if len(calls) >= 3:
+                client.stop_watchdog()
+            raise RuntimeError('fallo')
+        client._check_connection = check
+        thread = self.start(client)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertGreaterEqual(len(calls), 3)
+
+class AsyncHTTPClientTest(unittest.TestCase):
+    def setUp(self):
+        self.portal = benchmark.MockPortal().start()
+        self.portal.server.handle_error = lambda request, address: None
+
+    def tearDown(self):
+        self.portal.stop()
+
+    def run_client(self, function):
+        '''Ejecuta function(cliente) en un bucle de eventos nuevo. Devuelve (resultado, conexiones guardadas).'''
+        async def run():
+            client = logger.AsyncHTTPClient()
+            try:
+                result = await function(client)
+                host, port = self.portal.server.server_address[:2]
+                return result, list(client.idle.get(('http', host, port), []))
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
+    def test_keep_alive_connection_is_reused(self):
+        async def requests(client):
+            await client.get(self.portal.url + '/')
+            first = list(client.idle.values())[0][0]
+            response = await client.post(self.portal.url + '/EtecsaQueryServlet', {'op': 'getLeftTime'})
+            return first, response
+        (first, response), idle = self.run_client(requests)
+        self.assertEqual(response.text, 'errorop')
+        self.assertEqual(idle, [first])
+
+    def test_chunked_body(self):
+        self.portal.chunked = True
+        response, idle = self.run_client(lambda client: client.get(self.portal.url + '/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('name="CSRFHW"', response.text)
+        self.assertTrue(response.text.endswith('</html>'))
+        self.assertEqual(len(idle), 1)
+
+    def test_redirects(self):
+        response, _ = self.run_client(lambda client: client.get(self.portal.url + '/user_login.jsp'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.url, self.portal.url + '/')
+        response, _ = self.run_client(lambda client: client.get(self.portal.url + '/user_login.jsp', max_redirects=0))
+        self.assertEqual(response.status_code, 302)
+
+    def test_malformed_chunk_raises_value_error(self):
+        def reply(handler, body, status=200, headers=None):
+            handler.send_response(status)
+            handler.send_header('Transfer-Encoding', 'chunked')
+            handler.end_headers()
+            handler.wfile.write(b'zz\r\nx\r\n0\r\n\r\n')  # El tamaño del fragmento no es hexadecimal.
+        original = benchmark.MockPortalHandler._MockPortalHandler__reply
+        benchmark.MockPortalHandler._MockPortalHandler__reply = reply
+        try:
+            with self.assertRaises(ValueError):
+                self.run_client(lambda client: client.get(self.portal.url + '/'))
+        finally:
+            benchmark.MockPortalHandler._MockPortalHandler__reply = original
+
+
+class AsyncLoginTest(PortalTestCase):
+    base = logger.AsyncEtecsaLogger
+
+    def run_client(self, function):
+        async def run():
+            client = self.Logger()
+            try:
+                return client, await function(client)
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
+    def test_login_and_logout(self):
+        client, code = self.run_client(lambda client: client.login(verbose=False))
+        self.assertEqual(code, 0)
+        self.assertEqual(client.initial_left_time, '10:00:00')
+        _, code = self.run_client(lambda client: client.logout(verbose=False))
+        self.assertEqual(code, 0)
+
+    def test_failed_query_keeps_the_session(self):
+        self.break_queries()
+        client, code = self.run_client(lambda client: client.login(verbose=False))
+        self.assertEqual(code, 0)
+        self.assertEqual(client.initial_left_time, '??:??:??')
+        self.assertEqual(client.session_store.load()['ATTRIBUTE_UUID'], client.attribute_uuid)
+
+    def test_scheduled_actions_are_refused(self):
+        client = self.Logger()
+        self.assertEqual(client.schedule(['lo', '23:59'], verbose=False), 1)
+        with self.assertRaises(NotImplementedError):
+            client.scheduler
+
+
+class DaemonTest(PortalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.socket_path = self.Logger.logger_data_folder + 'logger.sock'
+        self.daemon = logger.ControlDaemon(self.Logger(), self.socket_path)
+        self.thread = threading.Thread(target=self.daemon.serve, kwargs={'verbose': False})
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            threading.Event().wait(0.01)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            self.request('shutdown')
+        self.thread.join(5)
+        super().tearDown()
+
+    def request(self, op:str, *args:str) -> dict:
+        return logger.daemon_request(self.socket_path, op, list(args), timeout=5)
+
+    def test_protocol(self):
+        self.assertEqual(self.request('status')['code'], 0)
+        response = self.request('unknown')
+        self.assertEqual(response['code'], 1)
+        self.assertIn('shutdown', response['message'])
+        self.assertEqual(self.request('shutdown')['code'], 0)
+        self.thread.join(5)
+        self.assertFalse(os.path.exists(self.socket_path))
+        with self.assertRaises(logger.DaemonUnavailable):
+            self.request('status')
+
+    def test_login_stores_the_username(self):
+        self.assertEqual(self.request('login')['code'], 0)
+        session = self.Logger().session_store.load()
+        self.assertEqual(session['username'], 'bench@nauta.com.cu')
+        self.assertEqual(list(self.portal.sessions.values()), ['bench@nauta.com.cu'])
+        self.assertEqual(self.request('logout')['code'], 0)
+        self.assertEqual(self.portal.sessions, {})
+
+    def test_failing_step_keeps_serving(self):
+        calls = []
+        def step(verbose=True):
+            calls.append(verbose)
+            if len(calls) == 1:
+                raise ConnectionError('portal caído')
+            return 0.05
+        self.daemon.logger.scheduler.max_backoff = 0.05
+        self.daemon.logger.scheduler.step = step
+        self.assertEqual(self.request('status')['code'], 0)  # Despierta al demonio, que espera la próxima acción.
+        threading.Event().wait(0.2)
+        self.assertGreater(len(calls), 1)
+        self.assertTrue(self.thread.is_alive())
+        self.assertEqual(self.request('status')['code'], 0)
+
+    def test_config_changes_are_reloaded(self):
+        client = self.Logger()
+        client.config['USERS']['other@nauta.com.cu'] = 'other'
+        client._use_account('other@nauta.com.cu', persist=True)
+        self.assertEqual(self.request('login')['code'], 0)
+        self.assertEqual(list(self.portal.sessions.values()), ['other@nauta.com.cu'])
+        self.assertEqual(self.request('logout')['code'], 0)
+
+    def test_session_username_is_restored(self):
+        client = self.Logger()
+        client.config['USERS']['other@nauta.com.cu'] = 'other'
+        client._use_account('other@nauta.com.cu', persist=True)
+        self.assertEqual(client.login(verbose=False), 0)
+        client._use_account('bench@nauta.com.cu', persist=True)  # Se elige otra cuenta con la sesión abierta.
+        self.assertEqual(self.request('logout')['code'], 0)
+        self.assertEqual(self.portal.sessions, {})
+
+    def test_schedule_is_forwarded(self):
+        command = logger.commands.find('sched')
+        self.assertIsNone(command.remote(['run']))
+        op, args = command.remote(['lo', '23:59'])
+        self.assertEqual(self.request(op, *args)['code'], 0)
+        self.assertEqual(len(self.Logger().scheduler.actions), 1)
+        op, args = logger.commands.find('cancel').remote(['1'])
+        self.assertEqual(self.request(op, *args)['code'], 0)
+        self.assertEqual(self.Logger().scheduler.actions, {})
+        self.assertIn('ya ejecuta', self.request('schedule', 'run')['message'])
+
+    def test_pool_is_forwarded(self):
+        op, args = logger.commands.find('pool').remote([])
+        self.assertEqual(self.request(op, *args)['code'], 0)
+
+if __name__ == '__main__':
+    unittest.main()